@@ -1,17 +1,85 @@
+import asyncio
+import logging
 import os
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
 from dotenv import load_dotenv
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from sqlmodel import SQLModel
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Optional
 load_dotenv()
 
-DATABASE_URL = os.getenv("DATABASE_URL")
+logger = logging.getLogger(__name__)
+
+
+def _env_bool(nombre: str, por_defecto: bool) -> bool:
+    valor = os.getenv(nombre)
+    if valor is None:
+        return por_defecto
+    return valor.strip().lower() in ("1", "true", "si", "sí", "yes", "on")
+
+
+@dataclass(frozen=True)
+class ConfiguracionDB:
+    """Parámetros del engine y del pool, leídos del entorno / .env."""
+    url: str
+    url_lectura: Optional[str] = None
+    echo: bool = False
+    pool_size: int = 10
+    max_overflow: int = 20
+    pool_timeout: float = 30.0
+    pool_recycle: int = 1800
+    pool_pre_ping: bool = True
+    statement_cache_size: int = 100
+    lectura_retraso_maximo: float = 10.0
+    lectura_intervalo_chequeo: float = 5.0
+
+    @classmethod
+    def desde_entorno(cls) -> "ConfiguracionDB":
+        return cls(
+            url=os.getenv("DATABASE_URL"),
+            url_lectura=os.getenv("DATABASE_READ_URL") or None,
+            echo=_env_bool("DB_ECHO", False),
+            pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+            max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "20")),
+            pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+            pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+            pool_pre_ping=_env_bool("DB_POOL_PRE_PING", True),
+            statement_cache_size=int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100")),
+            lectura_retraso_maximo=float(os.getenv("DB_READ_MAX_LAG", "10")),
+            lectura_intervalo_chequeo=float(os.getenv("DB_READ_CHECK_INTERVAL", "5")),
+        )
+
+    def argumentos_engine(self, url: Optional[str] = None) -> dict:
+        """Argumentos de create_async_engine para `url` (por defecto, la primaria)."""
+        url = make_url(url or self.url)
+        argumentos = {"echo": self.echo, "future": True, "pool_pre_ping": self.pool_pre_ping}
+
+        # SQLite en memoria usa un pool de una sola conexión que no acepta tamaño ni overflow
+        if not (url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")):
+            argumentos.update(
+                pool_size=self.pool_size,
+                max_overflow=self.max_overflow,
+                pool_timeout=self.pool_timeout,
+                pool_recycle=self.pool_recycle,
+            )
+
+        if url.get_driver_name() == "asyncpg":
+            argumentos["connect_args"] = {"prepared_statement_cache_size": self.statement_cache_size}
+        return argumentos
+
+
+configuracion_db = ConfiguracionDB.desde_entorno()
+DATABASE_URL = configuracion_db.url
 
 async_engine = create_async_engine(
     DATABASE_URL,
-    echo=True,
-    future=True,
+    **configuracion_db.argumentos_engine(),
 )
 AsyncSessionLocal = sessionmaker(
     bind=async_engine,
@@ -19,10 +87,160 @@ AsyncSessionLocal = sessionmaker(
     expire_on_commit=False,
 )
 
-async def init_db():
-    async with async_engine.begin() as conn:
-        await conn.run_sync(SQLModel.metadata.create_all)
+
+# === RÉPLICA DE LECTURA (opcional, DATABASE_READ_URL) ===
+read_engine = (
+    create_async_engine(configuracion_db.url_lectura, **configuracion_db.argumentos_engine(configuracion_db.url_lectura))
+    if configuracion_db.url_lectura else None
+)
+AsyncSessionLectura = sessionmaker(
+    bind=read_engine,
+    class_=AsyncSession,
+    expire_on_commit=False,
+) if read_engine is not None else None
+
+# Segundos que la réplica lleva sin aplicar lo que ya recibió de la primaria (0 si está al día
+# o si la base de datos no es una réplica)
+_RETRASO_POSTGRES = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+def _describir(error: Exception) -> str:
+    """Tipo y primera línea del error (los de SQLAlchemy agregan un enlace en otra línea)."""
+    mensaje = str(error).splitlines()[0] if str(error) else ""
+    return f"{type(error).__name__}: {mensaje}" if mensaje else type(error).__name__
+
+
+class RutaLectura:
+    """
+    Decide si una sesión de solo lectura va a la réplica o a la primaria.
+
+    El estado de la réplica (si responde y cuánto retraso lleva) se revisa como mucho una vez cada
+    `intervalo` segundos; entre revisiones se usa el último resultado, así que elegir la ruta no
+    agrega consultas a la petición. Si la réplica no responde, falla una consulta por la conexión
+    o su retraso pasa de `retraso_maximo`, las lecturas van a la primaria hasta la siguiente revisión.
+    En PostgreSQL el retraso sale de pg_last_xact_replay_timestamp(); con otros motores (p. ej. dos
+    archivos SQLite en desarrollo) solo se comprueba que la réplica responda.
+    """
+
+    def __init__(self, engine, retraso_maximo: float = 10.0, intervalo: float = 5.0, timeout: float = 2.0):
+        self.engine = engine
+        self.retraso_maximo = retraso_maximo
+        self.intervalo = intervalo
+        self.timeout = timeout
+        self.disponible = False
+        self.retraso: Optional[float] = None
+        self.error: Optional[str] = None
+        self.lecturas_replica = 0
+        self.lecturas_primaria = 0
+        self._revisada_en: Optional[float] = None
+        self._candado = asyncio.Lock()
+
+    @property
+    def configurada(self) -> bool:
+        return self.engine is not None
+
+    async def usar_replica(self) -> bool:
+        if not self.configurada:
+            return False
+        vencida = self._revisada_en is None or time.monotonic() - self._revisada_en >= self.intervalo
+        # Si otra petición ya está revisando, esta usa el resultado anterior en vez de esperar
+        if vencida and not self._candado.locked():
+            async with self._candado:
+                await self.revisar()
+        return self.disponible
+
+    async def revisar(self):
+        try:
+            self.retraso = await asyncio.wait_for(self._medir_retraso(), timeout=self.timeout)
+            self.error = None if self.retraso <= self.retraso_maximo else f"retraso de {self.retraso:.1f} s"
+        except Exception as e:
+            self.retraso = None
+            self.error = _describir(e)
+        self._cambiar_estado(self.error is None)
+
+    async def _medir_retraso(self) -> float:
+        async with self.engine.connect() as conn:
+            if conn.dialect.name == "postgresql":
+                return float(await conn.scalar(_RETRASO_POSTGRES))
+            await conn.execute(text("SELECT 1"))
+            return 0.0
+
+    def marcar_caida(self, error: Exception):
+        """Una consulta falló por la conexión: lecturas a la primaria hasta la siguiente revisión."""
+        self.error = _describir(error)
+        self._cambiar_estado(False)
+
+    def _cambiar_estado(self, disponible: bool):
+        self._revisada_en = time.monotonic()
+        if disponible != self.disponible:
+            if disponible:
+                logger.info("Réplica de lectura disponible (retraso %.1f s)", self.retraso or 0)
+            else:
+                logger.warning("Réplica de lectura no disponible, lecturas a la primaria: %s", self.error)
+        self.disponible = disponible
+
+    def estadisticas(self) -> dict:
+        return {
+            "configurada": self.configurada,
+            "disponible": int(self.disponible),
+            "retraso_segundos": self.retraso,
+            "retraso_maximo": self.retraso_maximo,
+            "lecturas_replica": self.lecturas_replica,
+            "lecturas_primaria": self.lecturas_primaria,
+            "error": self.error,
+        }
+
+
+ruta_lectura = RutaLectura(
+    read_engine,
+    retraso_maximo=configuracion_db.lectura_retraso_maximo,
+    intervalo=configuracion_db.lectura_intervalo_chequeo,
+)
+
 
 async def get_session() -> AsyncGenerator[AsyncSession, None]:
     async with AsyncSessionLocal() as session:
-        yield session
\ No newline at end of file
+        yield session
+
+@asynccontextmanager
+async def abrir_sesion_lectura(primaria: bool = False) -> AsyncGenerator[AsyncSession, None]:
+    """
+    Sesión para consultas que no escriben: en la réplica si está disponible, si no en la primaria.
+    primaria=True fuerza la primaria (p. ej. para leer algo que se acaba de escribir).
+    """
+    replica = not primaria and await ruta_lectura.usar_replica()
+    if replica:
+        ruta_lectura.lecturas_replica += 1
+    else:
+        ruta_lectura.lecturas_primaria += 1
+
+    async with (AsyncSessionLectura if replica else AsyncSessionLocal)() as session:
+        try:
+            yield session
+        except DBAPIError as e:
+            # Conexión caída o consulta cancelada por la réplica (p. ej. conflicto con la recuperación)
+            if replica and (e.connection_invalidated or isinstance(e, (OperationalError, InterfaceError))):
+                ruta_lectura.marcar_caida(e)
+            raise
+
+async def get_session_lectura() -> AsyncGenerator[AsyncSession, None]:
+    """Dependencia de FastAPI para listados, búsquedas, historiales y reportes."""
+    async with abrir_sesion_lectura() as session:
+        yield session
+
+def estado_pool(engine=None) -> dict:
+    """Conexiones del pool (por defecto, el de la primaria): en reposo (checked-in), en uso (checked-out) y overflow."""
+    pool = (engine or async_engine).pool
+    estado = {"pool": type(pool).__name__}
+    for clave, metodo in (
+        ("tamano", "size"),
+        ("checked_in", "checkedin"),
+        ("checked_out", "checkedout"),
+        ("overflow", "overflow"),
+    ):
+        if hasattr(pool, metodo):
+            estado[clave] = getattr(pool, metodo)()
+    return estado
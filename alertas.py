@@ -0,0 +1,67 @@
+"""
+Canal de alertas de stock bajo para Server-Sent Events.
+
+operations.py publica un evento cuando una venta o un descuento de stock deja un producto por
+debajo de su stock_minimo (solo al cruzar el umbral, no en cada venta posterior) y cada
+navegador conectado a /alertas/stock/stream lo recibe sin tener que volver a consultar el catálogo.
+
+Cada suscriptor tiene una cola acotada: si un cliente no lee, se descartan sus eventos más
+viejos en vez de acumular memoria o frenar la venta. El canal es por proceso; con varios
+workers cada uno avisa a los clientes conectados a él.
+"""
+import asyncio
+import json
+from typing import AsyncIterator, Optional, Set
+
+INTERVALO_KEEPALIVE = 15.0
+
+
+class CanalAlertas:
+
+    def __init__(self, max_pendientes: int = 100):
+        self.max_pendientes = max_pendientes
+        self.publicados = 0
+        self.descartados = 0
+        self._suscriptores: Set[asyncio.Queue] = set()
+
+    def suscribir(self) -> asyncio.Queue:
+        cola = asyncio.Queue(maxsize=self.max_pendientes)
+        self._suscriptores.add(cola)
+        return cola
+
+    def cancelar(self, cola: asyncio.Queue):
+        self._suscriptores.discard(cola)
+
+    def publicar(self, evento: dict):
+        """No bloquea: se llama después del commit, dentro de la petición que descontó el stock."""
+        self.publicados += 1
+        for cola in self._suscriptores:
+            if cola.full():
+                cola.get_nowait()
+                self.descartados += 1
+            cola.put_nowait(evento)
+
+    async def eventos(self, intervalo_keepalive: float = INTERVALO_KEEPALIVE) -> AsyncIterator[str]:
+        """Genera el stream SSE de un cliente; el comentario periódico mantiene viva la conexión."""
+        cola = self.suscribir()
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    evento: Optional[dict] = await asyncio.wait_for(cola.get(), timeout=intervalo_keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: stock_bajo\ndata: {json.dumps(evento, ensure_ascii=False)}\n\n"
+        finally:
+            self.cancelar(cola)
+
+    def estadisticas(self) -> dict:
+        return {
+            "suscriptores": len(self._suscriptores),
+            "publicados": self.publicados,
+            "descartados": self.descartados,
+        }
+
+
+canal_alertas = CanalAlertas()
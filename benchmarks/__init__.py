@@ -0,0 +1 @@
+"""Benchmarks de carga de la tienda; ver benchmarks/__main__.py."""
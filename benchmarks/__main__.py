@@ -0,0 +1,247 @@
+"""
+Benchmark de los endpoints más usados de la tienda.
+
+Siembra una base de datos local, levanta la app real en proceso (lifespan + cliente ASGI de
+httpx, sin servidor ni red) y mide cada escenario: latencia p50/p95/p99, peticiones por
+segundo y consultas SQL por petición (contadas por metricas.py). Compara contra
+benchmarks/baseline.json y termina con código 1 si algún escenario empeoró: por defecto solo en
+consultas por petición y errores, que no dependen de la máquina. Los tiempos del baseline se
+tomaron en una máquina concreta; --comparar-latencia también compara el p50 y solo tiene
+sentido en el mismo hardware en que se generó el baseline.
+
+Uso (desde la raíz del repositorio):
+    pip install -r benchmarks/requirements.txt
+    python -m benchmarks [--productos 5000] [--peticiones 200] [--concurrencia 1]
+    python -m benchmarks --actualizar-baseline
+    python -m benchmarks --db-url postgresql+asyncpg://.../bench --recrear
+
+Con --db-url la base de datos se borra y se vuelve a crear (--recrear es obligatorio);
+no la apunte a una base de datos con datos reales.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(RAIZ, "benchmarks", "baseline.json")
+if RAIZ not in sys.path:
+    sys.path.insert(0, RAIZ)
+
+from benchmarks.datos import Volumenes  # noqa: E402
+from benchmarks.escenarios import ESCENARIOS  # noqa: E402
+
+
+def percentil(valores_ordenados: list, p: float) -> float:
+    """Percentil por rango más cercano."""
+    if not valores_ordenados:
+        return 0.0
+    indice = max(0, math.ceil(p / 100 * len(valores_ordenados)) - 1)
+    return valores_ordenados[indice]
+
+
+async def medir(cliente, escenario, rng, datos, peticiones: int, concurrencia: int, calentamiento: int) -> dict:
+    from metricas import metricas
+
+    async def hacer():
+        inicio = time.perf_counter()
+        respuesta = await cliente.request(escenario.metodo, **escenario.armar(rng, datos))
+        return time.perf_counter() - inicio, respuesta.status_code < 400
+
+    for _ in range(calentamiento):
+        await hacer()
+
+    clave = (escenario.metodo, escenario.ruta)
+    antes = metricas.resumen_rutas().get(clave, {"peticiones": 0, "consultas": 0, "segundos_db": 0.0})
+    n_mas_1_antes = metricas.n_mas_1.get(clave, 0)
+
+    latencias, errores = [], 0
+    pendientes = iter(range(peticiones))
+
+    async def trabajador():
+        nonlocal errores
+        for _ in pendientes:
+            segundos, ok = await hacer()
+            latencias.append(segundos)
+            errores += not ok
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(trabajador() for _ in range(concurrencia)))
+    total = time.perf_counter() - inicio
+
+    despues = metricas.resumen_rutas().get(clave, antes)
+    atendidas = despues["peticiones"] - antes["peticiones"]
+    latencias.sort()
+    return {
+        "peticiones": len(latencias),
+        "errores": errores,
+        "p50_ms": round(percentil(latencias, 50) * 1000, 3),
+        "p95_ms": round(percentil(latencias, 95) * 1000, 3),
+        "p99_ms": round(percentil(latencias, 99) * 1000, 3),
+        "peticiones_por_segundo": round(len(latencias) / total, 1) if total else 0.0,
+        "consultas_por_peticion": round((despues["consultas"] - antes["consultas"]) / atendidas, 2) if atendidas else 0.0,
+        "db_ms_por_peticion": round((despues["segundos_db"] - antes["segundos_db"]) / atendidas * 1000, 3) if atendidas else 0.0,
+        "n_mas_1": metricas.n_mas_1.get(clave, 0) - n_mas_1_antes,
+    }
+
+
+def comparar(resultados: dict, baseline: dict, tolerancia: float, latencia: bool = False) -> list:
+    """
+    Regresiones contra el baseline: más consultas por petición (eso no depende de la máquina,
+    solo se deja margen para el azar de los escenarios) o errores nuevos. Con latencia=True,
+    también un p50 más de `tolerancia` por encima (el p95 de pocas peticiones varía demasiado
+    entre corridas); solo sirve si el baseline se tomó en el mismo hardware.
+    """
+    regresiones = []
+    for nombre, actual in resultados["escenarios"].items():
+        base = baseline.get("escenarios", {}).get(nombre)
+        if not base:
+            continue
+        if latencia and actual["p50_ms"] > base["p50_ms"] * (1 + tolerancia):
+            regresiones.append(f"{nombre}: p50 {actual['p50_ms']} ms (baseline {base['p50_ms']} ms)")
+        if actual["consultas_por_peticion"] > base["consultas_por_peticion"] + 0.5:
+            regresiones.append(
+                f"{nombre}: {actual['consultas_por_peticion']} consultas/petición "
+                f"(baseline {base['consultas_por_peticion']})"
+            )
+        if actual["errores"] > base.get("errores", 0):
+            regresiones.append(f"{nombre}: {actual['errores']} errores (baseline {base.get('errores', 0)})")
+    return regresiones
+
+
+async def ejecutar(args, volumenes: Volumenes) -> dict:
+    # La app se importa después de fijar DATABASE_URL: DBengine crea el engine al importarse
+    import httpx
+    from sqlmodel import SQLModel
+    import main
+    import migraciones
+    from DBengine import AsyncSessionLocal, async_engine
+    from benchmarks.datos import sembrar
+
+    rng = random.Random(args.semilla)
+    try:
+        async with async_engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.drop_all)
+        await migraciones.migrar(async_engine)
+
+        inicio = time.perf_counter()
+        async with AsyncSessionLocal() as session:
+            datos = await sembrar(session, volumenes, rng)
+        print(f"Datos sembrados en {time.perf_counter() - inicio:.1f}s: {volumenes.como_dict()}")
+
+        resultados = {
+            "volumenes": volumenes.como_dict(),
+            "peticiones": args.peticiones,
+            "concurrencia": args.concurrencia,
+            "motor": async_engine.dialect.name,
+            "escenarios": {},
+        }
+        async with main.app.router.lifespan_context(main.app):
+            transporte = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transporte, base_url="http://bench") as cliente:
+                for nombre in args.escenarios:
+                    resultado = await medir(
+                        cliente, ESCENARIOS[nombre], rng, datos,
+                        args.peticiones, args.concurrencia, args.calentamiento
+                    )
+                    resultados["escenarios"][nombre] = resultado
+                    print(
+                        f"{nombre:<22} p50 {resultado['p50_ms']:>8.2f} ms  p95 {resultado['p95_ms']:>8.2f} ms  "
+                        f"p99 {resultado['p99_ms']:>8.2f} ms  {resultado['peticiones_por_segundo']:>7.1f} req/s  "
+                        f"{resultado['consultas_por_peticion']:>5.1f} consultas/req  errores {resultado['errores']}"
+                    )
+        return resultados
+    finally:
+        await async_engine.dispose()
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="Benchmark de los endpoints de la tienda")
+    defecto = Volumenes()
+    parser.add_argument("--categorias", type=int, default=defecto.categorias)
+    parser.add_argument("--productos", type=int, default=defecto.productos)
+    parser.add_argument("--clientes", type=int, default=defecto.clientes)
+    parser.add_argument("--proveedores", type=int, default=defecto.proveedores)
+    parser.add_argument("--compras", type=int, default=defecto.compras)
+    parser.add_argument("--peticiones", type=int, default=200, help="peticiones medidas por escenario")
+    parser.add_argument("--concurrencia", type=int, default=1, help="peticiones en paralelo")
+    parser.add_argument("--calentamiento", type=int, default=10, help="peticiones sin medir antes de cada escenario")
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--escenarios", nargs="+", choices=sorted(ESCENARIOS), default=list(ESCENARIOS))
+    parser.add_argument("--db-url", help="base de datos a usar (por defecto, SQLite en un directorio temporal)")
+    parser.add_argument("--recrear", action="store_true", help="confirma que --db-url se puede borrar")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--actualizar-baseline", action="store_true", help="guarda estos resultados como baseline")
+    parser.add_argument(
+        "--comparar-latencia", action="store_true",
+        help="también falla si el p50 empeora (solo en el hardware donde se generó el baseline)"
+    )
+    parser.add_argument("--tolerancia", type=float, default=0.5, help="margen sobre el p50 del baseline (0.5 = 50%%)")
+    parser.add_argument("--salida", help="archivo JSON donde guardar los resultados")
+    args = parser.parse_args()
+
+    if args.db_url and not args.recrear:
+        parser.error("--db-url borra y recrea todas las tablas; agregue --recrear para confirmarlo")
+
+    volumenes = Volumenes(
+        categorias=args.categorias, productos=args.productos, clientes=args.clientes,
+        proveedores=args.proveedores, compras=args.compras,
+    )
+
+    # La app escribe recibos y plantillas relativas al directorio actual: se trabaja en una
+    # copia temporal para no tocar ventas_txt/ ni compras_txt/ del repositorio
+    directorio = tempfile.mkdtemp(prefix="bench_tienda_")
+    for carpeta in ("static", "templates"):
+        shutil.copytree(os.path.join(RAIZ, carpeta), os.path.join(directorio, carpeta))
+    os.environ["DATABASE_URL"] = args.db_url or f"sqlite+aiosqlite:///{os.path.join(directorio, 'bench.db')}"
+    os.environ["DB_ECHO"] = "false"
+    logging.getLogger("metricas").setLevel(logging.ERROR)
+    directorio_original = os.getcwd()
+    os.chdir(directorio)
+
+    try:
+        resultados = asyncio.run(ejecutar(args, volumenes))
+    finally:
+        os.chdir(directorio_original)
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2)
+
+    if args.actualizar_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2)
+            f.write("\n")
+        print(f"Baseline guardado en {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print("No hay baseline; use --actualizar-baseline para crearlo")
+        return
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if (baseline.get("volumenes"), baseline.get("concurrencia"), baseline.get("motor")) != (
+        resultados["volumenes"], resultados["concurrencia"], resultados["motor"]
+    ):
+        print("El baseline se tomó con otros volúmenes, concurrencia o motor; no se compara")
+        return
+
+    regresiones = comparar(resultados, baseline, args.tolerancia, args.comparar_latencia)
+    if regresiones:
+        print("Regresiones contra el baseline:")
+        for regresion in regresiones:
+            print(f"  - {regresion}")
+        sys.exit(1)
+    print("Sin regresiones contra el baseline")
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,103 @@
+"""Datos de prueba para los benchmarks: se cargan con INSERT multi-fila, sin pasar por la API."""
+import random
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from modelSQL import Categoria, Producto, Cliente, Proveedor, Compra, Detalle_Compra
+
+PALABRAS = (
+    "mecha", "vela", "aroma", "canela", "vainilla", "lavanda", "coco", "menta", "rosa", "cafe",
+    "mango", "limon", "naranja", "miel", "sandalo", "jazmin", "eucalipto", "chocolate", "pino", "cereza",
+)
+TAMANO_LOTE = 1000
+# Stock alto para que las ventas del benchmark nunca fallen por falta de unidades
+STOCK_INICIAL = 1_000_000
+
+
+@dataclass(frozen=True)
+class Volumenes:
+    categorias: int = 10
+    productos: int = 5000
+    clientes: int = 1000
+    proveedores: int = 20
+    compras: int = 2000
+    detalles_por_compra: int = 3
+
+    def como_dict(self) -> dict:
+        return asdict(self)
+
+
+@dataclass
+class DatosSembrados:
+    """Lo que los escenarios necesitan para armar peticiones válidas."""
+    ids_productos: list
+    palabras: tuple
+    ids_clientes: list
+    nits: list
+    paginas_compras: int
+
+
+async def _insertar(session: AsyncSession, modelo, filas: list):
+    for i in range(0, len(filas), TAMANO_LOTE):
+        await session.execute(insert(modelo), filas[i:i + TAMANO_LOTE])
+
+
+async def sembrar(session: AsyncSession, volumenes: Volumenes, rng: random.Random) -> DatosSembrados:
+    """Carga categorías, productos, clientes, proveedores y compras con sus detalles (tablas vacías)."""
+    await _insertar(session, Categoria, [
+        {"id_categoria": i, "tipo": f"Categoria {i}", "codigo": f"C{i:02d}", "stock_minimo": 3}
+        for i in range(1, volumenes.categorias + 1)
+    ])
+
+    ids_productos = [f"B{i:06d}" for i in range(volumenes.productos)]
+    await _insertar(session, Producto, [
+        {
+            "id_producto": id_producto,
+            "nombre": f"{rng.choice(PALABRAS)} {rng.choice(PALABRAS)} {i}",
+            "precio": round(rng.uniform(1000, 50000), 2),
+            "stock": STOCK_INICIAL,
+            "id_categoria": rng.randint(1, volumenes.categorias),
+            "stock_minimo": 3,
+        }
+        for i, id_producto in enumerate(ids_productos)
+    ])
+
+    ids_clientes = list(range(1, volumenes.clientes + 1))
+    await _insertar(session, Cliente, [
+        {"id_cliente": i, "nombre": f"Cliente {i}", "telefono": f"300{i:07d}", "email": f"cliente{i}@bench.co", "activo": True}
+        for i in ids_clientes
+    ])
+
+    nits = [f"900{i:06d}" for i in range(volumenes.proveedores)]
+    await _insertar(session, Proveedor, [
+        {"nit": nit, "nombre": f"Proveedor {nit}", "contacto": "contacto", "direccion": "calle", "ciudad": "Medellin"}
+        for nit in nits
+    ])
+
+    ahora = datetime.now()
+    await _insertar(session, Compra, [
+        {"id_compra": i, "fecha": ahora - timedelta(minutes=rng.randint(0, 365 * 24 * 60)), "nit": rng.choice(nits)}
+        for i in range(1, volumenes.compras + 1)
+    ])
+    await _insertar(session, Detalle_Compra, [
+        {
+            "id_compra": id_compra,
+            "id_producto": rng.choice(ids_productos),
+            "cantidad": rng.randint(1, 50),
+            "precio_unidad": round(rng.uniform(500, 30000), 2),
+        }
+        for id_compra in range(1, volumenes.compras + 1)
+        for _ in range(volumenes.detalles_por_compra)
+    ])
+
+    await session.commit()
+    return DatosSembrados(
+        ids_productos=ids_productos,
+        palabras=PALABRAS,
+        ids_clientes=ids_clientes,
+        nits=nits,
+        paginas_compras=max(1, volumenes.compras // 20),
+    )
@@ -0,0 +1,68 @@
+"""Peticiones que se miden: cada escenario arma una petición aleatoria (reproducible con la semilla)."""
+import random
+from dataclasses import dataclass
+from typing import Callable, Dict
+
+from benchmarks.datos import DatosSembrados
+
+
+@dataclass(frozen=True)
+class Escenario:
+    nombre: str
+    metodo: str
+    ruta: str  # plantilla de la ruta, para leer las consultas por petición en metricas.py
+    armar: Callable[[random.Random, DatosSembrados], Dict]  # kwargs de httpx (url, params, data)
+
+
+def _productos_paginados(rng: random.Random, datos: DatosSembrados) -> dict:
+    paginas = max(1, len(datos.ids_productos) // 20)
+    params = {"page": rng.randint(1, paginas), "page_size": 20}
+    # Una de cada cuatro páginas viene filtrada por búsqueda
+    if rng.random() < 0.25:
+        params = {"page": 1, "page_size": 20, "search": rng.choice(datos.palabras)}
+    return {"url": "/productos/paginados/", "params": params}
+
+
+def _buscar(rng: random.Random, datos: DatosSembrados) -> dict:
+    palabra = rng.choice(datos.palabras)
+    return {"url": "/productos/buscar", "params": {"query": palabra[:rng.randint(2, len(palabra))], "limite": 20}}
+
+
+def _hacer_venta(rng: random.Random, datos: DatosSembrados) -> dict:
+    productos = rng.sample(datos.ids_productos, rng.randint(1, 3))
+    return {
+        "url": "/ventas/hacer",
+        "data": {
+            "cliente_id": str(rng.choice(datos.ids_clientes)),
+            "producto_id": productos,
+            "cantidad": [str(rng.randint(1, 3)) for _ in productos],
+        },
+    }
+
+
+def _registrar_compra(rng: random.Random, datos: DatosSembrados) -> dict:
+    productos = rng.sample(datos.ids_productos, rng.randint(1, 3))
+    return {
+        "url": "/compras/nueva",
+        "data": {
+            "nit_proveedor": rng.choice(datos.nits),
+            "productos_ids": productos,
+            "cantidades": [str(rng.randint(1, 20)) for _ in productos],
+            "precios": [str(round(rng.uniform(500, 30000), 2)) for _ in productos],
+        },
+    }
+
+
+def _historial_compras(rng: random.Random, datos: DatosSembrados) -> dict:
+    return {"url": "/compras/historial", "params": {"page": rng.randint(1, datos.paginas_compras), "page_size": 20}}
+
+
+ESCENARIOS = {
+    e.nombre: e for e in (
+        Escenario("productos_paginados", "GET", "/productos/paginados/", _productos_paginados),
+        Escenario("productos_buscar", "GET", "/productos/buscar", _buscar),
+        Escenario("ventas_hacer", "POST", "/ventas/hacer", _hacer_venta),
+        Escenario("compras_nueva", "POST", "/compras/nueva", _registrar_compra),
+        Escenario("compras_historial", "GET", "/compras/historial", _historial_compras),
+    )
+}
@@ -0,0 +1,173 @@
+import bisect
+import heapq
+import unicodedata
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from modelSQL import Producto
+
+# Se indexan todos los n-gramas de 1 a 3 caracteres: una consulta de hasta 3 caracteres
+# se resuelve con una sola lista; una más larga intersecta sus trigramas y luego se verifica.
+N_MAX = 3
+
+
+def normalizar(texto: str) -> str:
+    """Minúsculas y sin tildes, para que 'azucar' encuentre 'Azúcar'."""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+
+def _gramas(texto: str) -> Set[str]:
+    return {
+        texto[i:i + n]
+        for n in range(1, N_MAX + 1)
+        for i in range(len(texto) - n + 1)
+    }
+
+
+def _prefijo(lista: list, q: str):
+    """Recorre las entradas de una lista ordenada cuya primera componente empieza por q."""
+    i = bisect.bisect_left(lista, (q,))
+    while i < len(lista) and lista[i][0].startswith(q):
+        yield lista[i]
+        i += 1
+
+
+class IndiceProductos:
+    """
+    Índice en memoria (n-gramas + prefijos) sobre nombre e id_producto para la búsqueda en caja.
+    Se construye al iniciar la app y se actualiza desde operations.py en cada alta, edición,
+    eliminación o recuperación de productos. Mientras no esté listo, buscar() devuelve None
+    y quien llama debe usar la consulta SQL.
+    Cada worker tiene su propio índice; los cambios hechos por otro worker se ven tras reconstruirlo.
+    Por eso solo sirve para las sugerencias de /productos/buscar: los listados y conteos filtran
+    con ILIKE en SQL, que siempre ve la tabla completa.
+    """
+
+    def __init__(self):
+        self.listo = False
+        self._textos: Dict[str, Tuple[str, str]] = {}  # id -> (id normalizado, nombre normalizado)
+        self._gramas: Dict[str, Set[str]] = defaultdict(set)
+        # Listas ordenadas para búsquedas por prefijo con bisect
+        self._ids: List[Tuple[str, str]] = []  # (id normalizado, id)
+        self._nombres: List[Tuple[str, str]] = []  # (nombre normalizado, id)
+        self._palabras: List[Tuple[str, str]] = []  # (palabra del nombre, id)
+        self._cambios_pendientes: Optional[list] = None
+
+    def __len__(self):
+        return len(self._textos)
+
+    async def construir(self, session: AsyncSession):
+        self._cambios_pendientes = []
+        nuevo = IndiceProductos()
+        result = await session.stream(
+            select(Producto.id_producto, Producto.nombre).where(Producto.eliminado_en.is_(None))
+        )
+        async for id_producto, nombre in result:
+            nuevo._indexar(id_producto, nombre, ordenado=False)
+        nuevo._ids.sort()
+        nuevo._nombres.sort()
+        nuevo._palabras.sort()
+
+        # Cambios que llegaron mientras se leía la tabla
+        cambios, self._cambios_pendientes = self._cambios_pendientes, None
+        self._textos, self._gramas = nuevo._textos, nuevo._gramas
+        self._ids, self._nombres, self._palabras = nuevo._ids, nuevo._nombres, nuevo._palabras
+        for id_producto, nombre in cambios:
+            if nombre is None:
+                self.eliminar(id_producto)
+            else:
+                self.agregar(id_producto, nombre)
+        self.listo = True
+
+    def _entradas(self, id_producto: str, id_norm: str, nombre_norm: str):
+        return (
+            (self._ids, (id_norm, id_producto)),
+            (self._nombres, (nombre_norm, id_producto)),
+            *((self._palabras, (palabra, id_producto)) for palabra in set(nombre_norm.split())),
+        )
+
+    def _indexar(self, id_producto: str, nombre: str, ordenado: bool = True):
+        id_norm, nombre_norm = normalizar(id_producto), normalizar(nombre)
+        self._textos[id_producto] = (id_norm, nombre_norm)
+        for grama in _gramas(id_norm) | _gramas(nombre_norm):
+            self._gramas[grama].add(id_producto)
+        for lista, entrada in self._entradas(id_producto, id_norm, nombre_norm):
+            if ordenado:
+                bisect.insort(lista, entrada)
+            else:
+                lista.append(entrada)
+
+    def agregar(self, id_producto: str, nombre: str):
+        """Agrega o re-indexa un producto."""
+        if self._cambios_pendientes is not None:
+            self._cambios_pendientes.append((id_producto, nombre))
+        self._quitar(id_producto)
+        self._indexar(id_producto, nombre)
+
+    def eliminar(self, id_producto: str):
+        if self._cambios_pendientes is not None:
+            self._cambios_pendientes.append((id_producto, None))
+        self._quitar(id_producto)
+
+    def _quitar(self, id_producto: str):
+        textos = self._textos.pop(id_producto, None)
+        if textos is None:
+            return
+        id_norm, nombre_norm = textos
+        for grama in _gramas(id_norm) | _gramas(nombre_norm):
+            ids = self._gramas.get(grama)
+            if ids is not None:
+                ids.discard(id_producto)
+                if not ids:
+                    del self._gramas[grama]
+        for lista, entrada in self._entradas(id_producto, id_norm, nombre_norm):
+            i = bisect.bisect_left(lista, entrada)
+            if i < len(lista) and lista[i] == entrada:
+                del lista[i]
+
+    def _candidatos(self, q: str) -> Set[str]:
+        """Ids que contienen q en el nombre o el id (q ya normalizado y no vacío)."""
+        if len(q) <= N_MAX:
+            return self._gramas.get(q, set())
+        listas = sorted(
+            (self._gramas.get(q[i:i + N_MAX], set()) for i in range(len(q) - N_MAX + 1)),
+            key=len
+        )
+        return {
+            id_producto for id_producto in listas[0].intersection(*listas[1:])
+            if q in self._textos[id_producto][1] or q in self._textos[id_producto][0]
+        }
+
+    def buscar(self, query: str, limite: int = 50) -> Optional[List[str]]:
+        """
+        Ids ordenados por relevancia: id exacto o prefijo de id, prefijo del nombre,
+        prefijo de una palabra del nombre y, por último, cualquier otra coincidencia.
+        Los primeros niveles salen de las listas ordenadas, así que una consulta corta
+        no necesita puntuar todos los productos que la contienen.
+        """
+        if not self.listo:
+            return None
+        q = normalizar(query.strip())
+        if not q or limite <= 0:
+            return []
+
+        resultado: List[str] = []
+        vistos: Set[str] = set()
+        for lista in (self._ids, self._nombres, self._palabras):
+            for _, id_producto in _prefijo(lista, q):
+                if id_producto not in vistos:
+                    vistos.add(id_producto)
+                    resultado.append(id_producto)
+                    if len(resultado) >= limite:
+                        return resultado
+
+        resto = (id_producto for id_producto in self._candidatos(q) if id_producto not in vistos)
+        resultado.extend(heapq.nsmallest(limite - len(resultado), resto, key=lambda i: self._textos[i][1]))
+        return resultado
+
+
+indice_productos = IndiceProductos()
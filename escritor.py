@@ -0,0 +1,84 @@
+import asyncio
+import logging
+import os
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _escribir(ruta: str, contenido: str):
+    carpeta = os.path.dirname(ruta)
+    if carpeta:
+        os.makedirs(carpeta, exist_ok=True)
+    with open(ruta, "w", encoding="utf-8") as f:
+        f.write(contenido)
+
+
+class EscritorArchivos:
+    """
+    Escribe los archivos de recibos de venta y registros de compra fuera del event loop.
+    Las peticiones encolan (ruta, contenido) y un worker los escribe en un hilo.
+    La cola es acotada: si se llena, encolar() espera en vez de crecer sin límite.
+    """
+
+    def __init__(self, max_pendientes: int = 1000):
+        self.max_pendientes = max_pendientes
+        self.escritos = 0
+        self.errores = 0
+        self._cola: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    @property
+    def profundidad(self) -> int:
+        """Archivos encolados que aún no se han escrito."""
+        return self._cola.qsize() if self._cola is not None else 0
+
+    def iniciar(self):
+        if self._worker is None:
+            self._cola = asyncio.Queue(maxsize=self.max_pendientes)
+            self._worker = asyncio.create_task(self._trabajar())
+
+    async def detener(self):
+        """Escribe todo lo pendiente (flush) y detiene el worker."""
+        if self._worker is None:
+            return
+        await self._cola.join()
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        self._cola = None
+
+    async def encolar(self, ruta: str, contenido: str):
+        if self._worker is None:
+            # Sin worker (p. ej. scripts fuera de la app) se escribe directamente, pero en un hilo
+            await asyncio.to_thread(_escribir, ruta, contenido)
+            self.escritos += 1
+            return
+        await self._cola.put((ruta, contenido))
+
+    async def _trabajar(self):
+        while True:
+            ruta, contenido = await self._cola.get()
+            try:
+                await asyncio.to_thread(_escribir, ruta, contenido)
+                self.escritos += 1
+            except Exception:
+                self.errores += 1
+                logger.exception(f"No se pudo escribir {ruta}")
+            finally:
+                self._cola.task_done()
+
+    def estadisticas(self) -> dict:
+        return {
+            "pendientes": self.profundidad,
+            "max_pendientes": self.max_pendientes,
+            "escritos": self.escritos,
+            "errores": self.errores,
+            "activo": self._worker is not None,
+        }
+
+
+escritor = EscritorArchivos(max_pendientes=int(os.getenv("ESCRITOR_MAX_PENDIENTES", "1000")))
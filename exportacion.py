@@ -0,0 +1,101 @@
+"""
+Exportaciones en streaming (CSV o NDJSON) para contabilidad.
+
+Las filas se leen con un cursor del lado del servidor (session.stream) en particiones de
+tamaño fijo y se escriben a la respuesta a medida que llegan, así que la memoria usada no
+depende del tamaño de la tabla. Si hay réplica de lectura (DATABASE_READ_URL), se leen de ella.
+"""
+import csv
+import io
+import json
+from datetime import date, datetime
+from typing import AsyncIterator
+
+from sqlalchemy import select
+
+from DBengine import abrir_sesion_lectura
+from modelSQL import Producto, Cliente, Proveedor, Compra, Detalle_Compra
+
+FORMATOS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def _consulta(tabla: str):
+    if tabla == "productos":
+        return select(
+            Producto.id_producto, Producto.nombre, Producto.precio, Producto.stock, Producto.id_categoria
+        ).where(Producto.eliminado_en.is_(None)).order_by(Producto.id_producto)
+
+    if tabla == "clientes":
+        return select(
+            Cliente.id_cliente, Cliente.nombre, Cliente.telefono, Cliente.email, Cliente.activo
+        ).order_by(Cliente.id_cliente)
+
+    if tabla == "proveedores":
+        return select(
+            Proveedor.nit, Proveedor.nombre, Proveedor.contacto, Proveedor.direccion, Proveedor.ciudad
+        ).where(Proveedor.eliminado_en.is_(None)).order_by(Proveedor.nit)
+
+    if tabla == "compras":
+        # Una fila por línea de compra, con los datos del encabezado repetidos
+        return (
+            select(
+                Compra.id_compra,
+                Compra.fecha,
+                Compra.nit,
+                Proveedor.nombre.label("proveedor_nombre"),
+                Detalle_Compra.id_detalle_compra,
+                Detalle_Compra.id_producto,
+                Producto.nombre.label("producto_nombre"),
+                Detalle_Compra.cantidad,
+                Detalle_Compra.precio_unidad,
+                (Detalle_Compra.cantidad * Detalle_Compra.precio_unidad).label("subtotal"),
+            )
+            .join(Detalle_Compra, Detalle_Compra.id_compra == Compra.id_compra)
+            .outerjoin(Proveedor, Proveedor.nit == Compra.nit)
+            .outerjoin(Producto, Producto.id_producto == Detalle_Compra.id_producto)
+            .order_by(Compra.id_compra, Detalle_Compra.id_detalle_compra)
+        )
+
+    raise LookupError(f"No se puede exportar '{tabla}'")
+
+
+TABLAS = ("productos", "clientes", "proveedores", "compras")
+
+
+def _valor(valor):
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    return valor
+
+
+async def exportar(tabla: str, formato: str, tamano_lote: int = 1000) -> AsyncIterator[str]:
+    """
+    Genera el contenido de la exportación por trozos.
+    Abre su propia sesión: la respuesta se sigue enviando después de que termina el endpoint.
+    """
+    stmt = _consulta(tabla).execution_options(yield_per=tamano_lote)
+
+    async with abrir_sesion_lectura() as session:
+        result = await session.stream(stmt)
+        columnas = list(result.keys())
+
+        if formato == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(columnas)
+            yield buffer.getvalue()
+
+        async for particion in result.partitions():
+            buffer = io.StringIO()
+            if formato == "csv":
+                writer = csv.writer(buffer)
+                for fila in particion:
+                    writer.writerow([_valor(v) for v in fila])
+            else:
+                for fila in particion:
+                    buffer.write(json.dumps({c: _valor(v) for c, v in zip(columnas, fila)}, ensure_ascii=False))
+                    buffer.write("\n")
+            yield buffer.getvalue()
@@ -0,0 +1,168 @@
+"""
+Claves de idempotencia para POST /ventas/hacer y /compras/nueva.
+
+El formulario (o el header Idempotency-Key) trae una clave por intento de operación. La clave se
+guarda en la tabla ClaveIdempotencia dentro de la misma transacción que la venta o la compra,
+junto con el id creado y una huella de los datos enviados; si la caja reintenta, el endpoint
+encuentra la clave y repite la respuesta original sin volver a descontar stock ni escribir recibos.
+
+Delante de la tabla hay un diccionario en memoria con TTL para no consultar la base de datos en
+los reintentos, y un candado por clave para que dos reintentos simultáneos en el mismo worker
+no corran la transacción a la vez. Entre workers la clave primaria de la tabla es la que decide:
+el segundo commit falla con IntegrityError y el endpoint repite la respuesta del primero.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from modelSQL import ClaveIdempotencia
+
+logger = logging.getLogger(__name__)
+
+MAX_LONGITUD_CLAVE = 100
+
+
+class ClaveReutilizada(ValueError):
+    """La clave ya se usó para otra operación o con otros datos."""
+
+
+def huella(*datos) -> str:
+    """Resumen de los datos de la petición, para detectar una clave reutilizada con otro contenido."""
+    return hashlib.sha256(json.dumps(datos, default=str, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class RegistroIdempotencia:
+
+    def __init__(self, ttl: float = 86400.0, max_entradas: int = 10000):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self.repeticiones = 0
+        # clave -> (operacion, huella, id_recurso, vence en time.monotonic())
+        self._entradas: "OrderedDict[str, tuple]" = OrderedDict()
+        # clave -> [candado, peticiones que lo tienen o lo esperan]
+        self._candados: Dict[str, list] = {}
+        self._purga: Optional[asyncio.Task] = None
+
+    def validar_clave(self, clave: str) -> str:
+        clave = (clave or "").strip()
+        if not clave or len(clave) > MAX_LONGITUD_CLAVE:
+            raise ValueError(f"Clave de idempotencia inválida (1 a {MAX_LONGITUD_CLAVE} caracteres)")
+        return clave
+
+    @asynccontextmanager
+    async def reservar(self, clave: str):
+        """Serializa, dentro del worker, las peticiones que traen la misma clave."""
+        # El candado se borra cuando nadie lo usa ni lo espera: justo después de release() se ve
+        # libre aunque ya haya despertado a la siguiente, así que locked() no sirve para decidirlo
+        entrada = self._candados.setdefault(clave, [asyncio.Lock(), 0])
+        entrada[1] += 1
+        try:
+            async with entrada[0]:
+                yield
+        finally:
+            entrada[1] -= 1
+            if entrada[1] == 0:
+                del self._candados[clave]
+
+    def recordar(self, clave: str, operacion: str, huella_datos: str, id_recurso: int):
+        """Guarda en memoria una operación ya confirmada (llamar después del commit)."""
+        self._entradas[clave] = (operacion, huella_datos, id_recurso, time.monotonic() + self.ttl)
+        self._entradas.move_to_end(clave)
+        while len(self._entradas) > self.max_entradas:
+            self._entradas.popitem(last=False)
+
+    def _en_memoria(self, clave: str) -> Optional[tuple]:
+        entrada = self._entradas.get(clave)
+        if entrada is not None and entrada[3] <= time.monotonic():
+            del self._entradas[clave]
+            return None
+        return entrada
+
+    async def buscar(self, session: AsyncSession, clave: str, operacion: str, huella_datos: str) -> Optional[int]:
+        """
+        Id del recurso creado antes con esta clave, o None si es la primera vez.
+        Lanza ClaveReutilizada si la clave se usó para otra operación o con otros datos.
+        """
+        entrada = self._en_memoria(clave)
+        if entrada is None:
+            registro = await session.get(ClaveIdempotencia, clave)
+            if registro is not None:
+                if registro.expira <= datetime.now():
+                    # Vencida pero aún sin purgar: se borra en la misma transacción que la reutiliza
+                    await session.delete(registro)
+                else:
+                    entrada = (registro.operacion, registro.huella, registro.id_recurso, None)
+                    self.recordar(clave, registro.operacion, registro.huella, registro.id_recurso)
+
+        if entrada is None:
+            return None
+        if entrada[0] != operacion or entrada[1] != huella_datos:
+            raise ClaveReutilizada("La clave de idempotencia ya se usó con otros datos")
+        self.repeticiones += 1
+        return entrada[2]
+
+    def registrar(self, session: AsyncSession, clave: str, operacion: str, huella_datos: str, id_recurso: int):
+        """Agrega la clave a la transacción en curso (no hace commit)."""
+        session.add(ClaveIdempotencia(
+            clave=clave,
+            operacion=operacion,
+            huella=huella_datos,
+            id_recurso=id_recurso,
+            expira=datetime.now() + timedelta(seconds=self.ttl),
+        ))
+
+    # --- purga periódica ---
+
+    async def purgar(self, session: AsyncSession) -> int:
+        result = await session.execute(delete(ClaveIdempotencia).where(ClaveIdempotencia.expira <= datetime.now()))
+        await session.commit()
+        ahora = time.monotonic()
+        for clave in [c for c, entrada in self._entradas.items() if entrada[3] <= ahora]:
+            del self._entradas[clave]
+        return result.rowcount
+
+    def iniciar_purga(self, fabrica_sesiones, intervalo: float):
+        if self._purga is None:
+            self._purga = asyncio.create_task(self._purgar_cada(fabrica_sesiones, intervalo))
+
+    async def detener_purga(self):
+        if self._purga is not None:
+            self._purga.cancel()
+            try:
+                await self._purga
+            except asyncio.CancelledError:
+                pass
+            self._purga = None
+
+    async def _purgar_cada(self, fabrica_sesiones, intervalo: float):
+        while True:
+            await asyncio.sleep(intervalo)
+            try:
+                async with fabrica_sesiones() as session:
+                    borradas = await self.purgar(session)
+                if borradas:
+                    logger.info("Claves de idempotencia vencidas borradas: %d", borradas)
+            except Exception:
+                logger.exception("No se pudieron purgar las claves de idempotencia")
+
+    def estadisticas(self) -> dict:
+        return {
+            "en_memoria": len(self._entradas),
+            "en_curso": len(self._candados),
+            "repeticiones": self.repeticiones,
+            "ttl": self.ttl,
+        }
+
+
+registro_idempotencia = RegistroIdempotencia(ttl=float(os.getenv("IDEMPOTENCIA_TTL", "86400")))
+INTERVALO_PURGA = float(os.getenv("IDEMPOTENCIA_INTERVALO_PURGA", "3600"))
@@ -0,0 +1,184 @@
+"""
+Importación masiva de productos desde un CSV.
+
+El archivo se lee por lotes (nunca completo en memoria), cada fila se valida y los lotes
+válidos se cargan con un INSERT ... ON CONFLICT multi-fila: los productos existentes se
+actualizan (nombre, precio, stock y categoría); los archivados no se tocan y se reportan como
+error de su fila. Devuelve un reporte con los errores por fila.
+
+Columnas requeridas: id_producto, nombre, precio, stock, id_categoria
+Columna opcional: stock_minimo (si falta o está vacía se usa el de la categoría; si el CSV
+no la trae, los productos existentes conservan el suyo)
+
+Uso desde consola:
+    python importacion.py catalogo.csv [--lote 1000]
+"""
+import argparse
+import asyncio
+import csv
+import io
+import math
+import time
+from typing import BinaryIO
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import operations as crud
+from modelSQL import Categoria
+
+COLUMNAS = ("id_producto", "nombre", "precio", "stock", "id_categoria")
+MAX_ERRORES_REPORTE = 1000
+# Cada fila del INSERT usa hasta 6 parámetros y asyncpg admite 32767 por consulta
+MAX_LOTE = 5000
+
+
+def validar_fila(fila: dict, categorias: dict) -> dict:
+    """
+    Convierte una fila del CSV en los campos de Producto; lanza ValueError si no es válida.
+    categorias: {id_categoria: stock_minimo}
+    """
+    id_producto = (fila.get("id_producto") or "").strip()
+    nombre = (fila.get("nombre") or "").strip()
+    if not id_producto:
+        raise ValueError("id_producto vacío")
+    if not nombre:
+        raise ValueError("nombre vacío")
+
+    try:
+        precio = float(fila.get("precio") or "")
+    except ValueError:
+        raise ValueError(f"precio inválido: {fila.get('precio')!r}")
+    # float() acepta 'nan' e 'inf'; con ellos los totales de ventas y reportes quedarían en NaN
+    if not math.isfinite(precio):
+        raise ValueError(f"precio inválido: {fila.get('precio')!r}")
+    try:
+        stock = int(fila.get("stock") or "")
+    except ValueError:
+        raise ValueError(f"stock inválido: {fila.get('stock')!r}")
+    try:
+        id_categoria = int(fila.get("id_categoria") or "")
+    except ValueError:
+        raise ValueError(f"id_categoria inválido: {fila.get('id_categoria')!r}")
+
+    if precio < 0:
+        raise ValueError("precio negativo")
+    if stock < 0:
+        raise ValueError("stock negativo")
+    if id_categoria not in categorias:
+        raise ValueError(f"categoría {id_categoria} no existe")
+
+    stock_minimo = (fila.get("stock_minimo") or "").strip()
+    if stock_minimo:
+        try:
+            stock_minimo = int(stock_minimo)
+        except ValueError:
+            raise ValueError(f"stock_minimo inválido: {fila.get('stock_minimo')!r}")
+        if stock_minimo < 0:
+            raise ValueError("stock_minimo negativo")
+    else:
+        stock_minimo = categorias[id_categoria]
+
+    return {
+        "id_producto": id_producto,
+        "nombre": nombre,
+        "precio": precio,
+        "stock": stock,
+        "id_categoria": id_categoria,
+        "stock_minimo": stock_minimo,
+    }
+
+
+def _siguiente_lote(lector: csv.DictReader, tamano: int) -> list:
+    """Lee hasta `tamano` filas; devuelve [(número de línea, fila), ...]."""
+    filas = []
+    for fila in lector:
+        filas.append((lector.line_num, fila))
+        if len(filas) >= tamano:
+            break
+    return filas
+
+
+def _agregar_error(reporte: dict, linea: int, error: str):
+    reporte["con_error"] += 1
+    if len(reporte["errores"]) < MAX_ERRORES_REPORTE:
+        reporte["errores"].append({"linea": linea, "error": error})
+
+
+async def importar_productos(session: AsyncSession, archivo: BinaryIO, tamano_lote: int = 1000) -> dict:
+    """
+    archivo: CSV abierto en modo binario (UTF-8, con o sin BOM).
+    La lectura del archivo corre en un hilo para no bloquear el event loop.
+    Lanza ValueError si tamano_lote no está entre 1 y MAX_LOTE o si faltan columnas.
+    """
+    if not 1 <= tamano_lote <= MAX_LOTE:
+        raise ValueError(f"El tamaño de lote debe estar entre 1 y {MAX_LOTE}")
+    result = await session.execute(select(Categoria.id_categoria, Categoria.stock_minimo))
+    categorias = dict(result.all())
+
+    texto = io.TextIOWrapper(archivo, encoding="utf-8-sig", newline="")
+    try:
+        lector = csv.DictReader(texto)
+        encabezado = await asyncio.to_thread(lambda: lector.fieldnames)
+        faltantes = [c for c in COLUMNAS if c not in (encabezado or [])]
+        if faltantes:
+            raise ValueError(f"Faltan columnas en el CSV: {', '.join(faltantes)}")
+        con_stock_minimo = "stock_minimo" in encabezado
+
+        reporte = {"filas": 0, "importados": 0, "con_error": 0, "errores": []}
+        while True:
+            filas = await asyncio.to_thread(_siguiente_lote, lector, tamano_lote)
+            if not filas:
+                break
+
+            # Dentro de un lote, si un id se repite gana la última fila
+            lote, lineas = {}, {}
+            for numero, fila in filas:
+                try:
+                    producto = validar_fila(fila, categorias)
+                except ValueError as e:
+                    _agregar_error(reporte, numero, str(e))
+                    continue
+                lote[producto["id_producto"]] = producto
+                lineas[producto["id_producto"]] = numero
+
+            reporte["filas"] += len(filas)
+            escritos = set(await crud.upsert_productos(session, list(lote.values()), con_stock_minimo))
+            reporte["importados"] += len(escritos)
+            for id_producto in lote.keys() - escritos:
+                _agregar_error(reporte, lineas[id_producto], f"el producto {id_producto} está archivado; restáurelo antes de importarlo")
+        return reporte
+    finally:
+        # El archivo es de quien llama; no lo cerramos junto con el wrapper
+        texto.detach()
+
+
+async def _main():
+    parser = argparse.ArgumentParser(description="Importa productos desde un CSV")
+    parser.add_argument("archivo", help="ruta del CSV (id_producto,nombre,precio,stock,id_categoria)")
+    parser.add_argument("--lote", type=int, default=1000, help=f"filas por INSERT (por defecto 1000, máximo {MAX_LOTE})")
+    args = parser.parse_args()
+    if not 1 <= args.lote <= MAX_LOTE:
+        parser.error(f"--lote debe estar entre 1 y {MAX_LOTE}")
+
+    from DBengine import AsyncSessionLocal, async_engine
+
+    inicio = time.perf_counter()
+    try:
+        with open(args.archivo, "rb") as archivo:
+            async with AsyncSessionLocal() as session:
+                reporte = await importar_productos(session, archivo, args.lote)
+    finally:
+        await async_engine.dispose()
+    segundos = time.perf_counter() - inicio
+
+    for error in reporte["errores"]:
+        print(f"línea {error['linea']}: {error['error']}")
+    print(
+        f"{reporte['filas']} filas, {reporte['importados']} importados, "
+        f"{reporte['con_error']} con error en {segundos:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
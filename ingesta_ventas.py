@@ -0,0 +1,272 @@
+"""
+Carga el archivo histórico de recibos ventas_txt/venta_YYYYMMDD_HHMMSS.txt en las tablas de ventas.
+
+Los recibos se parsean en paralelo con un pool de procesos y se insertan por lotes
+(Venta, Detalle_Venta y resúmenes diarios en una transacción por lote). Acepta los dos
+formatos que ha tenido crear_venta_txt:
+
+    Producto           Cant.   Total          Producto              Cant.        Total
+    hit mango 300ml   1      2000.00          tajada rechocoli          1      1000.00
+    TOTAL A PAGAR: 2000.00                    TOTAL A PAGAR:                   9800.00
+    Cliente: mechas - CC 4                    Cliente: dd - Documento: 3
+
+El documento del recibo se toma como id_cliente y el nombre del producto se busca en la
+tabla Producto; lo que no se encuentre (o el nombre que comparten varios productos) queda en NULL
+(el nombre se guarda igual en el detalle). Venta.archivo guarda solo el nombre del recibo.
+Los recibos ya cargados se registran en un archivo de checkpoint, así que se puede volver a
+ejecutar sin duplicar ventas. Los recibos venta_..._<id>.txt los escribe la app a partir de
+ventas que ya están en la base de datos, por eso no se cargan.
+
+Uso:
+    python ingesta_ventas.py [ventas_txt] [--checkpoint .ingesta_ventas.json] [--lote 500] [--procesos N]
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import operations as crud
+from modelSQL import Venta, Detalle_Venta, Producto, Cliente
+
+PATRON_ARCHIVO = re.compile(r"^venta_\d{8}_\d{6}\.txt$")
+PATRON_FECHA = re.compile(r"^Fecha y hora:\s*(.+)$", re.IGNORECASE)
+PATRON_TOTAL = re.compile(r"^total a pagar:\s*([\d.,]+)\s*$", re.IGNORECASE)
+PATRON_CLIENTE = re.compile(r"^Cliente:\s*(.*?)\s*-\s*(?:Documento:|CC)\s*(\S+)\s*$", re.IGNORECASE)
+
+
+def _es_separador(linea: str) -> bool:
+    return len(linea) >= 10 and set(linea) <= {"-", "="}
+
+
+def parsear_recibo(ruta: str) -> dict:
+    """Lee un recibo en cualquiera de los dos formatos. Lanza ValueError si no se reconoce."""
+    with open(ruta, "r", encoding="utf-8") as f:
+        lineas = [linea.rstrip() for linea in f]
+
+    fecha = total = None
+    cliente_nombre = documento = None
+    items = []
+    en_items = False
+
+    for linea in lineas:
+        if not linea:
+            continue
+        if en_items:
+            if _es_separador(linea):
+                en_items = False
+                continue
+            partes = linea.rsplit(None, 2)
+            if len(partes) != 3:
+                raise ValueError(f"línea de producto no reconocida: {linea!r}")
+            nombre, cantidad, subtotal = partes
+            items.append((nombre.strip(), int(cantidad), float(subtotal)))
+            continue
+
+        if linea.lower().startswith("producto"):
+            # La siguiente línea separadora abre la lista de productos
+            en_items = None
+            continue
+        if en_items is None and _es_separador(linea):
+            en_items = True
+            continue
+
+        coincidencia = PATRON_FECHA.match(linea)
+        if coincidencia:
+            fecha = datetime.strptime(coincidencia.group(1).strip(), "%Y-%m-%d %H:%M:%S")
+            continue
+        coincidencia = PATRON_TOTAL.match(linea)
+        if coincidencia:
+            total = float(coincidencia.group(1).replace(",", ""))
+            continue
+        coincidencia = PATRON_CLIENTE.match(linea)
+        if coincidencia:
+            cliente_nombre, documento = coincidencia.group(1), coincidencia.group(2)
+
+    if fecha is None:
+        raise ValueError("falta 'Fecha y hora'")
+    if not items:
+        raise ValueError("no tiene productos")
+    if total is None:
+        total = sum(subtotal for _, _, subtotal in items)
+
+    return {
+        "fecha": fecha,
+        "total": total,
+        "cliente_nombre": cliente_nombre,
+        "documento": documento,
+        "items": items,
+    }
+
+
+def parsear_lote(rutas: list) -> list:
+    """Corre en un proceso del pool: [(ruta, recibo o None, error o None), ...]"""
+    resultado = []
+    for ruta in rutas:
+        try:
+            resultado.append((ruta, parsear_recibo(ruta), None))
+        except (OSError, ValueError, UnicodeDecodeError) as e:
+            resultado.append((ruta, None, str(e)))
+    return resultado
+
+
+def clave_recibo(ruta: str) -> str:
+    """
+    Nombre con el que se registra un recibo (checkpoint y Venta.archivo): solo el nombre del
+    archivo, para que 'ventas_txt', './ventas_txt' o una ruta absoluta den la misma clave.
+    """
+    return os.path.basename(os.path.normpath(ruta))
+
+
+def cargar_checkpoint(ruta: str) -> set:
+    if not os.path.exists(ruta):
+        return set()
+    with open(ruta, "r", encoding="utf-8") as f:
+        # Los checkpoints anteriores guardaban la ruta tal como se escribió
+        return {clave_recibo(procesado) for procesado in json.load(f).get("procesados", [])}
+
+
+def guardar_checkpoint(ruta: str, procesados: set):
+    temporal = ruta + ".tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump({"procesados": sorted(procesados)}, f)
+    os.replace(temporal, ruta)
+
+
+async def insertar_recibos(session: AsyncSession, recibos: list, productos: dict, clientes: set) -> int:
+    """
+    Inserta un lote de recibos parseados [(ruta, recibo), ...] en una transacción.
+    Venta.archivo guarda clave_recibo(ruta) y es único: omite los que ya estén cargados
+    (también los de cargas anteriores, que guardaban la ruta tal como se escribió).
+    Devuelve cuántas ventas insertó.
+    """
+    rutas = {ruta for ruta, _ in recibos}
+    buscadas = {clave_recibo(ruta) for ruta in rutas} | rutas | {os.path.normpath(ruta) for ruta in rutas}
+    result = await session.execute(select(Venta.archivo).where(Venta.archivo.in_(buscadas)))
+    existentes = {clave_recibo(archivo) for archivo in result.scalars().all()}
+
+    pares = []
+    for ruta, recibo in recibos:
+        archivo = clave_recibo(ruta)
+        if archivo in existentes:
+            continue
+        existentes.add(archivo)
+        documento = recibo["documento"]
+        id_cliente = int(documento) if documento and documento.isdigit() and int(documento) in clientes else None
+        venta = Venta(fecha=recibo["fecha"], id_cliente=id_cliente, total=recibo["total"], archivo=archivo)
+        detalles = [
+            Detalle_Venta(
+                id_producto=productos.get(nombre.lower()),
+                nombre_producto=nombre,
+                cantidad=cantidad,
+                precio_unidad=subtotal / cantidad if cantidad else subtotal
+            )
+            for nombre, cantidad, subtotal in recibo["items"]
+        ]
+        pares.append((venta, detalles))
+
+    if not pares:
+        return 0
+
+    session.add_all([venta for venta, _ in pares])
+    await session.flush()
+    for venta, detalles in pares:
+        for detalle in detalles:
+            detalle.id_venta = venta.id_venta
+        session.add_all(detalles)
+    await crud.acumular_resumenes_ventas(session, pares)
+    await session.commit()
+    return len(pares)
+
+
+async def ingestar(session: AsyncSession, directorio: str, checkpoint: str, tamano_lote: int = 500, procesos: int = None) -> dict:
+    procesados = cargar_checkpoint(checkpoint)
+    rutas = sorted(
+        os.path.join(directorio, nombre)
+        for nombre in os.listdir(directorio)
+        if PATRON_ARCHIVO.match(nombre)
+    )
+    pendientes = [ruta for ruta in rutas if clave_recibo(ruta) not in procesados]
+
+    # Se resuelven una sola vez: nombre de producto -> id y los ids de clientes existentes.
+    # Un nombre que comparten varios productos es ambiguo: su detalle queda con id_producto NULL
+    result = await session.execute(select(Producto.nombre, Producto.id_producto))
+    productos = {}
+    for nombre, id_producto in result.all():
+        clave = nombre.lower()
+        productos[clave] = None if clave in productos else id_producto
+    result = await session.execute(select(Cliente.id_cliente))
+    clientes = set(result.scalars().all())
+
+    reporte = {"archivos": len(pendientes), "omitidos_checkpoint": len(rutas) - len(pendientes), "insertadas": 0, "errores": []}
+    inicio = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    procesos = procesos or os.cpu_count() or 1
+
+    with ProcessPoolExecutor(max_workers=procesos) as pool:
+        def parsear(lote):
+            # Cada lote se reparte en un trozo por proceso
+            tamano = max(1, -(-len(lote) // procesos))
+            trozos = [lote[i:i + tamano] for i in range(0, len(lote), tamano)]
+            return asyncio.gather(*(loop.run_in_executor(pool, parsear_lote, trozo) for trozo in trozos))
+
+        lotes = [pendientes[i:i + tamano_lote] for i in range(0, len(pendientes), tamano_lote)]
+        siguiente = parsear(lotes[0]) if lotes else None
+        for indice in range(len(lotes)):
+            resultados = [r for trozo in await siguiente for r in trozo]
+            # Mientras se inserta este lote, el pool ya parsea el siguiente
+            siguiente = parsear(lotes[indice + 1]) if indice + 1 < len(lotes) else None
+
+            recibos = []
+            for ruta, recibo, error in resultados:
+                if error:
+                    reporte["errores"].append({"archivo": ruta, "error": error})
+                else:
+                    recibos.append((ruta, recibo))
+
+            reporte["insertadas"] += await insertar_recibos(session, recibos, productos, clientes)
+            procesados.update(clave_recibo(ruta) for ruta, _ in recibos)
+            guardar_checkpoint(checkpoint, procesados)
+
+            hechos = sum(len(l) for l in lotes[:indice + 1])
+            segundos = time.perf_counter() - inicio
+            print(f"{hechos}/{len(pendientes)} archivos ({hechos / segundos:.0f} archivos/s)")
+
+    reporte["segundos"] = time.perf_counter() - inicio
+    reporte["archivos_por_segundo"] = len(pendientes) / reporte["segundos"] if reporte["segundos"] else 0.0
+    return reporte
+
+
+async def _main():
+    parser = argparse.ArgumentParser(description="Carga los recibos TXT históricos en las tablas de ventas")
+    parser.add_argument("directorio", nargs="?", default="ventas_txt")
+    parser.add_argument("--checkpoint", default=".ingesta_ventas.json", help="archivo con los recibos ya cargados")
+    parser.add_argument("--lote", type=int, default=500, help="recibos por transacción (por defecto 500)")
+    parser.add_argument("--procesos", type=int, default=None, help="procesos para parsear (por defecto, uno por CPU)")
+    args = parser.parse_args()
+
+    from DBengine import AsyncSessionLocal, async_engine
+
+    try:
+        async with AsyncSessionLocal() as session:
+            reporte = await ingestar(session, args.directorio, args.checkpoint, args.lote, args.procesos)
+    finally:
+        await async_engine.dispose()
+
+    for error in reporte["errores"]:
+        print(f"{error['archivo']}: {error['error']}")
+    print(
+        f"{reporte['archivos']} archivos ({reporte['omitidos_checkpoint']} ya cargados antes), "
+        f"{reporte['insertadas']} ventas insertadas, {len(reporte['errores'])} con error, "
+        f"{reporte['archivos_por_segundo']:.0f} archivos/s"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
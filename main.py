@@ -1,26 +1,113 @@
-from contextlib import asynccontextmanager
-from fastapi import FastAPI, Depends, HTTPException, status, Request, Form
+from contextlib import asynccontextmanager, nullcontext
+from fastapi import FastAPI, Depends, HTTPException, status, Request, Form, UploadFile, File
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from DBengine import get_session, init_db
+from DBengine import (
+    get_session, get_session_lectura, abrir_sesion_lectura, ruta_lectura,
+    AsyncSessionLocal, async_engine, read_engine, estado_pool,
+)
 import operations as crud
+import migraciones
+import importacion
+import exportacion
+from escritor import escritor
+from busqueda import indice_productos
+from alertas import canal_alertas
+import idempotencia
+from idempotencia import registro_idempotencia
+import metricas
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import RedirectResponse
-import os
+from fastapi.responses import RedirectResponse, PlainTextResponse, StreamingResponse, Response, JSONResponse
+from fastapi.encoders import jsonable_encoder
+from datetime import date, timedelta
+import time
+import uuid
+from typing import AsyncGenerator, List, Optional
+from modelSQL import AjusteStock
 
 # === EVENTO DE VIDA (LIFESPAN) ===
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Inicializa la base de datos al iniciar la app."""
-    await init_db()
+    """Aplica las migraciones pendientes, arma el índice de búsqueda e inicia el escritor de archivos; al cerrar escribe lo pendiente."""
+    await migraciones.migrar(async_engine)
+    async with AsyncSessionLocal() as session:
+        await indice_productos.construir(session)
+    escritor.iniciar()
+    registro_idempotencia.iniciar_purga(AsyncSessionLocal, idempotencia.INTERVALO_PURGA)
     yield
+    await registro_idempotencia.detener_purga()
+    await escritor.detener()
 
 app = FastAPI(lifespan=lifespan, title="Sistema de Inventario - Creaciones Mechas")
 
+# === MÉTRICAS (latencia por ruta y consultas SQL por petición, ver GET /metrics) ===
+app.add_middleware(metricas.MiddlewareMetricas)
+metricas.metricas.instrumentar_engine(async_engine)
+if read_engine is not None:
+    metricas.metricas.instrumentar_engine(read_engine)
+
 # === CONFIGURACIÓN DE FRONTEND ===
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
+# === CONFLICTOS DE VERSIÓN (concurrencia optimista) ===
+@app.exception_handler(crud.ConflictoVersion)
+async def conflicto_version(request: Request, exc: crud.ConflictoVersion):
+    """409 con el registro tal como está ahora, para que el cliente lo muestre y reintente con su versión."""
+    return JSONResponse(status_code=409, content={"detail": str(exc), "actual": jsonable_encoder(exc.actual)})
+
+# === RESPUESTAS CONDICIONALES (ETag) ===
+# El navegador guarda la respuesta pero la revalida siempre; si nada cambió recibe un 304 vacío.
+CACHE_CONTROL_LISTADOS = "private, no-cache"
+
+def _no_modificado(request: Request, etag: str) -> Optional[Response]:
+    """Respuesta 304 si el If-None-Match del navegador ya trae este ETag; si no, None."""
+    cabecera = request.headers.get("if-none-match")
+    if not cabecera:
+        return None
+    etags = [e.strip().removeprefix("W/") for e in cabecera.split(",")]
+    if "*" in etags or etag in etags:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL_LISTADOS})
+    return None
+
+def _cabeceras_cache(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL_LISTADOS
+
+# === SESIONES DE LECTURA (réplica opcional, ver DBengine.RutaLectura) ===
+def _sesion_lectura(*tablas: str):
+    """
+    Sesión de lectura para las páginas que se ven justo después de escribir en `tablas` (o que
+    llevan ETag). Si este worker escribió en ellas hace menos de lo que la réplica puede ir
+    atrasada, se lee de la primaria: el ETag nuevo no debe quedar con datos sin ese cambio.
+    """
+    async def dependencia() -> AsyncGenerator[AsyncSession, None]:
+        reciente = crud.versiones_tablas.cambio_reciente(ruta_lectura.retraso_maximo + ruta_lectura.intervalo, *tablas)
+        async with abrir_sesion_lectura(primaria=reciente) as session:
+            yield session
+    return dependencia
+
+
+# === IDEMPOTENCIA (ventas y compras) ===
+def _clave_idempotencia(request: Request, valor_formulario: Optional[str]) -> Optional[str]:
+    """Clave del header Idempotency-Key o, desde los formularios HTML, del campo idempotency_key."""
+    clave = request.headers.get("idempotency-key") or valor_formulario
+    if not clave:
+        return None
+    try:
+        return registro_idempotencia.validar_clave(clave)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def _buscar_clave_idempotencia(session: AsyncSession, clave: str, operacion: str, huella: str) -> Optional[int]:
+    try:
+        return await registro_idempotencia.buscar(session, clave, operacion, huella)
+    except idempotencia.ClaveReutilizada as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
 # === PÁGINA PRINCIPAL ===
 @app.get("/")
 async def home(request: Request):
@@ -31,45 +118,39 @@ async def home(request: Request):
 
 @app.get("/productos/pagina")
 @app.get("/productos/pagina")
-async def pagina_productos(request: Request, session: AsyncSession = Depends(get_session)):
-    productos = await crud.obtener_todos_productos(session)
-    categorias = await crud.obtener_todas_categorias(session)
-    categorias_dict = {c.id_categoria: c.tipo for c in categorias}
-
-    productos_lista = []
-    productos_bajo_stock = []
-
-    for p in productos:
-        producto_formateado = {
-            "id_producto": p.id_producto,
-            "nombre": p.nombre,
-            "precio": p.precio,
-            "stock": p.stock,
-            "id_categoria": p.id_categoria,
-            "categoria_nombre": categorias_dict.get(p.id_categoria, "Sin categoría")
-        }
-
-        productos_lista.append(producto_formateado)
+async def pagina_productos(request: Request, session: AsyncSession = Depends(_sesion_lectura("producto", "categoria"))):
+    """
+    Solo la primera página del catálogo (la misma que pide productos.js) y las alertas vigentes,
+    que salen del índice parcial de stock bajo. Las nuevas llegan por /alertas/stock/stream.
+    """
+    etag = crud.versiones_tablas.etag("producto", "categoria")
+    no_modificado = _no_modificado(request, etag)
+    if no_modificado:
+        return no_modificado
 
-        if p.stock < 3:
-            productos_bajo_stock.append(producto_formateado)
+    productos = await crud.obtener_productos_paginados(session, page=1, page_size=10)
+    categorias = await crud.cache_categorias.obtener(session)
+    bajo_stock = await crud.obtener_productos_bajo_stock(session)
 
-    return templates.TemplateResponse(
+    respuesta = templates.TemplateResponse(
         "productos.html",
         {
             "request": request,
-            "productos": productos_lista,
+            "productos": await crud.formatear_productos(session, productos),
             "categorias": categorias,
-            "alertas": productos_bajo_stock
+            "alertas": await crud.formatear_productos(session, bajo_stock)
         }
     )
+    _cabeceras_cache(respuesta, etag)
+    return respuesta
 
 @app.get("/productos/buscar")
 async def buscar_productos_endpoint(
     query: str,
-    session: AsyncSession = Depends(get_session)
+    limite: int = 50,
+    session: AsyncSession = Depends(get_session_lectura)
 ):
-    resultados = await crud.buscar_productos(session, query)
+    resultados = await crud.buscar_productos(session, query, limite)
     return {"resultados": resultados, "total": len(resultados)}
 
 
@@ -79,28 +160,45 @@ async def productos_paginados(
     page_size: int = 10,
     categoria: int = 0,
     search: str = "",
-    session: AsyncSession = Depends(get_session)
+    cursor: str = None,
+    session: AsyncSession = Depends(get_session_lectura)
 ):
-    productos_filtrados = await crud.obtener_productos_filtrados(
-        session, categoria=categoria, search=search
+    """
+    Paginación, filtro y conteo se resuelven en la base de datos.
+    Opcionalmente acepta `cursor` (el `next_cursor` de la respuesta anterior)
+    para paginar por keyset sobre (nombre, id_producto).
+    """
+    if page < 1 or page_size < 1:
+        raise HTTPException(status_code=400, detail="Página inválida")
+
+    despues_de = None
+    if cursor:
+        try:
+            despues_de = crud.decodificar_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    pagina = await crud.obtener_productos_paginados(
+        session, page=page, page_size=page_size, categoria=categoria, search=search, despues_de=despues_de
     )
-
-    pagina, total = crud.paginar_lista(productos_filtrados, page, page_size)
+    total = await crud.contar_productos_filtrados(session, categoria=categoria, search=search)
 
     productos_formateados = await crud.formatear_productos(session, pagina)
 
     total_pages = (total + page_size - 1) // page_size
+    next_cursor = crud.codificar_cursor(pagina[-1]) if len(pagina) == page_size else None
 
     return {
         "productos": productos_formateados,
         "total": total,
         "total_pages": total_pages,
-        "current_page": page
+        "current_page": page,
+        "next_cursor": next_cursor
     }
 
 
 @app.get("/productos/categoria/{categoria_id}")
-async def obtener_productos_por_categoria(categoria_id: int, session: AsyncSession = Depends(get_session)):
+async def obtener_productos_por_categoria(categoria_id: int, session: AsyncSession = Depends(get_session_lectura)):
     """
     Devuelve todos los productos de una categoría específica.
     Si categoria_id == 0, devuelve todos los productos.
@@ -110,7 +208,7 @@ async def obtener_productos_por_categoria(categoria_id: int, session: AsyncSessi
     else:
         productos = await crud.obtener_productos_por_categoria(session, categoria_id)
 
-    categorias = {c.id_categoria: c.tipo for c in await crud.obtener_todas_categorias(session)}
+    categorias = await crud.cache_categorias.mapa(session)
     productos_lista = [
         {
             "id_producto": p.id_producto,
@@ -135,18 +233,30 @@ async def pagina_compras(request: Request):
 
 # === CRUD DE CATEGORÍAS ===
 @app.post("/categorias/", status_code=status.HTTP_201_CREATED)
-async def crear_categoria(tipo: str = Form(...), codigo: str = Form(...), session: AsyncSession = Depends(get_session)):
+async def crear_categoria(
+    tipo: str = Form(...),
+    codigo: str = Form(...),
+    stock_minimo: int = Form(crud.STOCK_MINIMO_POR_DEFECTO),
+    session: AsyncSession = Depends(get_session)
+):
     if not tipo or not codigo:
         raise HTTPException(status_code=400, detail="Faltan campos requeridos")
+    if stock_minimo < 0:
+        raise HTTPException(status_code=400, detail="Stock mínimo negativo no permitido")
     try:
-        nueva_categoria = await crud.crear_categoria(session, tipo, codigo)
+        nueva_categoria = await crud.crear_categoria(session, tipo, codigo, stock_minimo)
         return {"message": "Categoría creada exitosamente", "categoria": nueva_categoria}
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error creando categoría: {e}")
 
 @app.get("/categorias/")
-async def obtener_categorias(session: AsyncSession = Depends(get_session)):
+async def obtener_categorias(request: Request, response: Response, session: AsyncSession = Depends(_sesion_lectura("categoria"))):
+    etag = crud.versiones_tablas.etag("categoria")
+    no_modificado = _no_modificado(request, etag)
+    if no_modificado:
+        return no_modificado
     categorias = await crud.obtener_todas_categorias(session)
+    _cabeceras_cache(response, etag)
     return {"categorias": categorias}
 
 
@@ -160,10 +270,12 @@ async def obtener_categoria(categoria_id: int, session: AsyncSession = Depends(g
 
 
 @app.patch("/categorias/{categoria_id}")
-async def actualizar_categoria(categoria_id: int, nombre: str = None, codigo: str = None,
+async def actualizar_categoria(categoria_id: int, nombre: str = None, codigo: str = None, stock_minimo: int = None,
                          session: AsyncSession = Depends(get_session)):
-    """Actualizar una categoría"""
-    categoria = await crud.actualizar_categoria(session, categoria_id, nombre, codigo)
+    """Actualizar una categoría (stock_minimo también se aplica a sus productos que no tienen umbral propio)"""
+    if stock_minimo is not None and stock_minimo < 0:
+        raise HTTPException(status_code=400, detail="Stock mínimo negativo no permitido")
+    categoria = await crud.actualizar_categoria(session, categoria_id, nombre, codigo, stock_minimo)
     if not categoria:
         raise HTTPException(status_code=404, detail="Categoría no encontrada")
     return {"message": "Categoría actualizada exitosamente", "categoria": categoria}
@@ -184,20 +296,43 @@ async def crear_producto(
     precio: float = Form(...),
     stock: int = Form(...),
     id_categoria: int = Form(...),
+    stock_minimo: Optional[int] = Form(None),
     session: AsyncSession = Depends(get_session)
 ):
     if not await crud.categoria_existe(session, id_categoria):
         raise HTTPException(status_code=400, detail="Categoría no válida")
+    if stock_minimo is not None and stock_minimo < 0:
+        raise HTTPException(status_code=400, detail="Stock mínimo negativo no permitido")
     try:
-        producto = await crud.crear_producto(session, id_producto, nombre, precio, stock, id_categoria)
+        producto = await crud.crear_producto(session, id_producto, nombre, precio, stock, id_categoria, stock_minimo)
         return {"message": "Producto creado correctamente", "producto": producto}
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error: {e}")
 
+@app.post("/productos/importar")
+async def importar_productos(
+    archivo: UploadFile = File(...),
+    lote: int = Form(1000),
+    session: AsyncSession = Depends(get_session)
+):
+    """Importación masiva desde CSV (id_producto,nombre,precio,stock,id_categoria) con reporte de errores por línea"""
+    # Se valida antes de leer el archivo: un lote demasiado grande fallaría después de confirmar los anteriores
+    if not 1 <= lote <= importacion.MAX_LOTE:
+        raise HTTPException(status_code=400, detail=f"Tamaño de lote inválido (1 a {importacion.MAX_LOTE})")
+    try:
+        reporte = await importacion.importar_productos(session, archivo.file, lote)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"CSV inválido: {e}")
+    return {"message": "Importación terminada", **reporte}
+
 @app.get("/productos/")
-async def obtener_productos(session: AsyncSession = Depends(get_session)):
+async def obtener_productos(request: Request, response: Response, session: AsyncSession = Depends(_sesion_lectura("producto", "categoria"))):
+    etag = crud.versiones_tablas.etag("producto", "categoria")
+    no_modificado = _no_modificado(request, etag)
+    if no_modificado:
+        return no_modificado
     productos = await crud.obtener_todos_productos(session)
-    categorias = {c.id_categoria: c.tipo for c in await crud.obtener_todas_categorias(session)}
+    categorias = await crud.cache_categorias.mapa(session)
     productos_lista = [
         {
             "id_producto": p.id_producto,
@@ -209,6 +344,7 @@ async def obtener_productos(session: AsyncSession = Depends(get_session)):
         }
         for p in productos
     ]
+    _cabeceras_cache(response, etag)
     return {"productos": productos_lista, "total": len(productos_lista)}
 
 @app.delete("/productos/{producto_id}")
@@ -216,6 +352,20 @@ async def eliminar_producto(producto_id: str, session: AsyncSession = Depends(ge
     if await crud.mover_producto(session, producto_id):
         return {"message": "Producto eliminado"}
     raise HTTPException(status_code=404, detail="Producto no encontrado")
+
+@app.post("/productos/archivar")
+async def archivar_productos(ids: List[str], session: AsyncSession = Depends(get_session)):
+    """Archiva por lote: ["id1", "id2", ...]"""
+    archivados = await crud.archivar_productos(session, ids)
+    hechos = set(archivados)
+    return {"archivados": archivados, "omitidos": [i for i in ids if i not in hechos]}
+
+@app.post("/productos/restaurar")
+async def restaurar_productos(ids: List[str], session: AsyncSession = Depends(get_session)):
+    """Restaura por lote: ["id1", "id2", ...]"""
+    restaurados = await crud.restaurar_productos(session, ids)
+    hechos = set(restaurados)
+    return {"restaurados": restaurados, "omitidos": [i for i in ids if i not in hechos]}
 # === CRUD DE PROVEEDORES ===
 @app.post("/proveedores/", status_code=status.HTTP_201_CREATED)
 async def crear_proveedor(
@@ -238,22 +388,41 @@ async def crear_proveedor(
 
 
 @app.get("/proveedores/")
-async def obtener_proveedores(session: AsyncSession = Depends(get_session)):
+async def obtener_proveedores(request: Request, response: Response, session: AsyncSession = Depends(_sesion_lectura("proveedor"))):
     """Devuelve todos los proveedores"""
+    etag = crud.versiones_tablas.etag("proveedor")
+    no_modificado = _no_modificado(request, etag)
+    if no_modificado:
+        return no_modificado
     proveedores = await crud.obtener_todos_proveedores(session)
+    _cabeceras_cache(response, etag)
     return {"proveedores": proveedores, "total": len(proveedores)}
 
 
 @app.delete("/proveedores/{nit}")
 async def eliminar_proveedor(nit: str, session: AsyncSession = Depends(get_session)):
-    """Elimina un proveedor (mueve a backup)"""
+    """Archiva un proveedor (borrado lógico)"""
     if await crud.mover_proveedor(session, nit):
-        return {"message": "Proveedor movido al backup"}
+        return {"message": "Proveedor archivado"}
     raise HTTPException(status_code=404, detail="Proveedor no encontrado")
 
+@app.post("/proveedores/archivar")
+async def archivar_proveedores(nits: List[str], session: AsyncSession = Depends(get_session)):
+    """Archiva por lote: ["nit1", "nit2", ...]"""
+    archivados = await crud.archivar_proveedores(session, nits)
+    hechos = set(archivados)
+    return {"archivados": archivados, "omitidos": [n for n in nits if n not in hechos]}
+
+@app.post("/proveedores/restaurar")
+async def restaurar_proveedores(nits: List[str], session: AsyncSession = Depends(get_session)):
+    """Restaura por lote: ["nit1", "nit2", ...]"""
+    restaurados = await crud.restaurar_proveedores(session, nits)
+    hechos = set(restaurados)
+    return {"restaurados": restaurados, "omitidos": [n for n in nits if n not in hechos]}
+
 @app.get("/productosE/")
-async def pagina_productos_eliminados(request: Request, session: AsyncSession = Depends(get_session)):
-    """Muestra los productos eliminados (guardados en ProductoBackup)."""
+async def pagina_productos_eliminados(request: Request, session: AsyncSession = Depends(_sesion_lectura("producto"))):
+    """Muestra los productos archivados (borrado lógico)."""
     productos_eliminados = await crud.obtener_productos_eliminados(session)
     return templates.TemplateResponse(
         "productos_eliminados.html",
@@ -261,33 +430,88 @@ async def pagina_productos_eliminados(request: Request, session: AsyncSession =
     )
 @app.post("/productos/recuperar/{producto_id}")
 async def recuperar_producto(producto_id: str, session: AsyncSession = Depends(get_session)):
-    """Restaura un producto desde la tabla ProductoBackup."""
+    """Restaura un producto archivado."""
     await crud.recuperar_producto(session, producto_id)
     return RedirectResponse(url="/productosE/", status_code=303)
 @app.get("/proveedores/backup/")
-async def obtener_proveedores_backup(session: AsyncSession = Depends(get_session)):
-    """Devuelve los proveedores eliminados (backup)"""
+async def obtener_proveedores_backup(session: AsyncSession = Depends(_sesion_lectura("proveedor"))):
+    """Devuelve los proveedores archivados"""
     proveedores_backup = await crud.obtener_proveedores_eliminados(session)
     return {"backup": proveedores_backup}
 
 # === MANEJO DE STOCK ===
 @app.put("/productos/{producto_id}/stock")
-async def actualizar_stock(producto_id: str, nueva_cantidad: int, session: AsyncSession = Depends(get_session)):
+async def actualizar_stock(producto_id: str, nueva_cantidad: int, version: Optional[int] = None, session: AsyncSession = Depends(get_session)):
+    """version: la del producto cuando se leyó; si otra persona lo cambió después se responde 409"""
     if nueva_cantidad < 0:
         raise HTTPException(status_code=400, detail="Cantidad negativa no permitida")
-    producto = await crud.actualizar_stock_producto(session, producto_id, nueva_cantidad)
+    producto = await crud.actualizar_stock_producto(session, producto_id, nueva_cantidad, version)
     if not producto:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
     return {"message": f"Stock actualizado: {nueva_cantidad}", "producto": producto}
 
 
+@app.put("/productos/{producto_id}/stock_minimo")
+async def actualizar_stock_minimo(producto_id: str, stock_minimo: int, version: Optional[int] = None, session: AsyncSession = Depends(get_session)):
+    """Umbral de reposición propio del producto"""
+    if stock_minimo < 0:
+        raise HTTPException(status_code=400, detail="Stock mínimo negativo no permitido")
+    producto = await crud.actualizar_producto(session, producto_id, stock_minimo=stock_minimo, version=version)
+    if not producto:
+        raise HTTPException(status_code=404, detail="Producto no encontrado")
+    return {"message": f"Stock mínimo actualizado: {stock_minimo}", "producto": producto}
+
+
+@app.get("/productos/bajo_stock")
+async def productos_bajo_stock(session: AsyncSession = Depends(get_session_lectura)):
+    """Productos por debajo de su stock mínimo"""
+    productos = await crud.obtener_productos_bajo_stock(session)
+    return {"productos": await crud.formatear_productos(session, productos), "total": len(productos)}
+
+
+@app.get("/alertas/stock/stream")
+async def stream_alertas_stock():
+    """Server-Sent Events: un evento `stock_bajo` cada vez que un producto cae bajo su stock mínimo"""
+    return StreamingResponse(
+        canal_alertas.eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.put("/productos/stock/lote")
+async def ajustar_stock_lote(ajustes: List[AjusteStock], session: AsyncSession = Depends(get_session)):
+    """Ajuste de inventario por lote: [{"id_producto": ..., "stock": n} | {"id_producto": ..., "delta": n}, ...]"""
+    try:
+        resultado = await crud.ajustar_stock_lote(session, ajustes)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"message": f"Stock actualizado para {len(resultado['actualizados'])} productos", **resultado}
+
+
 # === CRUD DE CLIENTES ===
+CLIENTES_POR_PAGINA = 50
+MAX_LIMITE_CLIENTES = 200
+
+def _validar_limite_clientes(limite: int):
+    if not 1 <= limite <= MAX_LIMITE_CLIENTES:
+        raise HTTPException(status_code=400, detail=f"limite debe estar entre 1 y {MAX_LIMITE_CLIENTES}")
+
+def _siguiente_cursor_clientes(clientes, limite: int) -> Optional[str]:
+    return crud.codificar_cursor_cliente(clientes[-1]) if len(clientes) == limite else None
+
+
 @app.get("/clientes/pagina")
-async def pagina_clientes(request: Request, session: AsyncSession = Depends(get_session)):
-    clientes = await crud.obtener_todos_clientes(session)
+async def pagina_clientes(request: Request, session: AsyncSession = Depends(_sesion_lectura("cliente"))):
+    """Renderiza solo la primera página; clientes.js pide las siguientes con el cursor."""
+    clientes = await crud.obtener_clientes_paginados(session, limite=CLIENTES_POR_PAGINA)
     return templates.TemplateResponse(
         "clientes.html",
-        {"request": request, "clientes": clientes}
+        {
+            "request": request,
+            "clientes": clientes,
+            "next_cursor": _siguiente_cursor_clientes(clientes, CLIENTES_POR_PAGINA),
+        }
     )
 
 @app.post("/clientes/", status_code=status.HTTP_201_CREATED)
@@ -297,17 +521,54 @@ async def crear_cliente(
     email: str = Form(...),
     session: AsyncSession = Depends(get_session)
 ):
-    if await crud.buscar_cliente_por_email(session, email):
+    try:
+        await crud.crear_cliente(session, nombre, telefono, email)
+    except ValueError:
         return RedirectResponse("/clientes/pagina?error=duplicado", status_code=303)
-
-    await crud.crear_cliente(session, nombre, telefono, email)
     return RedirectResponse("/clientes/pagina", status_code=303)
 
 
 @app.get("/clientes/")
-async def obtener_clientes(session: AsyncSession = Depends(get_session)):
-    clientes = await crud.obtener_todos_clientes(session)
-    return {"clientes": clientes, "total": len(clientes)}
+async def obtener_clientes(
+    request: Request,
+    response: Response,
+    limite: int = CLIENTES_POR_PAGINA,
+    cursor: str = None,
+    buscar: str = "",
+    session: AsyncSession = Depends(_sesion_lectura("cliente"))
+):
+    """
+    Listado paginado por cursor (activos primero, luego por nombre).
+    `cursor` es el `next_cursor` de la respuesta anterior; es None en la última página.
+    """
+    _validar_limite_clientes(limite)
+    despues_de = None
+    if cursor:
+        try:
+            despues_de = crud.decodificar_cursor_cliente(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    etag = crud.versiones_tablas.etag("cliente")
+    no_modificado = _no_modificado(request, etag)
+    if no_modificado:
+        return no_modificado
+    clientes = await crud.obtener_clientes_paginados(session, limite=limite, buscar=buscar, despues_de=despues_de)
+    _cabeceras_cache(response, etag)
+    return {"clientes": clientes, "next_cursor": _siguiente_cursor_clientes(clientes, limite)}
+
+
+@app.get("/clientes/buscar")
+async def buscar_clientes(
+    q: str = "",
+    limite: int = 10,
+    solo_activos: bool = False,
+    session: AsyncSession = Depends(get_session_lectura)
+):
+    """Autocompletado: clientes cuyo nombre, teléfono o email contiene `q`."""
+    _validar_limite_clientes(limite)
+    clientes = await crud.obtener_clientes_paginados(session, limite=limite, buscar=q, solo_activos=solo_activos)
+    return {"clientes": clientes}
 
 
 @app.get("/clientes/{cliente_id}")
@@ -334,9 +595,17 @@ async def actualizar_cliente(
     nombre: str = Form(None),
     telefono: str = Form(None),
     email: str = Form(None),
+    version: Optional[int] = Form(None),
     session: AsyncSession = Depends(get_session)
 ):
-    cliente = await crud.actualizar_cliente(session, cliente_id, nombre, telefono, email)
+    """version: la del cliente cuando se abrió el formulario; si otra persona lo editó después se responde 409"""
+    try:
+        cliente = await crud.actualizar_cliente(session, cliente_id, nombre, telefono, email, version=version)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not cliente:
+        raise HTTPException(status_code=404, detail="Cliente no encontrado")
+    return {"message": "Cliente actualizado exitosamente", "cliente": cliente}
 
 
 @app.post("/clientes/{cliente_id}/inactivar")
@@ -358,12 +627,18 @@ async def activar_cliente(cliente_id: int, session: AsyncSession = Depends(get_s
 
 # Página HTML principal de proveedores
 @app.get("/proveedores/pagina")
-async def pagina_proveedores(request: Request, session: AsyncSession = Depends(get_session)):
+async def pagina_proveedores(request: Request, session: AsyncSession = Depends(_sesion_lectura("proveedor"))):
+    etag = crud.versiones_tablas.etag("proveedor")
+    no_modificado = _no_modificado(request, etag)
+    if no_modificado:
+        return no_modificado
     proveedores = await crud.obtener_proveedores_resumen(session)
-    return templates.TemplateResponse(
+    respuesta = templates.TemplateResponse(
         "proveedores.html",
         {"request": request, "proveedores": proveedores}
     )
+    _cabeceras_cache(respuesta, etag)
+    return respuesta
 
 
 # Crear proveedor (desde formulario HTML)
@@ -386,7 +661,7 @@ async def crear_proveedor_endpoint(
         raise HTTPException(status_code=409, detail=str(e))
 
 
-# Eliminar proveedor moviéndolo a backup
+# Eliminar proveedor (queda archivado)
 @app.post("/proveedores/eliminar/{nit}")
 async def eliminar_proveedor_html(nit: str, session: AsyncSession = Depends(get_session)):
     if await crud.mover_proveedor(session, nit):
@@ -396,7 +671,7 @@ async def eliminar_proveedor_html(nit: str, session: AsyncSession = Depends(get_
 
 # Página HTML de proveedores eliminados
 @app.get("/proveedoresE/")
-async def pagina_proveedores_eliminados(request: Request, session: AsyncSession = Depends(get_session)):
+async def pagina_proveedores_eliminados(request: Request, session: AsyncSession = Depends(_sesion_lectura("proveedor"))):
     proveedores_eliminados = await crud.obtener_proveedores_eliminados(session)
     return templates.TemplateResponse(
         "proveedores_eliminados.html",
@@ -404,7 +679,7 @@ async def pagina_proveedores_eliminados(request: Request, session: AsyncSession
     )
 
 
-# Recuperar proveedor desde backup
+# Recuperar proveedor archivado
 @app.post("/proveedores/recuperar/{nit}")
 async def recuperar_proveedor(nit: str, session: AsyncSession = Depends(get_session)):
     await crud.recuperar_proveedor(session, nit)
@@ -413,7 +688,7 @@ async def recuperar_proveedor(nit: str, session: AsyncSession = Depends(get_sess
 
 # API JSON: obtener todos los proveedores
 @app.get("/proveedores/")
-async def obtener_proveedores(skip: int = 0, limit: int = 100, session: AsyncSession = Depends(get_session)):
+async def obtener_proveedores(skip: int = 0, limit: int = 100, session: AsyncSession = Depends(_sesion_lectura("proveedor"))):
     proveedores = await crud.obtener_todos_proveedores(session, skip, limit)
     return {"proveedores": proveedores, "total": len(proveedores)}
 
@@ -426,9 +701,10 @@ async def actualizar_proveedor(
     direccion: str = None,
     ciudad: str = None,
     contacto: str = None,
+    version: Optional[int] = None,
     session: AsyncSession = Depends(get_session)
 ):
-    proveedor = await crud.actualizar_proveedor(session, nit, nombre, direccion, ciudad, contacto)
+    proveedor = await crud.actualizar_proveedor(session, nit, nombre, direccion, ciudad, contacto, version)
     if not proveedor:
         raise HTTPException(status_code=404, detail="Proveedor no encontrado")
     return {"message": "Proveedor actualizado exitosamente", "proveedor": proveedor}
@@ -445,7 +721,119 @@ async def pagina_compras(request: Request):
     return templates.TemplateResponse("compras.html", {"request": request})
 
 
+# ===== REPORTES DE VENTAS =====
+def _rango_fechas(desde: Optional[date], hasta: Optional[date], dias: int = 30):
+    hasta = hasta or date.today()
+    desde = desde or hasta - timedelta(days=dias - 1)
+    if desde > hasta:
+        raise HTTPException(status_code=400, detail="Rango de fechas inválido")
+    return desde, hasta
+
+
+@app.get("/reportes/ventas/diarias")
+async def reporte_ventas_diarias(
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    session: AsyncSession = Depends(get_session_lectura)
+):
+    """Ventas por día (por defecto, los últimos 30 días)"""
+    desde, hasta = _rango_fechas(desde, hasta)
+    dias = await crud.resumen_ventas_diarias(session, desde, hasta)
+    return {
+        "desde": desde,
+        "hasta": hasta,
+        "dias": dias,
+        "num_ventas": sum(d.num_ventas for d in dias),
+        "total": sum(d.total for d in dias)
+    }
+
+
+@app.get("/reportes/ventas/productos")
+async def reporte_top_productos(
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    limite: int = 10,
+    orden: str = "total",
+    session: AsyncSession = Depends(get_session_lectura)
+):
+    """Productos más vendidos en el rango, por total vendido o por unidades"""
+    if orden not in ("total", "unidades"):
+        raise HTTPException(status_code=400, detail="orden debe ser 'total' o 'unidades'")
+    desde, hasta = _rango_fechas(desde, hasta)
+    productos = await crud.top_productos_vendidos(session, desde, hasta, limite, orden)
+    return {"desde": desde, "hasta": hasta, "productos": productos}
+
+
+@app.get("/reportes/ventas/clientes")
+async def reporte_top_clientes(
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    limite: int = 10,
+    session: AsyncSession = Depends(get_session_lectura)
+):
+    """Clientes con más compras en el rango"""
+    desde, hasta = _rango_fechas(desde, hasta)
+    clientes = await crud.top_clientes(session, desde, hasta, limite)
+    return {"desde": desde, "hasta": hasta, "clientes": clientes}
+
+
+@app.post("/reportes/ventas/reconstruir")
+async def reconstruir_reportes_ventas(session: AsyncSession = Depends(get_session)):
+    """Recalcula los resúmenes desde las tablas de ventas"""
+    ventas = await crud.reconstruir_resumenes_ventas(session)
+    return {"message": f"Resúmenes recalculados a partir de {ventas} ventas"}
+
+
+# ===== EXPORTACIONES =====
+@app.get("/exportar/{tabla}")
+async def exportar_tabla(tabla: str, formato: str = "csv"):
+    """Exporta productos, clientes, proveedores o compras (con su detalle) como CSV o NDJSON en streaming"""
+    if tabla not in exportacion.TABLAS:
+        raise HTTPException(status_code=404, detail=f"No se puede exportar '{tabla}'")
+    if formato not in exportacion.FORMATOS:
+        raise HTTPException(status_code=400, detail="Formato no soportado (csv o ndjson)")
+
+    return StreamingResponse(
+        exportacion.exportar(tabla, formato),
+        media_type=exportacion.FORMATOS[formato],
+        headers={"Content-Disposition": f'attachment; filename="{tabla}.{formato}"'}
+    )
+
+
 # ===== ENDPOINTS DE UTILIDAD =====
+@app.get("/health/db")
+async def salud_db(session: AsyncSession = Depends(get_session)):
+    """Estado del pool de conexiones, latencia de un SELECT 1 y estado de la réplica de lectura (si hay)"""
+    inicio = time.perf_counter()
+    await session.execute(text("SELECT 1"))
+    latencia_ms = (time.perf_counter() - inicio) * 1000
+    estado = {"pool": estado_pool(), "latencia_ms": round(latencia_ms, 2)}
+    if ruta_lectura.configurada:
+        await ruta_lectura.revisar()
+        estado["replica"] = {**ruta_lectura.estadisticas(), "pool": estado_pool(read_engine)}
+    return estado
+
+
+@app.get("/metrics")
+async def exportar_metricas():
+    """Métricas en formato de texto de Prometheus"""
+    contenido = (
+        metricas.metricas.exportar()
+        + metricas.gauges("db_pool", estado_pool(), "Estado del pool de conexiones")
+        + metricas.gauges("db_replica", ruta_lectura.estadisticas(), "Réplica de lectura")
+        + metricas.gauges("escritor", escritor.estadisticas(), "Escritor de archivos en segundo plano")
+        + metricas.gauges("cache_categorias", crud.cache_categorias.estadisticas(), "Caché de categorías")
+        + metricas.gauges("alertas_stock", canal_alertas.estadisticas(), "Canal de alertas de stock")
+        + metricas.gauges("idempotencia", registro_idempotencia.estadisticas(), "Claves de idempotencia")
+    )
+    return PlainTextResponse(contenido, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/health/escritor")
+async def salud_escritor():
+    """Profundidad de la cola de archivos pendientes por escribir"""
+    return escritor.estadisticas()
+
 @app.get("/verificar/categoria/{categoria_id}")
 async def verificar_categoria_existe(categoria_id: int, session: AsyncSession = Depends(get_session)):
     """Verificar si una categoría existe"""
@@ -458,7 +846,8 @@ async def mostrar_formulario_compra(request: Request, session: AsyncSession = De
     return templates.TemplateResponse("compras_nueva.html", {
         "request": request,
         "proveedores": proveedores,
-        "productos": productos
+        "productos": productos,
+        "clave_idempotencia": uuid.uuid4().hex
     })
 @app.post("/compras/nueva")
 async def registrar_nueva_compra(
@@ -467,25 +856,58 @@ async def registrar_nueva_compra(
     productos_ids: list[str] = Form(...),
     cantidades: list[int] = Form(...),
     precios: list[float] = Form(...),
+    idempotency_key: Optional[str] = Form(None),
     session: AsyncSession = Depends(get_session)
 ):
     productos_comprados = [
         (productos_ids[i], cantidades[i], precios[i]) for i in range(len(productos_ids))
     ]
 
-    await crud.registrar_compra(session, nit_proveedor, productos_comprados)
-
-    return RedirectResponse(url="/compras/historial", status_code=303)
+    # Un reintento con la misma clave no registra la compra otra vez; responde igual que la primera
+    clave = _clave_idempotencia(request, idempotency_key)
+    huella = idempotencia.huella("compra", nit_proveedor, productos_comprados) if clave else None
+    async with (registro_idempotencia.reservar(clave) if clave else nullcontext()):
+        repetida = clave and await _buscar_clave_idempotencia(session, clave, "compra", huella) is not None
+        if not repetida:
+            try:
+                await crud.registrar_compra(session, nit_proveedor, productos_comprados, clave, huella)
+            except LookupError as e:
+                raise HTTPException(status_code=404, detail=str(e))
+            except IntegrityError:
+                repetida = clave and await _buscar_clave_idempotencia(session, clave, "compra", huella) is not None
+                if not repetida:
+                    raise HTTPException(status_code=400, detail="No se pudo registrar la compra")
+
+    respuesta = RedirectResponse(url="/compras/historial", status_code=303)
+    if repetida:
+        respuesta.headers["Idempotent-Replayed"] = "true"
+    return respuesta
 @app.get("/compras/historial")
-async def historial_compras(request: Request, session: AsyncSession = Depends(get_session)):
-    compras = await crud.obtener_todas_compras(session)
+async def historial_compras(
+    request: Request,
+    page: int = 1,
+    page_size: int = 20,
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    session: AsyncSession = Depends(_sesion_lectura("compra"))
+):
+    if page < 1 or page_size < 1:
+        raise HTTPException(status_code=400, detail="Página inválida")
+
+    compras, total = await crud.obtener_compras_paginadas(session, page, page_size, desde, hasta)
     return templates.TemplateResponse("compras_historial.html", {
         "request": request,
-        "compras": compras
+        "compras": compras,
+        "total": total,
+        "current_page": page,
+        "total_pages": (total + page_size - 1) // page_size,
+        "page_size": page_size,
+        "desde": desde,
+        "hasta": hasta
     })
 @app.get("/compras/detalle/{id_compra}")
 @app.get("/compras/detalle/{id_compra}")
-async def detalle_compra(request: Request, id_compra: int, session: AsyncSession = Depends(get_session)):
+async def detalle_compra(request: Request, id_compra: int, session: AsyncSession = Depends(_sesion_lectura("compra"))):
     data = await crud.obtener_detalle_compra(session, id_compra)
     if not data:
         raise HTTPException(status_code=404, detail="Compra no encontrada")
@@ -519,13 +941,12 @@ async def verificar_stock_disponible(producto_id: str, cantidad: int, session: A
 
 @app.get("/ventas/hacer_venta")
 async def pagina_hacer_venta(request: Request, session: AsyncSession = Depends(get_session)):
-    """Página para registrar una venta"""
-    clientes = await crud.obtener_todos_clientes(session)
+    """Página para registrar una venta (el cliente se elige con /clientes/buscar)"""
     productos = await crud.obtener_todos_productos(session)
     return templates.TemplateResponse("hacer_venta.html", {
         "request": request,
-        "clientes": clientes,
-        "productos": productos
+        "productos": productos,
+        "clave_idempotencia": uuid.uuid4().hex
     })
 
 
@@ -565,51 +986,109 @@ async def realizar_venta(request: Request, session: AsyncSession = Depends(get_s
     except Exception:
         raise HTTPException(status_code=400, detail="Cantidad inválida en formulario")
 
-    # Validar cliente
-    cliente = await crud.obtener_cliente_por_id(session, int(cliente_id))
-    if not cliente:
-        raise HTTPException(status_code=404, detail="Cliente no encontrado")
-
-    # Construir lista de tuples (producto_id, cantidad) y validar stock
+    # Construir lista de tuples (producto_id, cantidad)
     productos_para_venta = []
     for pid, qty in zip(producto_ids, cantidades):
         if qty <= 0:
             raise HTTPException(status_code=400, detail=f"Cantidad inválida para producto {pid}")
-
-        producto = await crud.obtener_producto_por_id(session, pid)
-        if not producto:
-            raise HTTPException(status_code=404, detail=f"Producto no encontrado (id: {pid})")
-
-        if not await crud.verificar_stock_disponible(session, pid, qty):
-            raise HTTPException(status_code=400, detail=f"No hay suficiente stock para {producto.nombre}")
-
         productos_para_venta.append((pid, qty))
 
-    # Llamar a operations.crear_venta_txt (que actualizará stock y generará el TXT)
-    nombre_archivo = await crud.crear_venta_txt(session, cliente.nombre, str(cliente.id_cliente), productos_para_venta)
+    # Si la caja reintenta con la misma clave se repite la respuesta de la venta original
+    clave = _clave_idempotencia(request, form.get("idempotency_key"))
+    huella = idempotencia.huella("venta", cliente_id, productos_para_venta) if clave else None
+    async with (registro_idempotencia.reservar(clave) if clave else nullcontext()):
+        if clave:
+            id_venta = await _buscar_clave_idempotencia(session, clave, "venta", huella)
+            if id_venta is not None:
+                return await _repetir_venta(request, session, id_venta)
+
+        # Validar cliente
+        cliente = await crud.obtener_cliente_por_id(session, int(cliente_id))
+        if not cliente:
+            raise HTTPException(status_code=404, detail="Cliente no encontrado")
+
+        # operations.crear_venta_txt valida existencia y stock, descuenta y guarda la venta en una sola transacción
+        try:
+            venta, detalles, nombre_archivo = await crud.crear_venta_txt(
+                session, cliente, productos_para_venta, clave, huella
+            )
+        except LookupError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except IntegrityError:
+            # Otro worker confirmó primero una venta con la misma clave
+            id_venta = await _buscar_clave_idempotencia(session, clave, "venta", huella) if clave else None
+            if id_venta is None:
+                raise HTTPException(status_code=400, detail="No se pudo registrar la venta")
+            return await _repetir_venta(request, session, id_venta)
 
     # Renderizar vista de éxito mostrando lista de vendidos y ruta del archivo
     return templates.TemplateResponse("venta_exitosa.html", {
         "request": request,
         "cliente": cliente,
-        "productos": productos_para_venta,
+        "venta": venta,
+        "detalles": detalles,
         "archivo": nombre_archivo
     })
+
+
+async def _repetir_venta(request: Request, session: AsyncSession, id_venta: int):
+    """Vuelve a mostrar una venta ya registrada, sin tocar stock ni recibos."""
+    data = await crud.obtener_venta(session, id_venta)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Venta no encontrada")
+    respuesta = templates.TemplateResponse("venta_exitosa.html", {
+        "request": request,
+        "cliente": data["cliente"],
+        "venta": data["venta"],
+        "detalles": data["detalles"],
+        "archivo": data["venta"].archivo
+    })
+    respuesta.headers["Idempotent-Replayed"] = "true"
+    return respuesta
+
+
+@app.get("/ventas/{id_venta}/recibo")
+async def recibo_venta(id_venta: int, session: AsyncSession = Depends(get_session)):
+    """Texto del recibo generado desde Venta / Detalle_Venta"""
+    recibo = await crud.obtener_recibo_venta(session, id_venta)
+    if recibo is None:
+        raise HTTPException(status_code=404, detail="Venta no encontrada")
+    return PlainTextResponse(recibo)
+
+
+@app.get("/clientes/{cliente_id}/ventas")
+async def ventas_por_cliente(cliente_id: int, session: AsyncSession = Depends(_sesion_lectura("venta"))):
+    ventas = await crud.obtener_ventas_por_cliente(session, cliente_id)
+    return {"ventas": ventas, "total": len(ventas)}
+
+
 @app.get("/ventas/historial_ventas")
-async def historial_ventas(request: Request):
-    ruta_ventas = "ventas_txt"
-    ventas = []
-
-    # Si la carpeta existe, leer los archivos .txt
-    if os.path.exists(ruta_ventas):
-        for archivo in os.listdir(ruta_ventas):
-            if archivo.endswith(".txt"):
-                ruta_archivo = os.path.join(ruta_ventas, archivo)
-                with open(ruta_archivo, "r", encoding="utf-8") as f:
-                    contenido = f.read()
-                ventas.append({"nombre": archivo, "contenido": contenido})
+async def historial_ventas(
+    request: Request,
+    page: int = 1,
+    page_size: int = 20,
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    session: AsyncSession = Depends(_sesion_lectura("venta"))
+):
+    """Historial paginado desde la tabla Venta; solo arma los recibos de la página actual."""
+    if page < 1 or page_size < 1:
+        raise HTTPException(status_code=400, detail="Página inválida")
+
+    ventas, total = await crud.obtener_ventas_paginadas(session, page, page_size, desde, hasta)
 
     return templates.TemplateResponse(
         "historial_ventas.html",
-        {"request": request, "ventas": ventas}
-    )
\ No newline at end of file
+        {
+            "request": request,
+            "ventas": ventas,
+            "total": total,
+            "current_page": page,
+            "total_pages": (total + page_size - 1) // page_size,
+            "page_size": page_size,
+            "desde": desde,
+            "hasta": hasta
+        }
+    )
@@ -0,0 +1,250 @@
+"""
+Métricas de la app en formato de texto de Prometheus (GET /metrics).
+
+- MiddlewareMetricas: middleware ASGI que mide la latencia de cada petición por ruta
+  (la plantilla de la ruta, p. ej. /clientes/{cliente_id}, no la URL concreta).
+- instrumentar_engine: eventos before/after_cursor_execute de SQLAlchemy que cuentan las
+  consultas y el tiempo en la base de datos de la petición en curso (vía contextvar).
+- Si una misma sentencia SQL se repite UMBRAL_N_MAS_1 veces o más en una petición se cuenta
+  como patrón N+1 y se registra un warning con la ruta y la sentencia.
+
+Todo es por proceso: con varios workers cada uno expone sus propias métricas.
+"""
+import logging
+import os
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_CONSULTAS = (1, 2, 5, 10, 20, 50, 100)
+UMBRAL_N_MAS_1 = int(os.getenv("METRICAS_UMBRAL_N_MAS_1", "10"))
+
+
+class Histograma:
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.conteos = [0] * len(buckets)
+        self.suma = 0.0
+        self.cuenta = 0
+
+    def observar(self, valor: float):
+        self.suma += valor
+        self.cuenta += 1
+        for i, limite in enumerate(self.buckets):
+            if valor <= limite:
+                self.conteos[i] += 1
+                break
+
+    def acumulados(self) -> Iterable[Tuple[str, int]]:
+        total = 0
+        for limite, conteo in zip(self.buckets, self.conteos):
+            total += conteo
+            yield _numero(limite), total
+        yield "+Inf", self.cuenta
+
+
+class EstadoPeticion:
+    """Lo que la petición en curso lleva ejecutado en la base de datos."""
+
+    def __init__(self):
+        self.consultas = 0
+        self.segundos_db = 0.0
+        self.sentencias: Counter = Counter()
+
+
+_peticion_actual: ContextVar[Optional[EstadoPeticion]] = ContextVar("peticion_actual", default=None)
+
+
+class Metricas:
+
+    def __init__(self, umbral_n_mas_1: int = UMBRAL_N_MAS_1):
+        self.umbral_n_mas_1 = umbral_n_mas_1
+        self.latencias: Dict[Tuple[str, str, str], Histograma] = {}
+        self.consultas_por_peticion: Dict[Tuple[str, str], Histograma] = {}
+        self.segundos_db: Dict[Tuple[str, str], float] = defaultdict(float)
+        self.n_mas_1: Dict[Tuple[str, str], int] = defaultdict(int)
+        # Incluye las consultas hechas fuera de una petición (arranque, CLIs)
+        self.consultas_total = 0
+        self.segundos_db_total = 0.0
+
+    # --- eventos de SQLAlchemy ---
+
+    def instrumentar_engine(self, engine):
+        """engine: un AsyncEngine (se instrumenta su sync_engine) o un Engine."""
+        engine = getattr(engine, "sync_engine", engine)
+        event.listen(engine, "before_cursor_execute", self._antes_de_ejecutar)
+        event.listen(engine, "after_cursor_execute", self._despues_de_ejecutar)
+
+    def _antes_de_ejecutar(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metricas_inicio", []).append(time.perf_counter())
+
+    def _despues_de_ejecutar(self, conn, cursor, statement, parameters, context, executemany):
+        segundos = time.perf_counter() - conn.info["metricas_inicio"].pop()
+        self.consultas_total += 1
+        self.segundos_db_total += segundos
+
+        estado = _peticion_actual.get()
+        if estado is not None:
+            estado.consultas += 1
+            estado.segundos_db += segundos
+            estado.sentencias[statement] += 1
+
+    # --- peticiones ---
+
+    def registrar_peticion(self, metodo: str, ruta: str, estado_http: int, segundos: float, estado: EstadoPeticion):
+        clave = (metodo, ruta, str(estado_http))
+        if clave not in self.latencias:
+            self.latencias[clave] = Histograma(BUCKETS_SEGUNDOS)
+        self.latencias[clave].observar(segundos)
+
+        clave = (metodo, ruta)
+        if clave not in self.consultas_por_peticion:
+            self.consultas_por_peticion[clave] = Histograma(BUCKETS_CONSULTAS)
+        self.consultas_por_peticion[clave].observar(estado.consultas)
+        self.segundos_db[clave] += estado.segundos_db
+
+        if estado.sentencias:
+            sentencia, repeticiones = estado.sentencias.most_common(1)[0]
+            if repeticiones >= self.umbral_n_mas_1:
+                self.n_mas_1[clave] += 1
+                logger.warning(
+                    "Posible N+1 en %s %s: la misma consulta se ejecutó %d veces (%s)",
+                    metodo, ruta, repeticiones, " ".join(sentencia.split())[:200]
+                )
+
+    def resumen_rutas(self) -> dict:
+        """{(metodo, ruta): {"peticiones", "consultas", "segundos_db"}} acumulado desde el arranque."""
+        return {
+            clave: {
+                "peticiones": histograma.cuenta,
+                "consultas": int(histograma.suma),
+                "segundos_db": self.segundos_db[clave],
+            }
+            for clave, histograma in self.consultas_por_peticion.items()
+        }
+
+    # --- exportación ---
+
+    def exportar(self) -> str:
+        lineas = []
+
+        lineas += _encabezado("http_request_duration_seconds", "histogram", "Latencia de las peticiones HTTP por ruta")
+        for (metodo, ruta, estado_http), histograma in sorted(self.latencias.items()):
+            etiquetas = {"method": metodo, "route": ruta, "status": estado_http}
+            lineas += _lineas_histograma("http_request_duration_seconds", etiquetas, histograma)
+
+        lineas += _encabezado("http_request_db_queries", "histogram", "Consultas SQL por petición")
+        for (metodo, ruta), histograma in sorted(self.consultas_por_peticion.items()):
+            lineas += _lineas_histograma("http_request_db_queries", {"method": metodo, "route": ruta}, histograma)
+
+        lineas += _encabezado("http_request_db_seconds_total", "counter", "Tiempo acumulado en la base de datos por ruta")
+        for (metodo, ruta), segundos in sorted(self.segundos_db.items()):
+            lineas.append(_muestra("http_request_db_seconds_total", {"method": metodo, "route": ruta}, segundos))
+
+        lineas += _encabezado("http_request_n_plus_one_total", "counter", f"Peticiones que repitieron una consulta {self.umbral_n_mas_1} veces o más")
+        for (metodo, ruta), veces in sorted(self.n_mas_1.items()):
+            lineas.append(_muestra("http_request_n_plus_one_total", {"method": metodo, "route": ruta}, veces))
+
+        lineas += _encabezado("db_queries_total", "counter", "Consultas SQL ejecutadas por el proceso")
+        lineas.append(_muestra("db_queries_total", {}, self.consultas_total))
+        lineas += _encabezado("db_query_seconds_total", "counter", "Tiempo acumulado de las consultas SQL del proceso")
+        lineas.append(_muestra("db_query_seconds_total", {}, self.segundos_db_total))
+
+        return "\n".join(lineas) + "\n"
+
+
+def _numero(valor) -> str:
+    if isinstance(valor, bool):
+        return "1" if valor else "0"
+    if isinstance(valor, float):
+        return str(int(valor)) if valor.is_integer() else repr(valor)
+    return str(valor)
+
+
+def _escapar(valor: str) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _muestra(nombre: str, etiquetas: dict, valor) -> str:
+    if etiquetas:
+        texto = ",".join(f'{clave}="{_escapar(v)}"' for clave, v in etiquetas.items())
+        return f"{nombre}{{{texto}}} {_numero(valor)}"
+    return f"{nombre} {_numero(valor)}"
+
+
+def _encabezado(nombre: str, tipo: str, ayuda: str) -> list:
+    return [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} {tipo}"]
+
+
+def _lineas_histograma(nombre: str, etiquetas: dict, histograma: Histograma) -> list:
+    lineas = [_muestra(f"{nombre}_bucket", {**etiquetas, "le": le}, conteo) for le, conteo in histograma.acumulados()]
+    lineas.append(_muestra(f"{nombre}_sum", etiquetas, histograma.suma))
+    lineas.append(_muestra(f"{nombre}_count", etiquetas, histograma.cuenta))
+    return lineas
+
+
+def gauges(prefijo: str, valores: dict, ayuda: str) -> str:
+    """Exporta los valores numéricos de un dict de estadísticas (escritor, caché, pool...) como gauges."""
+    lineas = []
+    for clave, valor in valores.items():
+        if isinstance(valor, (int, float)):
+            nombre = f"{prefijo}_{clave}"
+            lineas += _encabezado(nombre, "gauge", f"{ayuda}: {clave}")
+            lineas.append(_muestra(nombre, {}, valor))
+    return "\n".join(lineas) + "\n" if lineas else ""
+
+
+class MiddlewareMetricas:
+    """Middleware ASGI puro: no envuelve el cuerpo de la respuesta, solo mira el status y el tiempo."""
+
+    def __init__(self, app, registro: Optional[Metricas] = None):
+        self.app = app
+        self.registro = registro
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        estado = EstadoPeticion()
+        token = _peticion_actual.set(estado)
+        estado_http = 500
+        inicio = time.perf_counter()
+
+        async def enviar(mensaje):
+            nonlocal estado_http
+            if mensaje["type"] == "http.response.start":
+                estado_http = mensaje["status"]
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            _peticion_actual.reset(token)
+            (self.registro or metricas).registrar_peticion(
+                scope["method"], _ruta(scope), estado_http, time.perf_counter() - inicio, estado
+            )
+
+
+def _ruta(scope) -> str:
+    """
+    Plantilla de la ruta que atendió la petición. FastAPI deja la ruta en el scope; un Mount
+    (p. ej. /static) deja su app como endpoint y su prefijo en root_path. Las URLs que no
+    coinciden con nada se agrupan para no crear una serie por cada 404.
+    """
+    ruta = scope.get("route")
+    if ruta is not None:
+        return ruta.path
+    if "endpoint" in scope:
+        return scope.get("root_path") or "sin_ruta"
+    return "sin_ruta"
+
+
+metricas = Metricas()
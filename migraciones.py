@@ -0,0 +1,303 @@
+"""
+Migraciones de esquema versionadas.
+
+La tabla esquema_version guarda las migraciones ya aplicadas. Al arrancar, cada worker hace una
+sola consulta (la versión máxima); si coincide con la última de MIGRACIONES no hace nada más.
+Si hay pendientes, las aplica con un candado consultivo de PostgreSQL (pg_advisory_lock), así
+que con varios workers solo uno migra y los demás esperan y encuentran la versión al día.
+Con SQLite (desarrollo, benchmarks) no hay candado: se asume un solo proceso.
+
+Cada migración corre en su propia transacción, salvo las que crean índices en tablas que ya
+existen: en PostgreSQL usan CREATE INDEX CONCURRENTLY (sin transacción) para no bloquear las
+escrituras mientras se construyen. Los cambios de columnas son aditivos (ADD COLUMN con un
+default constante), que en PostgreSQL 11+ no reescriben la tabla.
+
+Una base de datos vacía (instalación nueva) no recorre la lista: create_all la deja con el
+esquema de los modelos actuales y se marca directamente en la última versión. La lista solo se
+aplica a bases de datos que ya existían; la migración 1 es para las anteriores a esta tabla y
+solo crea las tablas que les falten. Como lo que ya existe puede venir de cualquier versión
+anterior, cada migración revisa qué hay antes de cambiarlo. Una migración publicada no se
+edita; los cambios nuevos van en una migración nueva al final de la lista (y en los modelos).
+
+Uso desde consola:
+    python migraciones.py            # aplica las pendientes
+    python migraciones.py --estado   # versión actual, pendientes e índices faltantes
+"""
+import argparse
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, List
+
+from sqlalchemy import func, inspect, insert, select, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.schema import CreateIndex
+from sqlmodel import SQLModel
+
+from modelSQL import EsquemaVersion
+
+logger = logging.getLogger(__name__)
+
+# Clave del candado consultivo de PostgreSQL (cualquier entero fijo, igual en todos los workers)
+CLAVE_CANDADO = 7_215_401
+
+
+@dataclass(frozen=True)
+class Migracion:
+    version: int
+    descripcion: str
+    aplicar: Callable  # recibe una Connection síncrona (se llama con run_sync)
+    transaccional: bool = True
+
+
+# ===== UTILIDADES =====
+
+def _tablas(conn) -> set:
+    return set(inspect(conn).get_table_names())
+
+def _columnas(conn, tabla: str) -> set:
+    return {columna["name"] for columna in inspect(conn).get_columns(tabla)}
+
+def _aplica_en(indice, dialecto: str) -> bool:
+    """False para los índices que solo se crean en otro motor (p. ej. el GIN de pg_trgm en SQLite)."""
+    condicion = indice._ddl_if
+    return condicion is None or condicion.dialect in (None, dialecto)
+
+def indices_faltantes(conn) -> List[str]:
+    """Tablas e índices declarados en los modelos que no están en la base de datos."""
+    inspector = inspect(conn)
+    tablas = set(inspector.get_table_names())
+    faltantes = []
+    for tabla in SQLModel.metadata.sorted_tables:
+        if tabla.name not in tablas:
+            faltantes.append(tabla.name)
+            continue
+        existentes = {indice["name"] for indice in inspector.get_indexes(tabla.name)}
+        for indice in tabla.indexes:
+            if _aplica_en(indice, conn.dialect.name) and indice.name not in existentes:
+                faltantes.append(f"{tabla.name}.{indice.name}")
+    return faltantes
+
+
+# ===== MIGRACIONES =====
+
+def _tablas_del_modelo(conn):
+    """
+    Crea las tablas que no existen (con sus índices); no toca las que ya están. Corre solo en
+    bases de datos anteriores a esquema_version: las nuevas se crean en instalar().
+    """
+    SQLModel.metadata.create_all(conn)
+
+# (tabla, columna, definición): columnas agregadas a tablas que ya existían en la primera versión
+COLUMNAS_NUEVAS = (
+    ("categoria", "stock_minimo", "INTEGER NOT NULL DEFAULT 3"),
+    ("producto", "stock_minimo", "INTEGER NOT NULL DEFAULT 3"),
+    ("producto", "version", "INTEGER NOT NULL DEFAULT 1"),
+    ("producto", "eliminado_en", "TIMESTAMP"),
+    ("cliente", "version", "INTEGER NOT NULL DEFAULT 1"),
+    ("proveedor", "version", "INTEGER NOT NULL DEFAULT 1"),
+    ("proveedor", "eliminado_en", "TIMESTAMP"),
+)
+
+def _columnas_nuevas(conn):
+    for tabla, columna, definicion in COLUMNAS_NUEVAS:
+        if columna not in _columnas(conn, tabla):
+            conn.execute(text(f"ALTER TABLE {tabla} ADD COLUMN {columna} {definicion}"))
+
+def _backups_a_borrado_logico(conn):
+    """
+    Pasa las filas de ProductoBackup / ProveedorBackup a la tabla principal como archivadas y
+    borra la tabla de backup. Si algún id ya existe en la tabla principal (se volvió a crear)
+    esa fila no se mueve y la tabla de backup se conserva para revisarla a mano.
+    """
+    ahora = datetime.now()
+    tablas = _tablas(conn)
+
+    if "productobackup" in tablas:
+        stock_minimo = "b.stock_minimo" if "stock_minimo" in _columnas(conn, "productobackup") else "3"
+        conn.execute(text(
+            "INSERT INTO producto (id_producto, nombre, precio, stock, id_categoria, stock_minimo, version, eliminado_en) "
+            f"SELECT b.id_producto, b.nombre, b.precio, b.stock, b.id_categoria, {stock_minimo}, 1, :ahora "
+            "FROM productobackup b WHERE NOT EXISTS (SELECT 1 FROM producto p WHERE p.id_producto = b.id_producto)"
+        ), {"ahora": ahora})
+        conn.execute(text(
+            "DELETE FROM productobackup WHERE id_producto IN "
+            "(SELECT id_producto FROM producto WHERE eliminado_en = :ahora)"
+        ), {"ahora": ahora})
+        _borrar_si_vacia(conn, "productobackup")
+
+    if "proveedorbackup" in tablas:
+        conn.execute(text(
+            "INSERT INTO proveedor (nit, nombre, contacto, direccion, ciudad, version, eliminado_en) "
+            "SELECT b.nit, b.nombre, b.contacto, b.direccion, b.ciudad, 1, :ahora "
+            "FROM proveedorbackup b WHERE NOT EXISTS (SELECT 1 FROM proveedor p WHERE p.nit = b.nit)"
+        ), {"ahora": ahora})
+        conn.execute(text(
+            "DELETE FROM proveedorbackup WHERE nit IN (SELECT nit FROM proveedor WHERE eliminado_en = :ahora)"
+        ), {"ahora": ahora})
+        _borrar_si_vacia(conn, "proveedorbackup")
+
+def _borrar_si_vacia(conn, tabla: str):
+    restantes = conn.execute(text(f"SELECT COUNT(*) FROM {tabla}")).scalar()
+    if restantes:
+        logger.warning("%s conserva %d filas cuyo id ya existe en la tabla principal; revíselas a mano", tabla, restantes)
+    else:
+        conn.execute(text(f"DROP TABLE {tabla}"))
+
+def _indices_declarados(conn):
+    """Crea los índices de los modelos que faltan en tablas que ya existían (create_all no los agrega)."""
+    postgres = conn.dialect.name == "postgresql"
+    if postgres:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
+    inspector = inspect(conn)
+    for tabla in SQLModel.metadata.sorted_tables:
+        existentes = {indice["name"] for indice in inspector.get_indexes(tabla.name)}
+        for indice in sorted(tabla.indexes, key=lambda i: i.name):
+            if indice.name in existentes or not _aplica_en(indice, conn.dialect.name):
+                continue
+            if indice.name == "ix_cliente_email":
+                _comprobar_emails_unicos(conn)
+            ddl = str(CreateIndex(indice).compile(dialect=conn.dialect))
+            if postgres:
+                # Sin transacción: construye el índice sin bloquear las escrituras de la tabla
+                ddl = ddl.replace(" INDEX ", " INDEX CONCURRENTLY ", 1)
+            logger.info("Creando índice %s", indice.name)
+            conn.execute(text(ddl))
+
+def _comprobar_emails_unicos(conn):
+    repetidos = conn.execute(text(
+        "SELECT email FROM cliente GROUP BY email HAVING COUNT(*) > 1 ORDER BY email LIMIT 10"
+    )).scalars().all()
+    if repetidos:
+        raise RuntimeError(
+            "No se puede crear el índice único de Cliente.email; emails repetidos: " + ", ".join(repetidos)
+        )
+
+def _indices_listado_clientes(conn):
+    """Cambia ix_cliente_activo_nombre por ix_cliente_listado (con id_cliente) y agrega los índices de búsqueda."""
+    concurrente = " CONCURRENTLY" if conn.dialect.name == "postgresql" else ""
+    conn.execute(text(f"DROP INDEX{concurrente} IF EXISTS ix_cliente_activo_nombre"))
+    _indices_declarados(conn)
+
+
+MIGRACIONES: List[Migracion] = [
+    Migracion(1, "Tablas de los modelos", _tablas_del_modelo),
+    Migracion(2, "Columnas stock_minimo, version y eliminado_en", _columnas_nuevas),
+    Migracion(3, "Tablas de backup a borrado lógico", _backups_a_borrado_logico),
+    Migracion(4, "Índices declarados en los modelos", _indices_declarados, transaccional=False),
+    Migracion(5, "Índices del listado paginado y la búsqueda de clientes", _indices_listado_clientes, transaccional=False),
+]
+
+
+# ===== EJECUCIÓN =====
+
+def instalar(conn):
+    """
+    Base de datos vacía: crea el esquema de los modelos actuales y registra todas las migraciones
+    como aplicadas (ya están incluidas en los modelos).
+    """
+    SQLModel.metadata.create_all(conn)
+    ahora = datetime.now()
+    conn.execute(insert(EsquemaVersion), [
+        {"version": m.version, "descripcion": m.descripcion, "aplicada_en": ahora} for m in MIGRACIONES
+    ])
+
+async def version_actual(engine) -> int:
+    """Última migración aplicada (0 si la tabla esquema_version no existe)."""
+    try:
+        async with engine.connect() as conn:
+            version = await conn.scalar(select(func.max(EsquemaVersion.version)))
+    except DBAPIError:
+        return 0
+    return version or 0
+
+async def migrar(engine) -> int:
+    """Aplica las migraciones pendientes y devuelve cuántas aplicó."""
+    if await version_actual(engine) >= MIGRACIONES[-1].version:
+        return 0
+
+    aplicadas = 0
+    async with engine.connect() as conn:
+        postgres = conn.dialect.name == "postgresql"
+        if postgres:
+            # Bloquea hasta que el worker que esté migrando termine
+            await conn.execute(text("SELECT pg_advisory_lock(:clave)"), {"clave": CLAVE_CANDADO})
+            await conn.commit()
+        try:
+            vacia = not await conn.run_sync(_tablas)
+            await conn.run_sync(lambda c: EsquemaVersion.__table__.create(c, checkfirst=True))
+            version = await conn.scalar(select(func.max(EsquemaVersion.version))) or 0
+            await conn.commit()
+
+            if vacia:
+                await conn.run_sync(instalar)
+                await conn.commit()
+                logger.info("Base de datos nueva: esquema creado en la versión %d", MIGRACIONES[-1].version)
+                version = MIGRACIONES[-1].version
+
+            for migracion in MIGRACIONES:
+                if migracion.version <= version:
+                    continue
+                logger.info("Aplicando migración %d: %s", migracion.version, migracion.descripcion)
+                registro = insert(EsquemaVersion).values(
+                    version=migracion.version, descripcion=migracion.descripcion, aplicada_en=datetime.now()
+                )
+                if migracion.transaccional:
+                    await conn.run_sync(migracion.aplicar)
+                    await conn.execute(registro)
+                    await conn.commit()
+                else:
+                    nivel = conn.default_isolation_level
+                    await conn.execution_options(isolation_level="AUTOCOMMIT")
+                    try:
+                        await conn.run_sync(migracion.aplicar)
+                        await conn.execute(registro)
+                        await conn.commit()
+                    finally:
+                        await conn.rollback()
+                        await conn.execution_options(isolation_level=nivel)
+                aplicadas += 1
+
+            faltantes = await conn.run_sync(indices_faltantes)
+            await conn.commit()
+            if faltantes:
+                logger.warning("Faltan tablas o índices en la base de datos: %s", ", ".join(faltantes))
+        except Exception:
+            await conn.rollback()
+            raise
+        finally:
+            if postgres:
+                await conn.execute(text("SELECT pg_advisory_unlock(:clave)"), {"clave": CLAVE_CANDADO})
+                await conn.commit()
+    return aplicadas
+
+
+async def _main():
+    parser = argparse.ArgumentParser(description="Aplica las migraciones de esquema pendientes")
+    parser.add_argument("--estado", action="store_true", help="solo muestra la versión y lo que falta")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    from DBengine import async_engine
+
+    try:
+        if args.estado:
+            version = await version_actual(async_engine)
+            pendientes = [m for m in MIGRACIONES if m.version > version]
+            print(f"Versión del esquema: {version} (última: {MIGRACIONES[-1].version})")
+            for migracion in pendientes:
+                print(f"  pendiente {migracion.version}: {migracion.descripcion}")
+            async with async_engine.connect() as conn:
+                faltantes = await conn.run_sync(indices_faltantes)
+            print("Tablas o índices faltantes: " + (", ".join(faltantes) if faltantes else "ninguno"))
+        else:
+            aplicadas = await migrar(async_engine)
+            print(f"{aplicadas} migraciones aplicadas")
+    finally:
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -1,75 +1,210 @@
-from datetime import datetime
+from datetime import datetime, date
+from typing import Optional
+from sqlalchemy import DDL, Index, event, text
+from sqlalchemy.orm import declared_attr
 from sqlmodel import Field, SQLModel, create_engine, Session, select
 
+STOCK_MINIMO_POR_DEFECTO = 3
+
+
+@declared_attr
+def _con_version(cls):
+    """
+    Concurrencia optimista: SQLAlchemy suma 1 a `version` en cada UPDATE del ORM y agrega
+    WHERE version = <la leída>; si otra transacción la cambió antes, el commit lanza StaleDataError.
+    """
+    return {"version_id_col": cls.__table__.c.version}
+
+
+def _campo_version():
+    return Field(default=1, sa_column_kwargs={"nullable": False, "server_default": "1"})
+
 
 class Categoria(SQLModel, table=True):
     id_categoria: int = Field(default=None, primary_key=True)
     tipo: str
     codigo: str
+    # Umbral de reposición que heredan los productos nuevos de la categoría
+    stock_minimo: int = Field(default=STOCK_MINIMO_POR_DEFECTO)
 
 
 class Producto(SQLModel, table=True):
-    id_producto: str = Field(default=None, primary_key=True)
-    nombre: str
-    precio: float
-    stock: int
-    id_categoria: int = Field(foreign_key="categoria.id_categoria")
+    __table_args__ = (
+        # Índice parcial: solo guarda los productos bajo su umbral, que son pocos
+        Index(
+            "ix_producto_bajo_stock",
+            "id_producto",
+            postgresql_where=text("stock < stock_minimo"),
+            sqlite_where=text("stock < stock_minimo"),
+        ),
+        # Solo los productos activos, en el orden de los listados (nombre, id)
+        Index(
+            "ix_producto_activo_nombre",
+            "nombre",
+            "id_producto",
+            postgresql_where=text("eliminado_en IS NULL"),
+            sqlite_where=text("eliminado_en IS NULL"),
+        ),
+        # Búsqueda ILIKE '%texto%' por nombre con trigramas; solo existe en PostgreSQL (extensión pg_trgm)
+        Index(
+            "ix_producto_nombre_trgm",
+            "nombre",
+            postgresql_using="gin",
+            postgresql_ops={"nombre": "gin_trgm_ops"},
+        ).ddl_if(dialect="postgresql"),
+    )
 
-class ProductoBackup(SQLModel, table=True):
     id_producto: str = Field(default=None, primary_key=True)
     nombre: str
     precio: float
     stock: int
-    id_categoria: int = Field(foreign_key="categoria.id_categoria")
+    id_categoria: int = Field(foreign_key="categoria.id_categoria", index=True)
+    stock_minimo: int = Field(default=STOCK_MINIMO_POR_DEFECTO)
+    # Los UPDATE masivos (ventas, ajustes por lote, importación) la incrementan a mano
+    version: int = _campo_version()
+    # Borrado lógico: cuándo se archivó (NULL = activo)
+    eliminado_en: Optional[datetime] = Field(default=None)
+
+    __mapper_args__ = _con_version
 
+class AjusteStock(SQLModel):
+    """Una línea de un ajuste de inventario por lote: stock nuevo o diferencia (delta)."""
+    id_producto: str
+    stock: Optional[int] = None
+    delta: Optional[int] = None
 
 class Cliente(SQLModel, table=True):
+    __table_args__ = (
+        # Orden del listado paginado de clientes: activos primero, luego por nombre (id desempata el cursor)
+        Index("ix_cliente_listado", text("activo DESC"), "nombre", "id_cliente"),
+        # Búsqueda por fragmento (ILIKE '%texto%') en nombre, teléfono y email; requiere pg_trgm
+        Index(
+            "ix_cliente_nombre_trgm",
+            "nombre",
+            postgresql_using="gin",
+            postgresql_ops={"nombre": "gin_trgm_ops"},
+        ).ddl_if(dialect="postgresql"),
+        Index(
+            "ix_cliente_telefono_trgm",
+            "telefono",
+            postgresql_using="gin",
+            postgresql_ops={"telefono": "gin_trgm_ops"},
+        ).ddl_if(dialect="postgresql"),
+        Index(
+            "ix_cliente_email_trgm",
+            "email",
+            postgresql_using="gin",
+            postgresql_ops={"email": "gin_trgm_ops"},
+        ).ddl_if(dialect="postgresql"),
+    )
+
     id_cliente: int = Field(default=None, primary_key=True)
     nombre: str
     telefono: str
-    email: str
+    # Único: buscar_cliente_por_email es una búsqueda por índice y dos altas simultáneas no duplican el email
+    email: str = Field(unique=True, index=True)
     activo: bool = Field(default=True)
+    version: int = _campo_version()
+
+    __mapper_args__ = _con_version
 
 
 
 class Venta(SQLModel, table=True):
-    id_venta_pk: str = Field(primary_key=True)
-    fecha: datetime
-    documento_fk: int = Field(foreign_key="cliente.documento_pk")
+    id_venta: int = Field(default=None, primary_key=True)
+    fecha: datetime = Field(index=True)
+    # Puede faltar en ventas históricas cargadas desde recibos TXT
+    id_cliente: Optional[int] = Field(default=None, foreign_key="cliente.id_cliente", index=True)
     total: float
+    archivo: Optional[str] = Field(default=None, unique=True)
 
 
 class Detalle_Venta(SQLModel, table=True):
-    id_detalleventa_pk: int = Field(primary_key=True)
-    id_venta_fk: str = Field(foreign_key="venta.id_venta_pk")
-    isbn_fk: str
+    id_detalle_venta: int = Field(default=None, primary_key=True)
+    id_venta: int = Field(foreign_key="venta.id_venta", index=True)
+    id_producto: Optional[str] = Field(default=None, foreign_key="producto.id_producto")
+    nombre_producto: str
     cantidad: int
     precio_unidad: float
 
 
+# Resúmenes de ventas que se actualizan en la misma transacción de cada venta
+class VentaDiaria(SQLModel, table=True):
+    fecha: date = Field(primary_key=True)
+    num_ventas: int = 0
+    unidades: int = 0
+    total: float = 0.0
+
+
+class VentaProductoDiaria(SQLModel, table=True):
+    fecha: date = Field(primary_key=True)
+    id_producto: str = Field(primary_key=True, index=True)
+    nombre_producto: str
+    unidades: int = 0
+    total: float = 0.0
+
+
+class VentaClienteDiaria(SQLModel, table=True):
+    fecha: date = Field(primary_key=True)
+    id_cliente: int = Field(primary_key=True, index=True)
+    num_ventas: int = 0
+    total: float = 0.0
+
+
 class Proveedor(SQLModel, table=True):
-    nit: str = Field(default=None, primary_key=True)
-    nombre: str
-    contacto: str
-    direccion: str
-    ciudad: str
+    __table_args__ = (
+        Index(
+            "ix_proveedor_activo_nombre",
+            "nombre",
+            postgresql_where=text("eliminado_en IS NULL"),
+            sqlite_where=text("eliminado_en IS NULL"),
+        ),
+    )
 
-class ProveedorBackup(SQLModel, table=True):
     nit: str = Field(default=None, primary_key=True)
     nombre: str
     contacto: str
     direccion: str
     ciudad: str
+    version: int = _campo_version()
+    # Borrado lógico: cuándo se archivó (NULL = activo)
+    eliminado_en: Optional[datetime] = Field(default=None)
+
+    __mapper_args__ = _con_version
 
 class Compra(SQLModel, table=True):
     id_compra: int = Field(default=None, primary_key=True)
-    fecha: datetime
+    fecha: datetime = Field(index=True)
     nit: str = Field(foreign_key="proveedor.nit")
 
 
 class Detalle_Compra(SQLModel, table=True):
     id_detalle_compra: int = Field(default=None, primary_key=True)
-    id_compra: int = Field(foreign_key="compra.id_compra")
+    id_compra: int = Field(foreign_key="compra.id_compra", index=True)
     id_producto: str = Field(foreign_key="producto.id_producto")
     cantidad: int
-    precio_unidad: float
\ No newline at end of file
+    precio_unidad: float
+
+class EsquemaVersion(SQLModel, table=True):
+    """Migraciones de esquema ya aplicadas (ver migraciones.py)."""
+    __tablename__ = "esquema_version"
+
+    version: int = Field(primary_key=True)
+    descripcion: str
+    aplicada_en: datetime
+
+class ClaveIdempotencia(SQLModel, table=True):
+    """Clave de idempotencia de una venta o compra ya registrada (ver idempotencia.py)."""
+    clave: str = Field(primary_key=True, max_length=100)
+    operacion: str  # "venta" o "compra"
+    huella: str
+    id_recurso: int
+    expira: datetime = Field(index=True)
+
+
+# Los índices *_trgm necesitan la extensión pg_trgm antes de crear las tablas
+event.listen(
+    SQLModel.metadata,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
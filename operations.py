@@ -1,18 +1,165 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, insert, update, delete, case, func, tuple_
 from sqlalchemy.exc import IntegrityError
-from typing import List, Optional
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.exc import StaleDataError
+from typing import Dict, List, Optional, Tuple
 from modelSQL import *
-from datetime import datetime
+from datetime import datetime, date, timedelta
+import base64
+import json
 import os
+import time
+import uuid
+from collections import defaultdict
 from modelSQL import Producto
+from escritor import escritor
+from busqueda import indice_productos
+from alertas import canal_alertas
+from idempotencia import registro_idempotencia
+
+# ===== VERSIONES DE TABLAS (ETag) =====
+
+class VersionesTablas:
+    """
+    Contador de cambios por tabla para los ETag de los listados.
+    Las funciones de escritura de este módulo llaman a cambio() después del commit y los endpoints
+    arman el ETag antes de consultar, así que responder 304 no toca la base de datos.
+    El id de arranque invalida los ETag de un proceso anterior. Los contadores son por proceso:
+    con varios workers, `ventana` (segundos) agrega un tramo de tiempo al ETag para acotar
+    cuánto puede servirse una copia que otro worker dejó desactualizada.
+    """
+
+    def __init__(self, ventana: float = 0):
+        self.ventana = ventana
+        self.arranque = uuid.uuid4().hex[:12]
+        self._versiones = defaultdict(int)
+        self._cambiada_en = {}
+
+    def cambio(self, *tablas: str):
+        ahora = time.monotonic()
+        for tabla in tablas:
+            self._versiones[tabla] += 1
+            self._cambiada_en[tabla] = ahora
+
+    def version(self, tabla: str) -> int:
+        return self._versiones[tabla]
+
+    def cambio_reciente(self, segundos: float, *tablas: str) -> bool:
+        """True si este proceso escribió en alguna de las tablas hace menos de `segundos`."""
+        limite = time.monotonic() - segundos
+        return any(self._cambiada_en.get(tabla, limite) > limite for tabla in tablas)
+
+    def etag(self, *tablas: str) -> str:
+        partes = [self.arranque] + [f"{tabla}.{self._versiones[tabla]}" for tabla in tablas]
+        if self.ventana > 0:
+            partes.append(str(int(time.time() // self.ventana)))
+        return '"' + "-".join(partes) + '"'
+
+
+# Los contadores son por worker: con varios workers (o los CLI escribiendo en la misma base) un
+# worker que no atendió la escritura sigue respondiendo 304 hasta que cambie el tramo de ETAG_VENTANA.
+# 0 desactiva el tramo; solo es seguro con un único proceso que escriba.
+versiones_tablas = VersionesTablas(ventana=float(os.getenv("ETAG_VENTANA", "5")))
+
+# ===== CONCURRENCIA OPTIMISTA =====
+
+class ConflictoVersion(Exception):
+    """Otro usuario modificó el registro después de que se leyó; `actual` es el estado vigente (None si lo borraron)."""
+
+    def __init__(self, actual):
+        super().__init__("El registro fue modificado por otra persona; revise los datos actuales e intente de nuevo")
+        self.actual = actual
+
+def _comprobar_version(objeto, version: Optional[int]):
+    """Compara la versión que el cliente leyó (si la envía) con la de la base de datos."""
+    if version is not None and objeto.version != version:
+        raise ConflictoVersion(objeto)
+
+async def _confirmar_version(session: AsyncSession, modelo, clave):
+    """
+    Commit de un objeto versionado. Si entre la lectura y el commit otra transacción lo cambió,
+    el UPDATE no encuentra la versión leída: se deshace y se lanza ConflictoVersion con el estado actual.
+    """
+    try:
+        await session.commit()
+    except StaleDataError:
+        await session.rollback()
+        raise ConflictoVersion(await session.get(modelo, clave, populate_existing=True))
+
 # ===== CATEGORÍAS =====
 
-async def crear_categoria(session: AsyncSession, tipo: str, codigo: str) -> Categoria:
-    categoria = Categoria(tipo=tipo, codigo=codigo)
+class CacheCategorias:
+    """
+    Caché en proceso de la tabla Categoria (cambia muy poco y la usan todos los listados de productos).
+    Cada escritura sube `version`; una carga que empezó antes de una invalidación no se guarda.
+    `max_age` (segundos) limita lo que puede durar una copia, p. ej. si otro worker cambió la tabla.
+    """
+
+    def __init__(self, max_age: float = 300.0):
+        self.max_age = max_age
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._categorias: Optional[List[Categoria]] = None
+        self._mapa: dict = {}
+        self._cargado_en = 0.0
+
+    def invalidar(self):
+        self.version += 1
+        self._categorias = None
+        self._mapa = {}
+
+    def _vigente(self) -> bool:
+        return self._categorias is not None and time.monotonic() - self._cargado_en < self.max_age
+
+    async def obtener(self, session: AsyncSession) -> List[Categoria]:
+        if self._vigente():
+            self.hits += 1
+            return self._categorias
+
+        self.misses += 1
+        version = self.version
+        result = await session.execute(select(Categoria).order_by(Categoria.id_categoria))
+        # Copias sin sesión, para no compartir instancias de una sesión entre peticiones
+        categorias = [
+            Categoria(id_categoria=c.id_categoria, tipo=c.tipo, codigo=c.codigo, stock_minimo=c.stock_minimo)
+            for c in result.scalars().all()
+        ]
+
+        if version == self.version:
+            self._categorias = categorias
+            self._mapa = {c.id_categoria: c.tipo for c in categorias}
+            self._cargado_en = time.monotonic()
+        return categorias
+
+    async def mapa(self, session: AsyncSession) -> dict:
+        """Devuelve {id_categoria: tipo}."""
+        if self._vigente():
+            self.hits += 1
+            return self._mapa
+        categorias = await self.obtener(session)
+        return {c.id_categoria: c.tipo for c in categorias}
+
+    def estadisticas(self) -> dict:
+        return {
+            "version": self.version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "max_age": self.max_age,
+            "cargado": self._vigente(),
+        }
+
+
+cache_categorias = CacheCategorias(max_age=float(os.getenv("CATEGORIAS_CACHE_MAX_AGE", "300")))
+
+async def crear_categoria(session: AsyncSession, tipo: str, codigo: str, stock_minimo: int = STOCK_MINIMO_POR_DEFECTO) -> Categoria:
+    categoria = Categoria(tipo=tipo, codigo=codigo, stock_minimo=stock_minimo)
     session.add(categoria)
     await session.commit()
     await session.refresh(categoria)
+    cache_categorias.invalidar()
+    versiones_tablas.cambio("categoria")
     return categoria
 
 async def obtener_categoria_por_id(session: AsyncSession, categoria_id: int) -> Optional[Categoria]:
@@ -22,15 +169,30 @@ async def obtener_todas_categorias(session: AsyncSession, skip: int = 0, limit:
     result = await session.execute(select(Categoria).offset(skip).limit(limit))
     return result.scalars().all()
 
-async def actualizar_categoria(session: AsyncSession, categoria_id: int, tipo: str = None, codigo: str = None) -> Optional[Categoria]:
+async def actualizar_categoria(session: AsyncSession, categoria_id: int, tipo: str = None, codigo: str = None, stock_minimo: int = None) -> Optional[Categoria]:
+    """
+    Si cambia stock_minimo, también lo cambia en los productos de la categoría que seguían
+    con el umbral anterior; los que tienen un umbral propio lo conservan.
+    """
     categoria = await session.get(Categoria, categoria_id)
     if categoria:
         if tipo is not None:
             categoria.tipo = tipo
         if codigo is not None:
             categoria.codigo = codigo
+        if stock_minimo is not None and stock_minimo != categoria.stock_minimo:
+            await session.execute(
+                update(Producto)
+                .where(Producto.id_categoria == categoria_id)
+                .where(Producto.stock_minimo == categoria.stock_minimo)
+                .values(stock_minimo=stock_minimo, version=Producto.version + 1)
+                .execution_options(synchronize_session=False)
+            )
+            categoria.stock_minimo = stock_minimo
         await session.commit()
         await session.refresh(categoria)
+        cache_categorias.invalidar()
+        versiones_tablas.cambio("categoria", "producto")
     return categoria
 
 async def eliminar_categoria(session: AsyncSession, categoria_id: int) -> bool:
@@ -38,58 +200,170 @@ async def eliminar_categoria(session: AsyncSession, categoria_id: int) -> bool:
     if categoria:
         await session.delete(categoria)
         await session.commit()
+        cache_categorias.invalidar()
+        versiones_tablas.cambio("categoria")
         return True
     return False
 
 # ===== PRODUCTOS =====
 
-async def crear_producto(session: AsyncSession, id_producto: str, nombre: str, precio: float, stock: int, id_categoria: int) -> Producto:
-    producto = Producto(id_producto=id_producto, nombre=nombre, precio=precio, stock=stock, id_categoria=id_categoria)
+async def crear_producto(session: AsyncSession, id_producto: str, nombre: str, precio: float, stock: int, id_categoria: int, stock_minimo: int = None) -> Producto:
+    """Sin stock_minimo, el producto toma el umbral de su categoría. Lanza ValueError si el id está archivado."""
+    existente = await session.get(Producto, id_producto)
+    if existente is not None:
+        if existente.eliminado_en is not None:
+            raise ValueError(f"El producto {id_producto} está archivado; recupérelo en lugar de crearlo de nuevo")
+        raise ValueError(f"El producto {id_producto} ya existe")
+    if stock_minimo is None:
+        categoria = await session.get(Categoria, id_categoria)
+        stock_minimo = categoria.stock_minimo if categoria else STOCK_MINIMO_POR_DEFECTO
+    producto = Producto(
+        id_producto=id_producto, nombre=nombre, precio=precio, stock=stock,
+        id_categoria=id_categoria, stock_minimo=stock_minimo
+    )
     session.add(producto)
     await session.commit()
     await session.refresh(producto)
+    indice_productos.agregar(producto.id_producto, producto.nombre)
+    versiones_tablas.cambio("producto")
     return producto
 
+def _insert(session: AsyncSession, modelo):
+    """INSERT con soporte de ON CONFLICT del motor en uso (PostgreSQL o SQLite)."""
+    if session.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(modelo)
+
+async def upsert_productos(session: AsyncSession, productos: List[dict], actualizar_stock_minimo: bool = False) -> List[str]:
+    """
+    Inserta o actualiza un lote de productos con un solo INSERT ... ON CONFLICT (id_producto) DO UPDATE.
+    productos: lista de dicts con id_producto, nombre, precio, stock, id_categoria y stock_minimo (ids sin repetir).
+    El stock_minimo de los productos que ya existen solo se reemplaza si actualizar_stock_minimo es True.
+    Los productos archivados no se tocan (igual que en crear_producto, hay que restaurarlos primero).
+    Devuelve los ids insertados o actualizados; los que faltan son los archivados.
+    """
+    if not productos:
+        return []
+    columnas = ("nombre", "precio", "stock", "id_categoria")
+    if actualizar_stock_minimo:
+        columnas += ("stock_minimo",)
+    stmt = _insert(session, Producto).values(productos)
+    valores = {columna: getattr(stmt.excluded, columna) for columna in columnas}
+    valores["version"] = Producto.version + 1
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Producto.id_producto],
+        set_=valores,
+        where=Producto.eliminado_en.is_(None),
+    ).returning(Producto.id_producto)
+    result = await session.execute(stmt)
+    escritos = set(result.scalars().all())
+    await session.commit()
+    for p in productos:
+        if p["id_producto"] in escritos:
+            indice_productos.agregar(p["id_producto"], p["nombre"])
+    versiones_tablas.cambio("producto")
+    return [p["id_producto"] for p in productos if p["id_producto"] in escritos]
+
 async def obtener_producto_por_id(session: AsyncSession, producto_id: str) -> Optional[Producto]:
-    return await session.get(Producto, producto_id)
+    """Solo productos activos (None si no existe o está archivado)."""
+    producto = await session.get(Producto, producto_id)
+    return producto if producto is not None and producto.eliminado_en is None else None
 
-async def buscar_productos(session: AsyncSession, query: str) -> List[Producto]:
-    patron = f"%{query}%"
-    statement = select(Producto).where(
-        (Producto.nombre.ilike(patron)) |
-        (Producto.id_producto.ilike(patron))
+async def buscar_productos(session: AsyncSession, query: str, limite: int = 50) -> List[Producto]:
+    """
+    Busca por nombre o id usando el índice en memoria (resultados ordenados por relevancia).
+    Si el índice aún no está construido, cae a ILIKE en SQL.
+    """
+    ids = indice_productos.buscar(query, limite)
+    if ids is None:
+        patron = f"%{query}%"
+        statement = select(Producto).where(
+            (Producto.nombre.ilike(patron)) |
+            (Producto.id_producto.ilike(patron))
+        ).where(Producto.eliminado_en.is_(None)).limit(limite)
+        result = await session.execute(statement)
+        return result.scalars().all()
+
+    if not ids:
+        return []
+    result = await session.execute(
+        select(Producto).where(Producto.id_producto.in_(ids)).where(Producto.eliminado_en.is_(None))
     )
-    result = await session.execute(statement)
-    return result.scalars().all()
+    productos = {p.id_producto: p for p in result.scalars().all()}
+    return [productos[i] for i in ids if i in productos]
 
 async def obtener_todos_productos(session: AsyncSession, skip: int = 0, limit: int = 100) -> List[Producto]:
-    result = await session.execute(select(Producto).offset(skip).limit(limit))
+    result = await session.execute(select(Producto).where(Producto.eliminado_en.is_(None)).offset(skip).limit(limit))
     return result.scalars().all()
 
 async def obtener_productos_por_categoria(session: AsyncSession, categoria_id: int):
-    result = await session.execute(select(Producto).where(Producto.id_categoria == categoria_id))
+    result = await session.execute(
+        select(Producto).where(Producto.id_categoria == categoria_id).where(Producto.eliminado_en.is_(None))
+    )
     return result.scalars().all()
 
-async def obtener_productos_filtrados(session, categoria: int = 0, search: str = "") -> List[Producto]:
-    stmt = select(Producto)
-
+def _filtrar_productos(stmt, categoria: int = 0, search: str = ""):
+    stmt = stmt.where(Producto.eliminado_en.is_(None))
     if categoria != 0:
         stmt = stmt.where(Producto.id_categoria == categoria)
 
     if search:
+        # Siempre en SQL (en PostgreSQL lo resuelve ix_producto_nombre_trgm): el índice en memoria
+        # de este worker no ve los productos que crean otros workers o la importación por consola
         stmt = stmt.where(Producto.nombre.ilike(f"%{search}%"))
 
+    return stmt
+
+async def obtener_productos_filtrados(session, categoria: int = 0, search: str = "") -> List[Producto]:
+    stmt = _filtrar_productos(select(Producto), categoria, search)
+    result = await session.execute(stmt)
+    return result.scalars().all()
+
+async def contar_productos_filtrados(session: AsyncSession, categoria: int = 0, search: str = "") -> int:
+    stmt = _filtrar_productos(select(func.count()).select_from(Producto), categoria, search)
+    result = await session.execute(stmt)
+    return result.scalar_one()
+
+async def obtener_productos_paginados(
+    session: AsyncSession,
+    page: int = 1,
+    page_size: int = 10,
+    categoria: int = 0,
+    search: str = "",
+    despues_de: Optional[Tuple[str, str]] = None
+) -> List[Producto]:
+    """
+    Devuelve una página de productos ordenada por (nombre, id_producto).
+    Si se pasa despues_de=(nombre, id_producto) se usa paginación por cursor
+    (keyset) y se ignora page, de modo que las páginas profundas cuestan lo mismo que la primera.
+    """
+    stmt = _filtrar_productos(select(Producto), categoria, search)
+
+    if despues_de is not None:
+        stmt = stmt.where(tuple_(Producto.nombre, Producto.id_producto) > tuple_(*despues_de))
+    else:
+        stmt = stmt.offset((page - 1) * page_size)
+
+    stmt = stmt.order_by(Producto.nombre, Producto.id_producto).limit(page_size)
     result = await session.execute(stmt)
     return result.scalars().all()
 
-def paginar_lista(lista, page: int, page_size: int):
-    total = len(lista)
-    start = (page - 1) * page_size
-    end = start + page_size
-    return lista[start:end], total
+def codificar_cursor(producto: Producto) -> str:
+    crudo = json.dumps([producto.nombre, producto.id_producto]).encode("utf-8")
+    return base64.urlsafe_b64encode(crudo).decode("ascii")
+
+def decodificar_cursor(cursor: str) -> Tuple[str, str]:
+    """Lanza ValueError si el cursor no es válido."""
+    try:
+        nombre, id_producto = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise ValueError("Cursor inválido")
+    return str(nombre), str(id_producto)
 
 async def formatear_productos(session, productos):
-    categorias = {c.id_categoria: c.tipo for c in await obtener_todas_categorias(session)}
+    categorias = await cache_categorias.mapa(session)
 
     return [
         {
@@ -97,14 +371,21 @@ async def formatear_productos(session, productos):
             "nombre": p.nombre,
             "precio": p.precio,
             "stock": p.stock,
+            "stock_minimo": p.stock_minimo,
+            "version": p.version,
             "categoria_nombre": categorias.get(p.id_categoria, "Sin categoría")
         }
         for p in productos
     ]
 
-async def actualizar_producto(session: AsyncSession, producto_id: str, nombre: str = None, precio: float = None, stock: int = None, id_categoria: int = None) -> Optional[Producto]:
-    producto = await session.get(Producto, producto_id)
+async def actualizar_producto(session: AsyncSession, producto_id: str, nombre: str = None, precio: float = None, stock: int = None, id_categoria: int = None, stock_minimo: int = None, version: int = None) -> Optional[Producto]:
+    """
+    version: la que el cliente leyó; si el producto cambió desde entonces lanza ConflictoVersion.
+    Los productos archivados no se editan (devuelve None, como si no existieran).
+    """
+    producto = await obtener_producto_por_id(session, producto_id)
     if producto:
+        _comprobar_version(producto, version)
         if nombre is not None:
             producto.nombre = nombre
         if precio is not None:
@@ -113,110 +394,274 @@ async def actualizar_producto(session: AsyncSession, producto_id: str, nombre: s
             producto.stock = stock
         if id_categoria is not None:
             producto.id_categoria = id_categoria
-        await session.commit()
+        if stock_minimo is not None:
+            producto.stock_minimo = stock_minimo
+        await _confirmar_version(session, Producto, producto_id)
         await session.refresh(producto)
+        indice_productos.agregar(producto.id_producto, producto.nombre)
+        versiones_tablas.cambio("producto")
     return producto
 
-async def actualizar_stock_producto(session: AsyncSession, producto_id: str, nueva_cantidad: int) -> Optional[Producto]:
-    producto = await session.get(Producto, producto_id)
+async def actualizar_stock_producto(session: AsyncSession, producto_id: str, nueva_cantidad: int, version: int = None) -> Optional[Producto]:
+    producto = await obtener_producto_por_id(session, producto_id)
     if producto:
+        _comprobar_version(producto, version)
         producto.stock = nueva_cantidad
-        await session.commit()
+        await _confirmar_version(session, Producto, producto_id)
         await session.refresh(producto)
+        versiones_tablas.cambio("producto")
     return producto
 
-async def sumar_stock_producto(session: AsyncSession, producto_id: str, cantidad: int) -> Optional[Producto]:
-    producto = await session.get(Producto, producto_id)
-    if producto:
-        producto.stock += cantidad
-        await session.commit()
-        await session.refresh(producto)
+async def _sumar_stock(session: AsyncSession, producto_id: str, cantidad: int, version: int = None) -> Optional[Producto]:
+    """
+    Suma (o resta, con cantidad negativa) en un solo UPDATE stock = stock + cantidad: dos cajas que
+    mueven el mismo producto a la vez no se pisan. Nunca deja el stock negativo ni toca productos archivados.
+    Con version solo aplica el cambio si el producto sigue en esa versión (si no, ConflictoVersion).
+    """
+    stmt = (
+        update(Producto)
+        .where(Producto.id_producto == producto_id)
+        .where(Producto.eliminado_en.is_(None))
+        .where(Producto.stock + cantidad >= 0)
+        .values(stock=Producto.stock + cantidad, version=Producto.version + 1)
+        .returning(Producto)
+        .execution_options(populate_existing=True, synchronize_session=False)
+    )
+    if version is not None:
+        stmt = stmt.where(Producto.version == version)
+    result = await session.execute(stmt)
+    producto = result.scalars().first()
+    await session.commit()
+    if producto is None:
+        actual = await obtener_producto_por_id(session, producto_id)
+        if actual is not None and version is not None and actual.version != version:
+            raise ConflictoVersion(actual)
+        return None
+    versiones_tablas.cambio("producto")
     return producto
 
-async def restar_stock_producto(session: AsyncSession, producto_id: str, cantidad: int) -> Optional[Producto]:
-    producto = await session.get(Producto, producto_id)
-    if producto and producto.stock >= cantidad:
-        producto.stock -= cantidad
-        await session.commit()
-        await session.refresh(producto)
-        return producto
-    return None
-
-async def mover_producto(session: AsyncSession, producto_id: str) -> bool:
-    producto = await session.get(Producto, producto_id)
-    if not producto:
-        return False
-
-    producto_backup = ProductoBackup(
-        id_producto=producto.id_producto,
-        nombre=producto.nombre,
-        precio=producto.precio,
-        stock=producto.stock,
-        id_categoria=producto.id_categoria
-    )
+async def sumar_stock_producto(session: AsyncSession, producto_id: str, cantidad: int, version: int = None) -> Optional[Producto]:
+    return await _sumar_stock(session, producto_id, cantidad, version)
 
-    session.add(producto_backup)
-    await session.commit()
-    await session.refresh(producto_backup)
+async def restar_stock_producto(session: AsyncSession, producto_id: str, cantidad: int, version: int = None) -> Optional[Producto]:
+    """None si el producto no existe o no alcanza el stock."""
+    producto = await _sumar_stock(session, producto_id, -cantidad, version)
+    if producto and cruza_stock_minimo(producto, producto.stock + cantidad):
+        canal_alertas.publicar(evento_stock_bajo(producto))
+    return producto
 
-    await session.delete(producto)
+async def ajustar_stock_lote(session: AsyncSession, ajustes: List[AjusteStock]) -> dict:
+    """
+    Aplica un conteo de inventario en una sola transacción con un único UPDATE ... CASE.
+    Cada ajuste trae el stock nuevo (stock) o una diferencia (delta); ningún stock queda negativo.
+    Lanza ValueError si el lote está mal formado.
+    Devuelve {"actualizados": [...], "faltantes": [...], "rechazados": [...]} (rechazados: quedarían
+    negativos; los archivados cuentan como faltantes).
+    """
+    ids = [a.id_producto for a in ajustes]
+    if len(set(ids)) != len(ids):
+        raise ValueError("Hay productos repetidos en el lote")
+    for a in ajustes:
+        if (a.stock is None) == (a.delta is None):
+            raise ValueError(f"El producto {a.id_producto} debe traer 'stock' o 'delta' (solo uno)")
+        if a.stock is not None and a.stock < 0:
+            raise ValueError(f"Cantidad negativa no permitida para {a.id_producto}")
+    if not ajustes:
+        return {"actualizados": [], "faltantes": [], "rechazados": []}
+
+    nuevo_stock = case(
+        *[
+            (Producto.id_producto == a.id_producto, a.stock if a.stock is not None else Producto.stock + a.delta)
+            for a in ajustes
+        ],
+        else_=Producto.stock
+    )
+    result = await session.execute(
+        update(Producto)
+        .where(Producto.id_producto.in_(ids))
+        .where(Producto.eliminado_en.is_(None))
+        .where(nuevo_stock >= 0)
+        .values(stock=nuevo_stock, version=Producto.version + 1)
+        .returning(Producto.id_producto)
+        .execution_options(synchronize_session=False)
+    )
+    actualizados = set(result.scalars().all())
+
+    # Solo si algo no se actualizó se consulta cuáles existen, para distinguir faltantes de rechazados
+    pendientes = [i for i in ids if i not in actualizados]
+    existentes = set()
+    if pendientes:
+        result = await session.execute(
+            select(Producto.id_producto)
+            .where(Producto.id_producto.in_(pendientes))
+            .where(Producto.eliminado_en.is_(None))
+        )
+        existentes = set(result.scalars().all())
     await session.commit()
+    versiones_tablas.cambio("producto")
 
-    return True
+    return {
+        "actualizados": [i for i in ids if i in actualizados],
+        "faltantes": [i for i in pendientes if i not in existentes],
+        "rechazados": [i for i in pendientes if i in existentes],
+    }
 
-async def obtener_productos_eliminados(session: AsyncSession):
-    result = await session.execute(select(ProductoBackup))
-    return result.scalars().all()
+async def archivar_productos(session: AsyncSession, ids: List[str]) -> List[str]:
+    """
+    Borrado lógico: marca eliminado_en en un solo UPDATE (los productos siguen en la tabla para las
+    compras y ventas que los referencian). Devuelve los ids archivados; los que no existen o ya
+    estaban archivados se omiten.
+    """
+    if not ids:
+        return []
+    result = await session.execute(
+        update(Producto)
+        .where(Producto.id_producto.in_(ids))
+        .where(Producto.eliminado_en.is_(None))
+        .values(eliminado_en=datetime.now(), version=Producto.version + 1)
+        .returning(Producto.id_producto)
+        .execution_options(synchronize_session=False)
+    )
+    archivados = result.scalars().all()
+    await session.commit()
+    for producto_id in archivados:
+        indice_productos.eliminar(producto_id)
+    if archivados:
+        versiones_tablas.cambio("producto")
+    return archivados
+
+async def restaurar_productos(session: AsyncSession, ids: List[str]) -> List[str]:
+    """Deshace archivar_productos en un solo UPDATE. Devuelve los ids restaurados."""
+    if not ids:
+        return []
+    result = await session.execute(
+        update(Producto)
+        .where(Producto.id_producto.in_(ids))
+        .where(Producto.eliminado_en.is_not(None))
+        .values(eliminado_en=None, version=Producto.version + 1)
+        .returning(Producto.id_producto, Producto.nombre)
+        .execution_options(synchronize_session=False)
+    )
+    restaurados = result.all()
+    await session.commit()
+    for producto_id, nombre in restaurados:
+        indice_productos.agregar(producto_id, nombre)
+    if restaurados:
+        versiones_tablas.cambio("producto")
+    return [producto_id for producto_id, _ in restaurados]
 
-async def recuperar_producto(session: AsyncSession, producto_id: str):
-    producto_backup = await session.get(ProductoBackup, producto_id)
-    if not producto_backup:
-        return False
+async def mover_producto(session: AsyncSession, producto_id: str) -> bool:
+    return bool(await archivar_productos(session, [producto_id]))
 
-    producto = Producto(
-        id_producto=producto_backup.id_producto,
-        nombre=producto_backup.nombre,
-        precio=producto_backup.precio,
-        stock=producto_backup.stock,
-        id_categoria=producto_backup.id_categoria
+async def obtener_productos_eliminados(session: AsyncSession) -> List[Producto]:
+    result = await session.execute(
+        select(Producto).where(Producto.eliminado_en.is_not(None)).order_by(Producto.eliminado_en.desc())
     )
+    return result.scalars().all()
 
-    session.add(producto)
-    await session.delete(producto_backup)
-    await session.commit()
-
-    return True
+async def recuperar_producto(session: AsyncSession, producto_id: str) -> bool:
+    return bool(await restaurar_productos(session, [producto_id]))
 
 
-# === ALERTA: productos con stock menor a 3 ===
-async def obtener_productos_bajo_stock(session: AsyncSession):
-    stmt = select(Producto).where(Producto.stock < 3)
+# === ALERTA: productos por debajo de su stock mínimo ===
+async def obtener_productos_bajo_stock(session: AsyncSession) -> List[Producto]:
+    # La condición es la misma del índice parcial ix_producto_bajo_stock, así que no recorre la tabla
+    stmt = (
+        select(Producto)
+        .where(Producto.stock < Producto.stock_minimo)
+        .where(Producto.eliminado_en.is_(None))
+        .order_by(Producto.stock, Producto.nombre)
+    )
     result = await session.execute(stmt)
     return result.scalars().all()
 
+def cruza_stock_minimo(producto: Producto, stock_anterior: int) -> bool:
+    """True solo cuando este descuento lo deja bajo el umbral (las ventas siguientes ya no avisan)."""
+    return producto.stock < producto.stock_minimo <= stock_anterior
+
+def evento_stock_bajo(producto: Producto) -> dict:
+    return {
+        "id_producto": producto.id_producto,
+        "nombre": producto.nombre,
+        "stock": producto.stock,
+        "stock_minimo": producto.stock_minimo,
+    }
+
 # ===== CLIENTES =====
 
 
 async def crear_cliente(session: AsyncSession, nombre: str, telefono: str, email: str):
+    """Lanza ValueError si el email ya está registrado (lo garantiza el índice único de Cliente.email)."""
     nuevo_cliente = Cliente(
         nombre=nombre.strip(),
         telefono=telefono.strip(),
         email=email.strip().lower(),
     )
     session.add(nuevo_cliente)
-    await session.commit()
+    try:
+        await session.commit()
+    except IntegrityError:
+        await session.rollback()
+        raise ValueError("El email ya está registrado")
     await session.refresh(nuevo_cliente)
+    versiones_tablas.cambio("cliente")
     return nuevo_cliente
 
 
 async def obtener_cliente_por_id(session: AsyncSession, cliente_id: int) -> Optional[Cliente]:
     return await session.get(Cliente, cliente_id)
 
-async def obtener_todos_clientes(session: AsyncSession):
-    statement = select(Cliente).order_by(Cliente.activo.desc(), Cliente.nombre.asc())
-    result = await session.execute(statement)
+def _filtrar_clientes(stmt, buscar: str = "", solo_activos: bool = False):
+    """Busca el texto en nombre, teléfono o email (en PostgreSQL lo resuelven los índices GIN de pg_trgm)."""
+    buscar = buscar.strip()
+    if buscar:
+        patron = f"%{buscar}%"
+        stmt = stmt.where(
+            Cliente.nombre.ilike(patron) | Cliente.telefono.ilike(patron) | Cliente.email.ilike(patron)
+        )
+    if solo_activos:
+        stmt = stmt.where(Cliente.activo.is_(True))
+    return stmt
+
+async def obtener_clientes_paginados(
+    session: AsyncSession,
+    limite: int = 50,
+    buscar: str = "",
+    solo_activos: bool = False,
+    despues_de: Optional[Tuple[bool, str, int]] = None
+) -> List[Cliente]:
+    """
+    Una página de clientes en el orden del listado: activos primero, luego (nombre, id_cliente).
+    despues_de=(activo, nombre, id_cliente) es el último cliente de la página anterior (keyset);
+    el orden sigue el índice ix_cliente_listado, así que cualquier página cuesta lo mismo.
+    """
+    stmt = _filtrar_clientes(select(Cliente), buscar, solo_activos)
+
+    if despues_de is not None:
+        activo, nombre, id_cliente = despues_de
+        # activo va en orden descendente: no sirve una sola comparación de tuplas
+        mismo_estado = (Cliente.activo == activo) & (
+            tuple_(Cliente.nombre, Cliente.id_cliente) > tuple_(nombre, id_cliente)
+        )
+        # Después de los activos siguen todos los inactivos
+        stmt = stmt.where(mismo_estado | (Cliente.activo == False) if activo else mismo_estado)  # noqa: E712
+
+    stmt = stmt.order_by(Cliente.activo.desc(), Cliente.nombre, Cliente.id_cliente).limit(limite)
+    result = await session.execute(stmt)
     return result.scalars().all()
 
+def codificar_cursor_cliente(cliente: Cliente) -> str:
+    crudo = json.dumps([cliente.activo, cliente.nombre, cliente.id_cliente]).encode("utf-8")
+    return base64.urlsafe_b64encode(crudo).decode("ascii")
+
+def decodificar_cursor_cliente(cursor: str) -> Tuple[bool, str, int]:
+    """Lanza ValueError si el cursor no es válido."""
+    try:
+        activo, nombre, id_cliente = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return bool(activo), str(nombre), int(id_cliente)
+    except Exception:
+        raise ValueError("Cursor inválido")
+
 async def buscar_cliente_por_email(session: AsyncSession, email: str):
     stmt = select(Cliente).where(Cliente.email == email.strip().lower())
     result = await session.execute(stmt)
@@ -228,7 +673,8 @@ async def actualizar_cliente(
     nombre: str = None,
     telefono: str = None,
     email: str = None,
-    activo: bool = None
+    activo: bool = None,
+    version: int = None
 ):
     from fastapi.logger import logger
 
@@ -236,6 +682,7 @@ async def actualizar_cliente(
     if not cliente:
         logger.warning(f"Cliente {cliente_id} no encontrado")
         return None
+    _comprobar_version(cliente, version)
 
     logger.info(f"Antes de actualizar cliente {cliente_id}: {cliente}")
 
@@ -250,9 +697,16 @@ async def actualizar_cliente(
 
     try:
         session.add(cliente)
-        await session.commit()
+        await _confirmar_version(session, Cliente, cliente_id)
         await session.refresh(cliente)
+        versiones_tablas.cambio("cliente")
         logger.info(f"Cliente actualizado correctamente: {cliente}")
+    except ConflictoVersion:
+        logger.info(f"Cliente {cliente_id} modificado por otra persona; no se actualizó")
+        raise
+    except IntegrityError:
+        await session.rollback()
+        raise ValueError("El email ya está registrado")
     except Exception as e:
         await session.rollback()
         logger.error(f"Error al actualizar cliente: {e}")
@@ -265,6 +719,7 @@ async def eliminar_cliente(session: AsyncSession, cliente_id: int) -> bool:
     if cliente:
         await session.delete(cliente)
         await session.commit()
+        versiones_tablas.cambio("cliente")
         return True
     return False
 
@@ -288,6 +743,7 @@ async def crear_proveedor(session: AsyncSession, nit: str, nombre: str, direccio
     try:
         await session.commit()
         await session.refresh(proveedor)
+        versiones_tablas.cambio("proveedor")
         return proveedor
     except IntegrityError:
         await session.rollback()
@@ -298,52 +754,64 @@ async def obtener_proveedor_por_nit(session: AsyncSession, nit: str) -> Optional
     return result.scalars().first()
 
 async def obtener_todos_proveedores(session: AsyncSession, skip: int = 0, limit: int = 100) -> List[Proveedor]:
-    result = await session.execute(select(Proveedor).offset(skip).limit(limit))
+    result = await session.execute(select(Proveedor).where(Proveedor.eliminado_en.is_(None)).offset(skip).limit(limit))
     return result.scalars().all()
 
 async def obtener_proveedores_resumen(session: AsyncSession) -> List[Proveedor]:
-    result = await session.execute(select(Proveedor))
+    result = await session.execute(select(Proveedor).where(Proveedor.eliminado_en.is_(None)))
     return result.scalars().all()
 
-async def mover_proveedor(session: AsyncSession, nit: str) -> bool:
-    proveedor = await session.get(Proveedor, nit)
-    if not proveedor:
-        return False
-    proveedor_backup = ProveedorBackup(
-        nit=proveedor.nit,
-        nombre=proveedor.nombre,
-        direccion=proveedor.direccion,
-        ciudad=proveedor.ciudad,
-        contacto=proveedor.contacto
+async def archivar_proveedores(session: AsyncSession, nits: List[str]) -> List[str]:
+    """Borrado lógico en un solo UPDATE (sus compras los siguen referenciando). Devuelve los NIT archivados."""
+    if not nits:
+        return []
+    result = await session.execute(
+        update(Proveedor)
+        .where(Proveedor.nit.in_(nits))
+        .where(Proveedor.eliminado_en.is_(None))
+        .values(eliminado_en=datetime.now(), version=Proveedor.version + 1)
+        .returning(Proveedor.nit)
+        .execution_options(synchronize_session=False)
+    )
+    archivados = result.scalars().all()
+    await session.commit()
+    if archivados:
+        versiones_tablas.cambio("proveedor")
+    return archivados
+
+async def restaurar_proveedores(session: AsyncSession, nits: List[str]) -> List[str]:
+    if not nits:
+        return []
+    result = await session.execute(
+        update(Proveedor)
+        .where(Proveedor.nit.in_(nits))
+        .where(Proveedor.eliminado_en.is_not(None))
+        .values(eliminado_en=None, version=Proveedor.version + 1)
+        .returning(Proveedor.nit)
+        .execution_options(synchronize_session=False)
     )
-    session.add(proveedor_backup)
-    await session.delete(proveedor)
+    restaurados = result.scalars().all()
     await session.commit()
-    return True
+    if restaurados:
+        versiones_tablas.cambio("proveedor")
+    return restaurados
 
-async def obtener_proveedores_eliminados(session: AsyncSession) -> List[ProveedorBackup]:
-    result = await session.execute(select(ProveedorBackup))
+async def mover_proveedor(session: AsyncSession, nit: str) -> bool:
+    return bool(await archivar_proveedores(session, [nit]))
+
+async def obtener_proveedores_eliminados(session: AsyncSession) -> List[Proveedor]:
+    result = await session.execute(
+        select(Proveedor).where(Proveedor.eliminado_en.is_not(None)).order_by(Proveedor.eliminado_en.desc())
+    )
     return result.scalars().all()
 
 async def recuperar_proveedor(session: AsyncSession, nit: str) -> bool:
-    proveedor_backup = await session.get(ProveedorBackup, nit)
-    if not proveedor_backup:
-        return False
-    proveedor = Proveedor(
-        nit=proveedor_backup.nit,
-        nombre=proveedor_backup.nombre,
-        direccion=proveedor_backup.direccion,
-        ciudad=proveedor_backup.ciudad,
-        contacto=proveedor_backup.contacto
-    )
-    session.add(proveedor)
-    await session.delete(proveedor_backup)
-    await session.commit()
-    return True
+    return bool(await restaurar_proveedores(session, [nit]))
 
-async def actualizar_proveedor(session: AsyncSession, nit: str, nombre: str = None, direccion: str = None, ciudad: str = None, contacto: str = None) -> Optional[Proveedor]:
+async def actualizar_proveedor(session: AsyncSession, nit: str, nombre: str = None, direccion: str = None, ciudad: str = None, contacto: str = None, version: int = None) -> Optional[Proveedor]:
     proveedor = await session.get(Proveedor, nit)
     if proveedor:
+        _comprobar_version(proveedor, version)
         if nombre is not None:
             proveedor.nombre = nombre
         if direccion is not None:
@@ -352,8 +820,9 @@ async def actualizar_proveedor(session: AsyncSession, nit: str, nombre: str = No
             proveedor.ciudad = ciudad
         if contacto is not None:
             proveedor.contacto = contacto
-        await session.commit()
+        await _confirmar_version(session, Proveedor, nit)
         await session.refresh(proveedor)
+        versiones_tablas.cambio("proveedor")
     return proveedor
 
 # ===== VALIDACIONES =====
@@ -362,7 +831,7 @@ async def categoria_existe(session: AsyncSession, categoria_id: int) -> bool:
     return await session.get(Categoria, categoria_id) is not None
 
 async def producto_existe(session: AsyncSession, producto_id: str) ->bool:
-    return await session.get(Producto, producto_id) is not None
+    return await obtener_producto_por_id(session, producto_id) is not None
 
 async def cliente_existe(session: AsyncSession, cliente_id: int) -> bool:
     return await session.get(Cliente, cliente_id) is not None
@@ -371,125 +840,448 @@ async def proveedor_existe(session: AsyncSession, nit: str) -> bool:
     return await session.get(Proveedor, nit) is not None
 
 async def verificar_stock_disponible(session: AsyncSession, producto_id: str, cantidad_requerida: int) -> bool:
-    producto = await session.get(Producto, producto_id)
+    producto = await obtener_producto_por_id(session, producto_id)
     if producto:
         return producto.stock >= cantidad_requerida
     return False
 
-async def crear_venta_txt(session: AsyncSession, cliente_nombre: str, cliente_documento: str, productos_para_venta: list):
+async def descontar_stock_venta(
+    session: AsyncSession, productos_para_venta: list
+) -> Tuple[Dict[str, Producto], List[Producto]]:
+    """
+    Valida y descuenta el stock de todo el carrito dentro de la transacción actual (no hace commit).
+    Bloquea los productos con un solo SELECT ... FOR UPDATE y descuenta con un solo UPDATE condicional
+    (stock >= cantidad), así dos cajas no pueden vender la última unidad a la vez.
+    Lanza LookupError si un producto no existe y ValueError si no alcanza el stock.
+    Devuelve la tupla (productos, bajo_minimo): productos es {id_producto: Producto} con los productos
+    bloqueados y su stock nuevo; bajo_minimo, los que con esta venta quedaron bajo su stock mínimo.
+    """
+    # Un mismo producto puede venir en varias líneas del carrito
+    cantidades = {}
+    for producto_id, cantidad in productos_para_venta:
+        cantidades[producto_id] = cantidades.get(producto_id, 0) + cantidad
+
+    result = await session.execute(
+        select(Producto)
+        .where(Producto.id_producto.in_(cantidades))
+        .where(Producto.eliminado_en.is_(None))
+        .with_for_update()
+    )
+    productos = {p.id_producto: p for p in result.scalars().all()}
+
+    for producto_id, cantidad in cantidades.items():
+        producto = productos.get(producto_id)
+        if not producto:
+            raise LookupError(f"Producto no encontrado (id: {producto_id})")
+        if producto.stock < cantidad:
+            raise ValueError(f"No hay suficiente stock para {producto.nombre}")
+
+    cantidad_por_producto = case(cantidades, value=Producto.id_producto)
+    result = await session.execute(
+        update(Producto)
+        .where(Producto.id_producto.in_(cantidades))
+        .where(Producto.stock >= cantidad_por_producto)
+        .values(stock=Producto.stock - cantidad_por_producto, version=Producto.version + 1)
+        .returning(Producto.id_producto, Producto.stock, Producto.version)
+        .execution_options(synchronize_session=False)
+    )
+    actualizados = {fila.id_producto: fila for fila in result.all()}
+
+    # Sin FOR UPDATE (p. ej. SQLite) la condición del UPDATE es la que protege el stock
+    bajo_minimo = []
+    for producto_id, cantidad in cantidades.items():
+        if producto_id not in actualizados:
+            raise ValueError(f"No hay suficiente stock para {productos[producto_id].nombre}")
+        producto = productos[producto_id]
+        # Sin marcar el objeto como modificado: el UPDATE ya se hizo, el commit no debe repetirlo
+        set_committed_value(producto, "stock", actualizados[producto_id].stock)
+        set_committed_value(producto, "version", actualizados[producto_id].version)
+        if cruza_stock_minimo(producto, producto.stock + cantidad):
+            bajo_minimo.append(producto)
+
+    return productos, bajo_minimo
+
+def generar_texto_venta(venta: Venta, cliente_nombre: str, detalles: List[Detalle_Venta]) -> str:
+    """Arma el texto del recibo a partir de las filas de Venta / Detalle_Venta."""
+    lineas = [
+        "CREACIONES MECHAS",
+        f"Fecha y hora: {venta.fecha.strftime('%Y-%m-%d %H:%M:%S')}",
+        "=" * 40,
+        f"{'Producto':<20}{'Cant.':>7}{'Total':>13}",
+        "-" * 40,
+    ]
+    for d in detalles:
+        lineas.append(f"{d.nombre_producto:<20}{str(d.cantidad):>7}{d.cantidad * d.precio_unidad:>13.2f}")
+    lineas.append("-" * 40)
+    lineas.append(f"{'TOTAL A PAGAR:':<20}{venta.total:>20.2f}")
+    lineas.append("")
+    lineas.append(f"Cliente: {cliente_nombre} - Documento: {venta.id_cliente if venta.id_cliente is not None else '-'}")
+    return "\n".join(lineas) + "\n"
+
+async def crear_venta_txt(
+    session: AsyncSession,
+    cliente: Cliente,
+    productos_para_venta: list,
+    clave_idempotencia: str = None,
+    huella: str = None
+):
     """
     productos_para_venta: lista de tuples [(producto_id, cantidad), ...]
-    Actualiza stock y genera archivo TXT con nombre, subtotales y total.
-    Devuelve la ruta del archivo generado.
+    En una sola transacción valida y descuenta stock, guarda la Venta con sus Detalle_Venta,
+    actualiza los resúmenes diarios y, si se pasa, registra la clave de idempotencia;
+    luego encola el archivo TXT, generado a partir de esas filas.
+    Lanza LookupError / ValueError (ver descontar_stock_venta) sin modificar nada,
+    e IntegrityError si otra petición ya registró la misma clave.
+    Devuelve (venta, detalles, ruta del archivo generado).
     """
-    fecha_hora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    fecha = datetime.now()
     carpeta_ventas = "ventas_txt"
-    os.makedirs(carpeta_ventas, exist_ok=True)
 
-    total_general = 0.0
-    lineas = []
+    try:
+        productos, bajo_minimo = await descontar_stock_venta(session, productos_para_venta)
+
+        detalles = [
+            Detalle_Venta(
+                id_producto=producto_id,
+                nombre_producto=productos[producto_id].nombre,
+                cantidad=cantidad,
+                precio_unidad=productos[producto_id].precio
+            )
+            for producto_id, cantidad in productos_para_venta
+        ]
+        venta = Venta(
+            fecha=fecha,
+            id_cliente=cliente.id_cliente,
+            total=sum(d.cantidad * d.precio_unidad for d in detalles)
+        )
+        session.add(venta)
+        await session.flush()
+
+        venta.archivo = os.path.join(carpeta_ventas, f"venta_{fecha.strftime('%Y%m%d_%H%M%S')}_{venta.id_venta}.txt")
+        for detalle in detalles:
+            detalle.id_venta = venta.id_venta
+        # Un solo INSERT multi-fila sin RETURNING (nadie usa id_detalle_venta): con add_all el ORM
+        # hace un INSERT ... RETURNING por línea del carrito (en SQLite, por ejemplo)
+        await session.execute(insert(Detalle_Venta).values([
+            {
+                "id_venta": d.id_venta,
+                "id_producto": d.id_producto,
+                "nombre_producto": d.nombre_producto,
+                "cantidad": d.cantidad,
+                "precio_unidad": d.precio_unidad,
+            }
+            for d in detalles
+        ]))
+        await acumular_resumenes_ventas(session, [(venta, detalles)])
+        if clave_idempotencia:
+            registro_idempotencia.registrar(session, clave_idempotencia, "venta", huella, venta.id_venta)
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    versiones_tablas.cambio("producto", "venta")
+    if clave_idempotencia:
+        registro_idempotencia.recordar(clave_idempotencia, "venta", huella, venta.id_venta)
 
-    # Procesar cada item: buscar producto por id, calcular subtotal, restar stock
-    for producto_id, cantidad in productos_para_venta:
-        result = await session.execute(select(Producto).where(Producto.id_producto == producto_id))
-        producto = result.scalars().first()
-        if not producto:
-            # saltar si no existe (normalmente ya validado antes)
-            continue
+    # Las alertas y el archivo van después del commit: una venta que se revierte no avisa nada
+    for producto in bajo_minimo:
+        canal_alertas.publicar(evento_stock_bajo(producto))
 
-        subtotal = producto.precio * cantidad
-        total_general += subtotal
-        lineas.append((producto.nombre, cantidad, subtotal))
+    # El archivo lo escribe el escritor en segundo plano; la venta ya quedó confirmada en la base de datos
+    await escritor.encolar(venta.archivo, generar_texto_venta(venta, cliente.nombre, detalles))
 
-        # Actualizar stock en objeto
-        producto.stock = producto.stock - cantidad
-        session.add(producto)
+    return venta, detalles, venta.archivo
+
+async def obtener_venta(session: AsyncSession, id_venta: int):
+    """Retorna la venta con su cliente y sus detalles, o None."""
+    result = await session.execute(
+        select(Venta, Cliente)
+        .outerjoin(Cliente, Venta.id_cliente == Cliente.id_cliente)
+        .where(Venta.id_venta == id_venta)
+    )
+    fila = result.first()
+    if not fila:
+        return None
+    venta, cliente = fila
+
+    result = await session.execute(
+        select(Detalle_Venta)
+        .where(Detalle_Venta.id_venta == id_venta)
+        .order_by(Detalle_Venta.id_detalle_venta)
+    )
+    return {"venta": venta, "cliente": cliente, "detalles": result.scalars().all()}
+
+async def obtener_recibo_venta(session: AsyncSession, id_venta: int) -> Optional[str]:
+    data = await obtener_venta(session, id_venta)
+    if not data:
+        return None
+    cliente_nombre = data["cliente"].nombre if data["cliente"] else "Desconocido"
+    return generar_texto_venta(data["venta"], cliente_nombre, data["detalles"])
+
+async def obtener_ventas_por_cliente(session: AsyncSession, id_cliente: int) -> List[Venta]:
+    result = await session.execute(
+        select(Venta).where(Venta.id_cliente == id_cliente).order_by(Venta.fecha.desc())
+    )
+    return result.scalars().all()
+
+def _filtrar_por_fecha(stmt, columna, desde: Optional[date] = None, hasta: Optional[date] = None):
+    """Filtra por rango de fechas; ambos extremos son inclusivos."""
+    if desde is not None:
+        stmt = stmt.where(columna >= datetime.combine(desde, datetime.min.time()))
+    if hasta is not None:
+        stmt = stmt.where(columna < datetime.combine(hasta + timedelta(days=1), datetime.min.time()))
+    return stmt
+
+async def obtener_ventas_paginadas(
+    session: AsyncSession,
+    page: int = 1,
+    page_size: int = 20,
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None
+):
+    """
+    Historial de ventas más recientes primero, paginado en la base de datos.
+    Solo se cargan los detalles (y se arma el recibo) de las ventas de la página.
+    Devuelve (ventas, total) donde cada venta es un dict con el texto del recibo en "contenido".
+    """
+    stmt = _filtrar_por_fecha(
+        select(Venta, func.coalesce(Cliente.nombre, "Desconocido"))
+        .outerjoin(Cliente, Venta.id_cliente == Cliente.id_cliente),
+        Venta.fecha, desde, hasta
+    )
+    stmt = stmt.order_by(Venta.fecha.desc(), Venta.id_venta.desc()).offset((page - 1) * page_size).limit(page_size)
+    filas = (await session.execute(stmt)).all()
+
+    total_stmt = _filtrar_por_fecha(select(func.count()).select_from(Venta), Venta.fecha, desde, hasta)
+    total = (await session.execute(total_stmt)).scalar_one()
+
+    detalles_por_venta = {venta.id_venta: [] for venta, _ in filas}
+    if detalles_por_venta:
+        result = await session.execute(
+            select(Detalle_Venta)
+            .where(Detalle_Venta.id_venta.in_(detalles_por_venta))
+            .order_by(Detalle_Venta.id_detalle_venta)
+        )
+        for detalle in result.scalars().all():
+            detalles_por_venta[detalle.id_venta].append(detalle)
+
+    ventas = [
+        {
+            "id_venta": venta.id_venta,
+            "nombre": os.path.basename(venta.archivo) if venta.archivo else f"Venta {venta.id_venta}",
+            "fecha": venta.fecha.strftime("%Y-%m-%d %H:%M:%S"),
+            "total": venta.total,
+            "cliente_nombre": cliente_nombre,
+            "contenido": generar_texto_venta(venta, cliente_nombre, detalles_por_venta[venta.id_venta])
+        }
+        for venta, cliente_nombre in filas
+    ]
+    return ventas, total
+
+# ===== RESÚMENES DE VENTAS =====
+
+async def acumular_resumenes_ventas(session: AsyncSession, ventas: list):
+    """
+    Suma un grupo de ventas a los resúmenes diarios (por día, por producto y por cliente)
+    con un INSERT ... ON CONFLICT DO UPDATE por tabla. No hace commit: va en la transacción de la venta.
+    ventas: lista de tuples [(venta, detalles), ...]
+    """
+    por_dia, por_producto, por_cliente = {}, {}, {}
+    for venta, detalles in ventas:
+        fecha = venta.fecha.date()
+        unidades = sum(d.cantidad for d in detalles)
+
+        dia = por_dia.setdefault(fecha, {"fecha": fecha, "num_ventas": 0, "unidades": 0, "total": 0.0})
+        dia["num_ventas"] += 1
+        dia["unidades"] += unidades
+        dia["total"] += venta.total
+
+        if venta.id_cliente is not None:
+            cliente = por_cliente.setdefault(
+                (fecha, venta.id_cliente),
+                {"fecha": fecha, "id_cliente": venta.id_cliente, "num_ventas": 0, "total": 0.0}
+            )
+            cliente["num_ventas"] += 1
+            cliente["total"] += venta.total
+
+        for d in detalles:
+            if d.id_producto is None:
+                continue
+            producto = por_producto.setdefault(
+                (fecha, d.id_producto),
+                {"fecha": fecha, "id_producto": d.id_producto, "nombre_producto": d.nombre_producto, "unidades": 0, "total": 0.0}
+            )
+            producto["unidades"] += d.cantidad
+            producto["total"] += d.cantidad * d.precio_unidad
+
+    for modelo, filas, claves, sumas in (
+        (VentaDiaria, por_dia, ["fecha"], ["num_ventas", "unidades", "total"]),
+        (VentaProductoDiaria, por_producto, ["fecha", "id_producto"], ["unidades", "total"]),
+        (VentaClienteDiaria, por_cliente, ["fecha", "id_cliente"], ["num_ventas", "total"]),
+    ):
+        if not filas:
+            continue
+        stmt = _insert(session, modelo).values(list(filas.values()))
+        set_ = {c: getattr(modelo, c) + getattr(stmt.excluded, c) for c in sumas}
+        if modelo is VentaProductoDiaria:
+            set_["nombre_producto"] = stmt.excluded.nombre_producto
+        await session.execute(stmt.on_conflict_do_update(index_elements=claves, set_=set_))
+
+async def reconstruir_resumenes_ventas(session: AsyncSession) -> int:
+    """Vuelve a calcular todos los resúmenes desde Venta / Detalle_Venta (p. ej. tras una carga histórica)."""
+    for modelo in (VentaDiaria, VentaProductoDiaria, VentaClienteDiaria):
+        await session.execute(delete(modelo))
+
+    ventas = 0
+    result = await session.stream(select(Venta).order_by(Venta.id_venta).execution_options(yield_per=500))
+    async for particion in result.scalars().partitions():
+        ids = [v.id_venta for v in particion]
+        detalles = {i: [] for i in ids}
+        filas = await session.execute(select(Detalle_Venta).where(Detalle_Venta.id_venta.in_(ids)))
+        for d in filas.scalars().all():
+            detalles[d.id_venta].append(d)
+        await acumular_resumenes_ventas(session, [(v, detalles[v.id_venta]) for v in particion])
+        ventas += len(particion)
 
-    # Commit de todos los cambios en DB (stocks)
     await session.commit()
+    return ventas
 
-    # Crear archivo TXT
-    nombre_archivo = os.path.join(carpeta_ventas, f"venta_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
-    with open(nombre_archivo, "w", encoding="utf-8") as f:
-        f.write("CREACIONES MECHAS\n")
-        f.write(f"Fecha y hora: {fecha_hora}\n")
-        f.write("="*40 + "\n")
-        f.write(f"{'Producto':<20}{'Cant.':>7}{'Total':>13}\n")
-        f.write("-"*40 + "\n")
-        for nombre, cant, subtotal in lineas:
-            f.write(f"{nombre:<20}{str(cant):>7}{subtotal:>13.2f}\n")
-        f.write("-"*40 + "\n")
-        f.write(f"{'TOTAL A PAGAR:':<20}{total_general:>20.2f}\n\n")
-        f.write(f"Cliente: {cliente_nombre} - Documento: {cliente_documento}\n")
-
-    return nombre_archivo
+async def resumen_ventas_diarias(session: AsyncSession, desde: date, hasta: date) -> List[VentaDiaria]:
+    result = await session.execute(
+        select(VentaDiaria)
+        .where(VentaDiaria.fecha >= desde, VentaDiaria.fecha <= hasta)
+        .order_by(VentaDiaria.fecha)
+    )
+    return result.scalars().all()
+
+async def top_productos_vendidos(session: AsyncSession, desde: date, hasta: date, limite: int = 10, orden: str = "total"):
+    unidades = func.sum(VentaProductoDiaria.unidades).label("unidades")
+    total = func.sum(VentaProductoDiaria.total).label("total")
+    result = await session.execute(
+        select(VentaProductoDiaria.id_producto, func.max(VentaProductoDiaria.nombre_producto).label("nombre"), unidades, total)
+        .where(VentaProductoDiaria.fecha >= desde, VentaProductoDiaria.fecha <= hasta)
+        .group_by(VentaProductoDiaria.id_producto)
+        .order_by((unidades if orden == "unidades" else total).desc(), VentaProductoDiaria.id_producto)
+        .limit(limite)
+    )
+    return [dict(fila._mapping) for fila in result.all()]
+
+async def top_clientes(session: AsyncSession, desde: date, hasta: date, limite: int = 10):
+    num_ventas = func.sum(VentaClienteDiaria.num_ventas).label("num_ventas")
+    total = func.sum(VentaClienteDiaria.total).label("total")
+    result = await session.execute(
+        select(VentaClienteDiaria.id_cliente, Cliente.nombre, num_ventas, total)
+        .join(Cliente, Cliente.id_cliente == VentaClienteDiaria.id_cliente)
+        .where(VentaClienteDiaria.fecha >= desde, VentaClienteDiaria.fecha <= hasta)
+        .group_by(VentaClienteDiaria.id_cliente, Cliente.nombre)
+        .order_by(total.desc(), VentaClienteDiaria.id_cliente)
+        .limit(limite)
+    )
+    return [dict(fila._mapping) for fila in result.all()]
 
 # ===== COMPRAS =====
 
 async def registrar_compra(
     session: AsyncSession,
     nit_proveedor: str,
-    productos_comprados: list
+    productos_comprados: list,
+    clave_idempotencia: str = None,
+    huella: str = None
 ):
     """
-    Registra una compra en la base de datos y actualiza stock.
+    Registra una compra en la base de datos y actualiza stock, en una sola transacción
+    (junto con la clave de idempotencia, si se pasa). El stock se suma con un solo UPDATE ... CASE
+    (stock = stock + cantidad), así una venta simultánea del mismo producto no choca con la compra.
     productos_comprados: lista de tuples [(id_producto, cantidad, precio_unidad), ...]
+    Lanza LookupError si el proveedor o algún producto no existe o está archivado.
     """
-
-    # Crear registro de la compra
-    compra = Compra(fecha=datetime.now(), nit=nit_proveedor)
-    session.add(compra)
-    await session.commit()
-    await session.refresh(compra)
-
-    total_compra = 0.0
-
-    for id_producto, cantidad, precio_unidad in productos_comprados:
-        detalle = Detalle_Compra(
-            id_compra=compra.id_compra,
-            id_producto=id_producto,
-            cantidad=cantidad,
-            precio_unidad=precio_unidad
+    try:
+        # Proveedor y productos activos; FOR UPDATE evita que se archiven antes del commit
+        result = await session.execute(
+            select(Proveedor.nit)
+            .where(Proveedor.nit == nit_proveedor)
+            .where(Proveedor.eliminado_en.is_(None))
+            .with_for_update()
         )
-        session.add(detalle)
-
-        # Actualizar stock del producto
-        producto = await session.get(Producto, id_producto)
-        if producto:
-            producto.stock += cantidad
-            session.add(producto)
+        if result.scalar_one_or_none() is None:
+            raise LookupError(f"Proveedor {nit_proveedor} no encontrado o archivado")
+        ids = {id_producto for id_producto, _, _ in productos_comprados}
+        result = await session.execute(
+            select(Producto.id_producto)
+            .where(Producto.id_producto.in_(ids))
+            .where(Producto.eliminado_en.is_(None))
+            .with_for_update()
+        )
+        faltantes = ids - set(result.scalars().all())
+        if faltantes:
+            raise LookupError(f"Productos no encontrados o archivados: {', '.join(sorted(faltantes))}")
 
-        total_compra += cantidad * precio_unidad
+        # Crear registro de la compra
+        compra = Compra(fecha=datetime.now(), nit=nit_proveedor)
+        session.add(compra)
+        await session.flush()
 
-    await session.commit()
+        total_compra = 0.0
+        cantidades = defaultdict(int)
 
-    # Registrar en archivo TXT para control contable
-    carpeta_compras = "compras_txt"
-    os.makedirs(carpeta_compras, exist_ok=True)
+        for id_producto, cantidad, precio_unidad in productos_comprados:
+            detalle = Detalle_Compra(
+                id_compra=compra.id_compra,
+                id_producto=id_producto,
+                cantidad=cantidad,
+                precio_unidad=precio_unidad
+            )
+            session.add(detalle)
+            cantidades[id_producto] += cantidad
+            total_compra += cantidad * precio_unidad
+
+        # Actualizar stock de los productos
+        if cantidades:
+            cantidad_por_producto = case(dict(cantidades), value=Producto.id_producto)
+            await session.execute(
+                update(Producto)
+                .where(Producto.id_producto.in_(cantidades))
+                .where(Producto.eliminado_en.is_(None))
+                .values(stock=Producto.stock + cantidad_por_producto, version=Producto.version + 1)
+                .execution_options(synchronize_session=False)
+            )
+
+        if clave_idempotencia:
+            registro_idempotencia.registrar(session, clave_idempotencia, "compra", huella, compra.id_compra)
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    versiones_tablas.cambio("producto", "compra")
+    if clave_idempotencia:
+        registro_idempotencia.recordar(clave_idempotencia, "compra", huella, compra.id_compra)
 
+    # Registrar en archivo TXT para control contable (lo escribe el escritor en segundo plano)
     nombre_archivo = os.path.join(
-        carpeta_compras,
+        "compras_txt",
         f"compra_{compra.id_compra}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
     )
-
-    with open(nombre_archivo, "w", encoding="utf-8") as f:
-        f.write("REGISTRO DE COMPRA - CREACIONES MECHAS\n")
-        f.write("=" * 45 + "\n")
-        f.write(f"Proveedor NIT: {nit_proveedor}\n")
-        f.write(f"Fecha: {compra.fecha.strftime('%Y-%m-%d %H:%M:%S')}\n")
-        f.write("-" * 45 + "\n")
-        f.write(f"{'Producto':<20}{'Cant.':>7}{'Precio':>10}{'Subtotal':>10}\n")
-        f.write("-" * 45 + "\n")
-
-        for id_producto, cantidad, precio_unidad in productos_comprados:
-            subtotal = cantidad * precio_unidad
-            f.write(f"{id_producto:<20}{cantidad:>7}{precio_unidad:>10.2f}{subtotal:>10.2f}\n")
-
-        f.write("-" * 45 + "\n")
-        f.write(f"{'TOTAL COMPRA:':<20}{total_compra:>25.2f}\n")
+    await escritor.encolar(nombre_archivo, generar_texto_compra(compra, productos_comprados, total_compra))
 
     return compra, nombre_archivo
 
+def generar_texto_compra(compra: Compra, productos_comprados: list, total_compra: float) -> str:
+    lineas = [
+        "REGISTRO DE COMPRA - CREACIONES MECHAS",
+        "=" * 45,
+        f"Proveedor NIT: {compra.nit}",
+        f"Fecha: {compra.fecha.strftime('%Y-%m-%d %H:%M:%S')}",
+        "-" * 45,
+        f"{'Producto':<20}{'Cant.':>7}{'Precio':>10}{'Subtotal':>10}",
+        "-" * 45,
+    ]
+    for id_producto, cantidad, precio_unidad in productos_comprados:
+        subtotal = cantidad * precio_unidad
+        lineas.append(f"{id_producto:<20}{cantidad:>7}{precio_unidad:>10.2f}{subtotal:>10.2f}")
+    lineas.append("-" * 45)
+    lineas.append(f"{'TOTAL COMPRA:':<20}{total_compra:>25.2f}")
+    return "\n".join(lineas) + "\n"
+
 async def obtener_detalle_compra(session: AsyncSession, id_compra: int):
     """
     Retorna la información de una compra (encabezado y detalles de productos).
@@ -512,25 +1304,37 @@ async def obtener_detalle_compra(session: AsyncSession, id_compra: int):
     total = sum(detalle.cantidad * detalle.precio_unidad for detalle, _ in detalles)
 
     return {"compra": compra, "detalles": detalles, "total": total}
-async def obtener_todas_compras(session: AsyncSession):
-    result = await session.execute(select(Compra))
-    compras = result.scalars().all()
-
-    datos = []
-    for c in compras:
-        proveedor = await session.get(Proveedor, c.nit)
-        detalles = await session.execute(select(Detalle_Compra).where(Detalle_Compra.id_compra == c.id_compra))
-        detalles_lista = detalles.scalars().all()
-
-        total = sum(d.cantidad * d.precio_unidad for d in detalles_lista)
-
-        datos.append({
-            "id_compra": c.id_compra,
-            "fecha": c.fecha,
-            "proveedor_nombre": proveedor.nombre if proveedor else "Desconocido",
-            "total": total
-        })
-    return datos
+async def obtener_compras_paginadas(
+    session: AsyncSession,
+    page: int = 1,
+    page_size: int = 20,
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None
+):
+    """
+    Historial de compras (más recientes primero) con proveedor y total en una sola consulta agregada.
+    Devuelve (compras, total).
+    """
+    total_compra = func.coalesce(func.sum(Detalle_Compra.cantidad * Detalle_Compra.precio_unidad), 0.0)
+    stmt = (
+        select(
+            Compra.id_compra,
+            Compra.fecha,
+            func.coalesce(Proveedor.nombre, "Desconocido").label("proveedor_nombre"),
+            total_compra.label("total")
+        )
+        .outerjoin(Proveedor, Compra.nit == Proveedor.nit)
+        .outerjoin(Detalle_Compra, Detalle_Compra.id_compra == Compra.id_compra)
+        .group_by(Compra.id_compra, Compra.fecha, Proveedor.nombre)
+    )
+    stmt = _filtrar_por_fecha(stmt, Compra.fecha, desde, hasta)
+    stmt = stmt.order_by(Compra.fecha.desc(), Compra.id_compra.desc()).offset((page - 1) * page_size).limit(page_size)
+    result = await session.execute(stmt)
+    datos = [dict(fila._mapping) for fila in result.all()]
+
+    total_stmt = _filtrar_por_fecha(select(func.count()).select_from(Compra), Compra.fecha, desde, hasta)
+    total = (await session.execute(total_stmt)).scalar_one()
+    return datos, total
 
 async def obtener_detalles_por_compra(session: AsyncSession, id_compra: int) -> List[Detalle_Compra]:
     result = await session.execute(select(Detalle_Compra).where(Detalle_Compra.id_compra == id_compra))
@@ -4,9 +4,15 @@ document.addEventListener("DOMContentLoaded", () => {
   const abrirModal = document.getElementById("abrirModalCliente");
   const cerrarModal = document.getElementById("cerrarModalCliente");
   const clientesBody = document.getElementById("clientesBody");
+  const buscarInput = document.getElementById("buscarCliente");
+  const cargarMas = document.getElementById("cargarMasClientes");
 
   let modoEdicion = false;
   let clienteEditandoId = null;
+  let clienteEditandoVersion = null; // versión leída al abrir el modal (concurrencia optimista)
+  // La primera página viene renderizada por el servidor; las siguientes se piden con el cursor
+  let siguienteCursor = cargarMas.dataset.cursor || null;
+  let temporizadorBusqueda = null;
 
   // === Abrir modal (para nuevo cliente) ===
   abrirModal.addEventListener("click", () => {
@@ -47,6 +53,9 @@ document.addEventListener("DOMContentLoaded", () => {
       telefono: formData.get("telefono").trim(),
       email: formData.get("email").trim().toLowerCase()
     });
+    if (modoEdicion && clienteEditandoVersion !== null) {
+      data.append("version", clienteEditandoVersion);
+    }
 
     const url = modoEdicion
       ? `/clientes/${clienteEditandoId}`
@@ -67,6 +76,17 @@ document.addEventListener("DOMContentLoaded", () => {
         modoEdicion = false;
         clienteEditandoId = null;
         cargarClientes();
+      } else if (res.status === 409) {
+        // Otra persona editó el cliente: se muestran sus datos actuales para revisar y volver a guardar
+        const err = await res.json();
+        alert("⚠️ " + err.detail);
+        if (err.actual) {
+          clienteEditandoVersion = err.actual.version;
+          form.nombre.value = err.actual.nombre;
+          form.telefono.value = err.actual.telefono;
+          form.email.value = err.actual.email;
+        }
+        cargarClientes();
       } else {
         const err = await res.json();
         alert("⚠️ " + (err.detail || "Error en la operación"));
@@ -110,6 +130,7 @@ document.addEventListener("DOMContentLoaded", () => {
         // Rellenar modal
         modoEdicion = true;
         clienteEditandoId = cliente.id_cliente;
+        clienteEditandoVersion = cliente.version;
         form.querySelector("h2")?.remove();
         const h2 = document.createElement("h2");
         h2.textContent = "Editar Cliente";
@@ -127,23 +148,39 @@ document.addEventListener("DOMContentLoaded", () => {
     }
   });
 
-  // === Cargar clientes ===
-  async function cargarClientes() {
+  // === Buscar (espera a que se deje de escribir) ===
+  buscarInput.addEventListener("input", () => {
+    clearTimeout(temporizadorBusqueda);
+    temporizadorBusqueda = setTimeout(() => cargarClientes(), 300);
+  });
+
+  // === Siguiente página ===
+  cargarMas.addEventListener("click", () => cargarClientes(siguienteCursor));
+
+  // === Cargar clientes (sin cursor: primera página, reemplaza la tabla) ===
+  async function cargarClientes(cursor = null) {
+    const params = new URLSearchParams();
+    const buscar = buscarInput.value.trim();
+    if (buscar) params.set("buscar", buscar);
+    if (cursor) params.set("cursor", cursor);
+
     try {
-      const res = await fetch("/clientes/");
+      const res = await fetch(`/clientes/?${params}`);
       if (!res.ok) throw await res.json();
       const data = await res.json();
-      renderClientes(data.clientes);
+      renderClientes(data.clientes, Boolean(cursor));
+      siguienteCursor = data.next_cursor;
+      cargarMas.style.display = siguienteCursor ? "" : "none";
     } catch (err) {
       console.error(err);
       alert("❌ Error al cargar los clientes");
     }
   }
 
-  // === Renderizar tabla ===
-  function renderClientes(clientes) {
-    clientesBody.innerHTML = "";
-    if (!clientes.length) {
+  // === Renderizar tabla (agregar=true añade las filas al final) ===
+  function renderClientes(clientes, agregar = false) {
+    if (!agregar) clientesBody.innerHTML = "";
+    if (!clientes.length && !agregar) {
       clientesBody.innerHTML = `<tr><td colspan="5" style="text-align:center">No hay clientes</td></tr>`;
       return;
     }
@@ -44,6 +44,8 @@ document.addEventListener("DOMContentLoaded", () => {
       e.preventDefault();
 
       const formData = new FormData(form);
+      // Sin stock mínimo el servidor usa el de la categoría
+      if (!formData.get("stock_minimo")) formData.delete("stock_minimo");
       const body = new URLSearchParams(formData);
 
       try {
@@ -214,6 +216,23 @@ setTimeout(() => {
   mostrarAlertasStock();
 }, 300);
 
+// ============================
+//   ALERTAS EN VIVO (SSE)
+// ============================
+// El servidor avisa cuando una venta deja un producto bajo su stock mínimo;
+// solo se recarga la página actual de la tabla, no el catálogo completo.
+if (window.EventSource) {
+  const alertasStream = new EventSource("/alertas/stock/stream");
+
+  alertasStream.addEventListener("stock_bajo", (e) => {
+    const p = JSON.parse(e.data);
+    alert(`⚠️ El producto "${p.nombre}" quedó con ${p.stock} unidades (mínimo ${p.stock_minimo}).`);
+    obtenerPagina(currentPage);
+  });
+
+  window.addEventListener("beforeunload", () => alertasStream.close());
+}
+
 
   // ============================
   //    CARGAR PRIMERA PAGINA